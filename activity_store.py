@@ -0,0 +1,211 @@
+# activity_store.py
+# Monthly range partitions, indexes and retention for user_activity
+
+import os
+import logging
+from datetime import date, datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Partitions are created this many months ahead of the current one
+ACTIVITY_PARTITIONS_AHEAD = int(os.environ.get('ACTIVITY_PARTITIONS_AHEAD', 3))
+# Months of activity kept; older partitions are dropped (or detached)
+ACTIVITY_RETENTION_MONTHS = int(os.environ.get('ACTIVITY_RETENTION_MONTHS', 12))
+# 'drop' deletes expired partitions, 'detach' keeps them as standalone
+# user_activity_archive_YYYYMM tables for offline archiving
+ACTIVITY_RETENTION_MODE = os.environ.get('ACTIVITY_RETENTION_MODE', 'drop')
+
+# Arbitrary key so only one instance runs maintenance at a time
+MAINTENANCE_LOCK_KEY = 0x44415458  # 'DATX'
+
+# Catches rows no monthly partition covers (clock skew, maintenance not
+# running), so inserts never fail; maintenance warns while it holds any
+DEFAULT_PARTITION = 'user_activity_default'
+
+ACTIVITY_INDEXES = """
+    CREATE INDEX IF NOT EXISTS user_activity_telegram_id_ts_idx
+        ON user_activity (telegram_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS user_activity_ts_idx
+        ON user_activity (timestamp);
+    CREATE INDEX IF NOT EXISTS user_activity_type_ts_idx
+        ON user_activity (activity_type, timestamp);
+"""
+
+
+def _this_month():
+    # Partition bounds are UTC month starts
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"user_activity_p{month.year:04d}{month.month:02d}"
+
+
+def _create_partition(cur, month):
+    name = partition_name(month)
+    if _relkind(cur, name):
+        return
+    start = f"{month.isoformat()} 00:00:00+00"
+    end = f"{_add_months(month, 1).isoformat()} 00:00:00+00"
+
+    # The new range may not overlap rows already in the default partition;
+    # move them out and back in once the partition exists
+    moved = 0
+    has_default = _relkind(cur, DEFAULT_PARTITION) is not None
+    if has_default:
+        cur.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"""
+            CREATE TEMP TABLE user_activity_moving ON COMMIT DROP AS
+            SELECT * FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= %s AND timestamp < %s
+        """, (start, end))
+        moved = cur.rowcount
+        if moved:
+            cur.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s",
+                        (start, end))
+
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name}
+        PARTITION OF user_activity
+        FOR VALUES FROM ('{start}') TO ('{end}')
+    """)
+
+    if has_default:
+        if moved:
+            cur.execute("INSERT INTO user_activity SELECT * FROM user_activity_moving")
+            logger.info(f"✅ Moved {moved} activity rows from {DEFAULT_PARTITION} into {name}")
+        cur.execute("DROP TABLE user_activity_moving")
+
+
+def _relkind(cur, table):
+    cur.execute("""
+        SELECT c.relkind FROM pg_class c
+        WHERE c.oid = to_regclass(%s)
+    """, (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _create_partitioned_table(cur):
+    cur.execute("""
+        CREATE TABLE user_activity (
+            id BIGSERIAL,
+            telegram_id BIGINT,
+            activity_type TEXT,
+            activity_data TEXT,
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+
+
+def _convert_legacy_table(cur):
+    """Move rows of an unpartitioned user_activity into the partitioned layout"""
+    logger.info("🔄 Converting user_activity to monthly partitions...")
+    cur.execute("LOCK TABLE user_activity IN ACCESS EXCLUSIVE MODE")
+    cur.execute("ALTER TABLE user_activity RENAME TO user_activity_legacy")
+    cur.execute("""
+        ALTER TABLE user_activity_legacy
+        RENAME CONSTRAINT user_activity_pkey TO user_activity_legacy_pkey
+    """)
+    cur.execute("SELECT MIN(timestamp), MAX(id) FROM user_activity_legacy")
+    oldest, max_id = cur.fetchone()
+
+    _create_partitioned_table(cur)
+    first = oldest.astimezone(timezone.utc).date().replace(day=1) if oldest else _this_month()
+    ensure_partitions(cur, first=first)
+
+    cur.execute("""
+        INSERT INTO user_activity (id, telegram_id, activity_type, activity_data, timestamp)
+        SELECT id, telegram_id, activity_type, activity_data, COALESCE(timestamp, NOW())
+        FROM user_activity_legacy
+    """)
+    moved = cur.rowcount
+    if max_id is not None:
+        cur.execute("SELECT setval(pg_get_serial_sequence('user_activity', 'id'), %s)", (max_id,))
+    cur.execute("DROP TABLE user_activity_legacy")
+    logger.info(f"✅ Moved {moved} activity rows into partitions")
+
+
+def install_activity_store(cur):
+    """Create (or convert to) the partitioned user_activity table"""
+    kind = _relkind(cur, 'user_activity')
+    if kind is None:
+        _create_partitioned_table(cur)
+    elif kind == 'r':
+        _convert_legacy_table(cur)
+    ensure_partitions(cur)
+    cur.execute(ACTIVITY_INDEXES)
+
+
+def install_default_partition(cur):
+    """Add the DEFAULT partition to user_activity"""
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF user_activity DEFAULT")
+
+
+def ensure_partitions(cur, first=None, ahead=ACTIVITY_PARTITIONS_AHEAD):
+    """Create monthly partitions from ``first`` (default: this month) to ``ahead`` months out"""
+    this_month = _this_month()
+    month = first or this_month
+    last = _add_months(this_month, ahead)
+    while month <= last:
+        _create_partition(cur, month)
+        month = _add_months(month, 1)
+
+
+def list_partitions(cur):
+    """(name, first day of month) of every monthly partition, oldest first"""
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'user_activity'::regclass
+    """)
+    partitions = []
+    for (name,) in cur.fetchall():
+        suffix = name[len('user_activity_p'):]
+        if name.startswith('user_activity_p') and len(suffix) == 6 and suffix.isdigit():
+            partitions.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def apply_retention(cur, months=ACTIVITY_RETENTION_MONTHS, mode=ACTIVITY_RETENTION_MODE):
+    """Drop or detach whole partitions older than the retention window"""
+    cutoff = _add_months(_this_month(), -months)
+    removed = []
+    for name, month in list_partitions(cur):
+        if month >= cutoff:
+            break
+        cur.execute(f"ALTER TABLE user_activity DETACH PARTITION {name}")
+        if mode == 'detach':
+            archive = name.replace('user_activity_p', 'user_activity_archive_')
+            cur.execute(f"ALTER TABLE {name} RENAME TO {archive}")
+        else:
+            cur.execute(f"DROP TABLE {name}")
+        removed.append(name)
+    if removed:
+        logger.info(f"✅ Activity retention ({mode}): {', '.join(removed)}")
+    return removed
+
+
+def count_default_rows(cur):
+    """Rows in the default partition, i.e. outside every monthly partition"""
+    if not _relkind(cur, DEFAULT_PARTITION):
+        return 0
+    cur.execute(f"SELECT COUNT(*) FROM {DEFAULT_PARTITION}")
+    return cur.fetchone()[0]
+
+
+def run_maintenance(cur):
+    """Create upcoming partitions and expire old ones; False if another instance holds the lock"""
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (MAINTENANCE_LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        return False
+    ensure_partitions(cur)
+    apply_retention(cur)
+    return True
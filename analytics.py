@@ -0,0 +1,176 @@
+# analytics.py
+# Hourly/daily activity rollups behind /api/datrix_analytics
+
+import os
+from collections import Counter
+from datetime import timezone
+
+from psycopg2.extras import execute_values
+
+# Hourly rollup rows older than this are dropped by the maintenance job; the
+# hourly series go back at most 7 days, daily rows are kept
+ANALYTICS_HOURLY_RETENTION_DAYS = int(os.environ.get('ANALYTICS_HOURLY_RETENTION_DAYS', 14))
+
+ANALYTICS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS activity_rollup_hourly (
+        bucket TIMESTAMP NOT NULL,          -- UTC hour
+        activity_type TEXT NOT NULL,
+        events BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, activity_type)
+    );
+
+    CREATE TABLE IF NOT EXISTS activity_rollup_daily (
+        day DATE NOT NULL,                  -- UTC day
+        activity_type TEXT NOT NULL,
+        events BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, activity_type)
+    );
+"""
+
+# range -> (window, allowed granularities)
+ANALYTICS_RANGES = {
+    '24h': ('24 hours', ('hour',)),
+    '7d': ('7 days', ('hour', 'day')),
+    '30d': ('30 days', ('day',)),
+    '90d': ('90 days', ('day',)),
+}
+
+
+def install_analytics_schema(cur):
+    cur.execute(ANALYTICS_SCHEMA)
+
+
+def record_rollups(cur, rows):
+    """Add a batch of new user_activity rows to the rollups.
+
+    ``rows`` are (telegram_id, activity_type, activity_data, timestamp)
+    tuples; call inside the transaction that inserts them.
+    """
+    hourly = Counter()
+    daily = Counter()
+    for _, activity_type, _, timestamp in rows:
+        utc = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        activity_type = activity_type or 'unknown'
+        hourly[(utc.replace(minute=0, second=0, microsecond=0), activity_type)] += 1
+        daily[(utc.date(), activity_type)] += 1
+
+    if not hourly:
+        return
+    execute_values(cur, """
+        INSERT INTO activity_rollup_hourly (bucket, activity_type, events)
+        VALUES %s
+        ON CONFLICT (bucket, activity_type)
+        DO UPDATE SET events = activity_rollup_hourly.events + EXCLUDED.events
+    """, [(bucket, activity_type, n) for (bucket, activity_type), n in sorted(hourly.items())])
+    execute_values(cur, """
+        INSERT INTO activity_rollup_daily (day, activity_type, events)
+        VALUES %s
+        ON CONFLICT (day, activity_type)
+        DO UPDATE SET events = activity_rollup_daily.events + EXCLUDED.events
+    """, [(day, activity_type, n) for (day, activity_type), n in sorted(daily.items())])
+
+
+def rebuild_rollups(cur, since):
+    """Recompute both rollups from raw user_activity for days >= ``since`` (a date)"""
+    cur.execute("DELETE FROM activity_rollup_hourly WHERE bucket >= %s", (since,))
+    cur.execute("DELETE FROM activity_rollup_daily WHERE day >= %s", (since,))
+    cur.execute("""
+        INSERT INTO activity_rollup_hourly (bucket, activity_type, events)
+        SELECT date_trunc('hour', timestamp AT TIME ZONE 'UTC'),
+               COALESCE(activity_type, 'unknown'), COUNT(*)
+        FROM user_activity
+        WHERE timestamp >= (%s::date)::timestamp AT TIME ZONE 'UTC'
+        GROUP BY 1, 2
+    """, (since,))
+    cur.execute("""
+        INSERT INTO activity_rollup_daily (day, activity_type, events)
+        SELECT bucket::date, activity_type, SUM(events)
+        FROM activity_rollup_hourly
+        WHERE bucket >= %s
+        GROUP BY 1, 2
+    """, (since,))
+
+
+def prune_rollups(cur, days=ANALYTICS_HOURLY_RETENTION_DAYS):
+    """Drop hourly rollup rows older than ``days`` (at least the 7 day hourly range)"""
+    cur.execute("""
+        DELETE FROM activity_rollup_hourly
+        WHERE bucket < date_trunc('hour', NOW() AT TIME ZONE 'UTC') - make_interval(days => %s)
+    """, (max(days, 8),))
+    return cur.rowcount
+
+
+def read_today_stats(cur):
+    """Figures for the dashboard's overview cards in one query"""
+    cur.execute("""
+        SELECT
+            s.total_users,
+            (SELECT COALESCE(SUM(users), 0) FROM datrix_stats_seen
+             WHERE bucket >= date_trunc('minute', (NOW() AT TIME ZONE 'UTC') - INTERVAL '24 hours')),
+            (SELECT COALESCE(SUM(users), 0) FROM datrix_stats_seen
+             WHERE bucket >= date_trunc('minute', (NOW() AT TIME ZONE 'UTC') - INTERVAL '7 days')),
+            s.total_downloads,
+            (SELECT COALESCE(SUM(events), 0) FROM activity_rollup_daily
+             WHERE day = (NOW() AT TIME ZONE 'UTC')::date AND activity_type = 'request_license'),
+            (SELECT COALESCE(SUM(events), 0) FROM activity_rollup_daily
+             WHERE day = (NOW() AT TIME ZONE 'UTC')::date AND activity_type = 'download')
+        FROM datrix_stats_totals s
+    """)
+    row = cur.fetchone() or (0, 0, 0, 0, 0, 0)
+    return {
+        'total_users': int(row[0]),
+        'active_users_24h': int(row[1]),
+        'active_users_7d': int(row[2]),
+        'downloads_all_time': int(row[3]),
+        'license_requests': int(row[4]),
+        'downloads_today': int(row[5])
+    }
+
+
+def read_series(cur, range_name='7d', granularity=None):
+    """Events per bucket and activity type over a range (UTC buckets, gaps filled)"""
+    if range_name not in ANALYTICS_RANGES:
+        raise ValueError(f"range must be one of {', '.join(ANALYTICS_RANGES)}")
+    window, granularities = ANALYTICS_RANGES[range_name]
+    granularity = granularity or granularities[-1]
+    if granularity not in granularities:
+        raise ValueError(f"granularity for {range_name} must be one of {', '.join(granularities)}")
+
+    if granularity == 'hour':
+        cur.execute(f"""
+            SELECT b.bucket, r.activity_type, r.events
+            FROM generate_series(
+                date_trunc('hour', (NOW() AT TIME ZONE 'UTC') - INTERVAL '{window}') + INTERVAL '1 hour',
+                date_trunc('hour', NOW() AT TIME ZONE 'UTC'),
+                INTERVAL '1 hour'
+            ) AS b(bucket)
+            LEFT JOIN activity_rollup_hourly r ON r.bucket = b.bucket
+            ORDER BY b.bucket
+        """)
+    else:
+        cur.execute(f"""
+            SELECT b.bucket::date, r.activity_type, r.events
+            FROM generate_series(
+                (NOW() AT TIME ZONE 'UTC')::date - INTERVAL '{window}' + INTERVAL '1 day',
+                (NOW() AT TIME ZONE 'UTC')::date,
+                INTERVAL '1 day'
+            ) AS b(bucket)
+            LEFT JOIN activity_rollup_daily r ON r.day = b.bucket::date
+            ORDER BY b.bucket
+        """)
+
+    series = []
+    totals = Counter()
+    for bucket, activity_type, events in cur.fetchall():
+        if not series or series[-1]['bucket'] != bucket.isoformat():
+            series.append({'bucket': bucket.isoformat(), 'counts': {}})
+        if activity_type is not None:
+            series[-1]['counts'][activity_type] = int(events)
+            totals[activity_type] += int(events)
+
+    return {
+        'range': range_name,
+        'granularity': granularity,
+        'series': series,
+        'totals': dict(totals)
+    }
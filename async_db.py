@@ -0,0 +1,78 @@
+# async_db.py
+# Non-blocking access to database.py for the async Telegram handlers
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import database as db
+from db_pool import DB_POOL_MAX
+
+# One worker per pooled connection: queries queue here instead of
+# blocking worker threads on an exhausted pool
+DB_EXECUTOR_WORKERS = int(os.environ.get('DB_EXECUTOR_WORKERS', DB_POOL_MAX))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Return this process's executor (threads do not survive fork)"""
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=DB_EXECUTOR_WORKERS,
+                    thread_name_prefix='datrix-db'
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def run_sync(fn, *args, **kwargs):
+    """Run a blocking database call on the executor and await its result"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+
+
+def _async(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_sync(fn, *args, **kwargs)
+    return wrapper
+
+
+# Mirrors of the database.py API
+add_or_update_user = _async(db.add_or_update_user)
+update_user_company = _async(db.update_user_company)
+get_user_info = _async(db.get_user_info)
+extend_user_license = _async(db.extend_user_license)
+track_download = _async(db.track_download)
+get_active_release = _async(db.get_active_release)
+expect_release_upload = _async(db.expect_release_upload)
+get_pending_upload = _async(db.get_pending_upload)
+publish_release = _async(db.publish_release)
+get_all_datrix_users = _async(db.get_all_datrix_users)
+get_basic_stats = _async(db.get_basic_stats)
+log_user_activity = _async(db.log_user_activity)
+run_database_maintenance = _async(db.run_database_maintenance)
+sweep_license_expiry = _async(db.sweep_license_expiry)
+queue_messages = _async(db.queue_messages)
+claim_outbound_messages = _async(db.claim_outbound_messages)
+complete_outbound_message = _async(db.complete_outbound_message)
+retry_outbound_message = _async(db.retry_outbound_message)
+
+
+async def shutdown():
+    """Wait for in-flight queries, then release the executor and the pool"""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None and _executor_pid == os.getpid():
+        await asyncio.get_running_loop().run_in_executor(
+            None, partial(executor.shutdown, wait=True)
+        )
+    db.shutdown()
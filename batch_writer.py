@@ -0,0 +1,218 @@
+# batch_writer.py
+# Write-behind batching for telemetry that must stay off the request path
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+from db_pool import get_db_connection
+from analytics import record_rollups
+
+logger = logging.getLogger(__name__)
+
+# Activity writer configuration
+ACTIVITY_BATCH_SIZE = int(os.environ.get('ACTIVITY_BATCH_SIZE', 500))
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', 2.0))
+ACTIVITY_BUFFER_MAX = int(os.environ.get('ACTIVITY_BUFFER_MAX', 10000))
+
+
+class BatchWriter:
+    """Base class for buffers flushed by a background thread.
+
+    A flush happens when ``batch_size`` items are pending or every
+    ``flush_interval`` seconds, whichever comes first, and once more on
+    ``close()``. The thread is started lazily in each process; a forked
+    child drops whatever its parent had buffered (the parent writes it).
+    Subclasses implement ``_pending()``, ``_drain()``, ``_write()`` and
+    ``_restore()``; all buffer access happens under ``self._cond``.
+    """
+
+    name = 'batch'
+
+    def __init__(self, flush_interval, batch_size):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = os.getpid()
+        self._stopping = False
+        self._atexit_pid = None
+        self._counters = {'flushes': 0, 'failed_flushes': 0}
+
+    # ---------- subclass hooks ----------
+
+    def _pending(self):
+        raise NotImplementedError
+
+    def _drain(self):
+        raise NotImplementedError
+
+    def _write(self, items):
+        raise NotImplementedError
+
+    def _restore(self, items):
+        """Put back items whose write failed"""
+        raise NotImplementedError
+
+    def _reset_buffer(self):
+        raise NotImplementedError
+
+    # ---------- thread management ----------
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+        if self._thread is None and not self._stopping:
+            with self._cond:
+                if self._thread is None and not self._stopping:
+                    self._thread = threading.Thread(
+                        target=self._run, name=f'datrix-{self.name}-writer', daemon=True
+                    )
+                    self._thread.start()
+                    if self._atexit_pid != os.getpid():
+                        atexit.register(self.close)
+                        self._atexit_pid = os.getpid()
+
+    def _after_fork(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._counters = dict.fromkeys(self._counters, 0)
+        self._reset_buffer()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and self._pending() < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            if not self.flush():
+                # Back off instead of spinning on a full buffer while the DB is down
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(self.flush_interval)
+
+    def _wake(self):
+        """Call with ``self._cond`` held when a full batch is pending"""
+        self._cond.notify()
+
+    # ---------- public API ----------
+
+    def flush(self):
+        """Write everything currently buffered; returns False on failure"""
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    items = self._drain()
+                if not items:
+                    return True
+                try:
+                    self._write(items)
+                except Exception as e:
+                    logger.error(f"Error flushing {self.name} batch: {e}")
+                    with self._cond:
+                        self._counters['failed_flushes'] += 1
+                        self._restore(items)
+                    return False
+                with self._cond:
+                    self._counters['flushes'] += 1
+
+    def close(self, timeout=10):
+        """Stop the background thread and flush what is left"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
+        with self._cond:
+            # Allow reuse after an explicit close (e.g. tests, restarts)
+            self._stopping = False
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['pending'] = self._pending()
+        return stats
+
+
+class ActivityWriter(BatchWriter):
+    """Buffers user_activity rows and inserts them with multi-row INSERTs.
+
+    The buffer is bounded by ``max_buffer``; events arriving while it is
+    full are dropped and counted rather than blocking the caller.
+    """
+
+    name = 'activity'
+
+    def __init__(self, flush_interval=ACTIVITY_FLUSH_INTERVAL,
+                 batch_size=ACTIVITY_BATCH_SIZE, max_buffer=ACTIVITY_BUFFER_MAX):
+        super().__init__(flush_interval, batch_size)
+        self.max_buffer = max_buffer
+        self._buffer = deque()
+        self._counters.update({'enqueued': 0, 'written': 0, 'dropped': 0})
+
+    def enqueue(self, telegram_id, activity_type, activity_data=""):
+        """Buffer one activity row; returns False if it had to be dropped"""
+        self._ensure_started()
+        row = (telegram_id, activity_type, activity_data, datetime.now(timezone.utc))
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                self._counters['dropped'] += 1
+                return False
+            self._buffer.append(row)
+            self._counters['enqueued'] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._wake()
+        return True
+
+    def _pending(self):
+        return len(self._buffer)
+
+    def _drain(self):
+        items = []
+        while self._buffer and len(items) < self.batch_size:
+            items.append(self._buffer.popleft())
+        return items
+
+    def _write(self, items):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO user_activity (telegram_id, activity_type, activity_data, timestamp)
+                VALUES %s
+            """, items, page_size=self.batch_size)
+            # Keep the analytics rollups in step with the raw rows
+            record_rollups(cur, items)
+            conn.commit()
+        with self._cond:
+            self._counters['written'] += len(items)
+
+    def _restore(self, items):
+        # Oldest events go back to the front; whatever no longer fits is lost
+        room = max(self.max_buffer - len(self._buffer), 0)
+        keep = items[:room]
+        self._counters['dropped'] += len(items) - len(keep)
+        self._buffer.extendleft(reversed(keep))
+
+    def _reset_buffer(self):
+        self._buffer = deque()
+
+
+activity_writer = ActivityWriter()
@@ -0,0 +1,287 @@
+# benchmark.py
+# Drives the real bot handlers against a local Postgres with a fake Bot API
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from collections import deque
+from datetime import date, timedelta
+
+from psycopg2.extras import execute_values
+from telegram import Update
+from telegram.request import BaseRequest
+
+import database as db
+import main
+from db_pool import get_db_connection, pool_stats
+from fake_telegram import make_update
+from outbound import outbound
+from presence import presence_tracker
+from query_log import query_stats
+
+COMMANDS = ('start', 'my_status', 'datrix_app', 'register_company', 'callback')
+# Seconds an update may take to get its reply before it counts as unanswered
+REPLY_TIMEOUT = 60
+
+
+class FakeBotRequest(BaseRequest):
+    """Bot API transport that answers every call locally.
+
+    ``latency`` (seconds) is added to each call to stand in for the round
+    trip to Telegram. ``expect_reply`` tells when the next message for a
+    chat reaches the transport.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+        self._waiters = {}
+
+    def expect_reply(self, chat_id):
+        """Future set to the perf_counter() at which the next message to ``chat_id`` arrives"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(str(chat_id), deque()).append(future)
+        return future
+
+    def _received(self, chat_id):
+        waiters = self._waiters.get(str(chat_id))
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(time.perf_counter())
+                return
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        if api_method.startswith(('send', 'edit')):
+            self._received(params.get('chat_id'))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return 200, json.dumps({'ok': True, 'result': self._result(api_method, params)}).encode()
+
+    def _result(self, api_method, params):
+        if api_method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'DATRIX', 'username': 'datrix_bench_bot',
+                    'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if api_method.startswith(('send', 'edit')):
+            chat_id = params.get('chat_id', 1)
+            message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                       'chat': {'id': chat_id, 'type': 'private'}}
+            if api_method == 'sendDocument':
+                message['document'] = {'file_id': str(params.get('document')), 'file_unique_id': 'bench'}
+            return message
+        return True
+
+
+def make_callback_update(update_id, admin_id, data):
+    """An admin pressing an inline button on the license request message"""
+    admin = {'id': admin_id, 'is_bot': False, 'first_name': 'Admin'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': admin,
+            'chat_instance': 'bench',
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': admin_id, 'type': 'private'},
+                'text': 'license request',
+            },
+        },
+    }
+
+
+def seed_users(first_user, count, licensed):
+    """Upsert ``count`` benchmark users; a ``licensed`` share of them with a valid license"""
+    licensed_until = date.today() + timedelta(days=30)
+    rows = [
+        (first_user + i, f'bench_{i}', f'Bench {i}', f'Bench Co {i % 100}', f'sheet_{i}',
+         licensed_until if i < count * licensed else None)
+        for i in range(count)
+    ]
+    with get_db_connection() as conn, conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO datrix_users (telegram_id, user_name, first_name, company_name, google_sheet_id,
+                                      license_expires)
+            VALUES %s
+            ON CONFLICT (telegram_id) DO UPDATE SET company_name = EXCLUDED.company_name,
+                google_sheet_id = EXCLUDED.google_sheet_id, license_expires = EXCLUDED.license_expires
+        """, rows, page_size=1000)
+        conn.commit()
+
+
+def delete_users(first_user, count):
+    """Remove the benchmark users and their activity"""
+    with get_db_connection() as conn, conn.cursor() as cur:
+        for table in ('user_activity', 'datrix_users'):
+            cur.execute(f"DELETE FROM {table} WHERE telegram_id >= %s AND telegram_id < %s",
+                        (first_user, first_user + count))
+        conn.commit()
+
+
+def build_update(command, update_id, user_id, admin_id):
+    if command == 'callback':
+        return make_callback_update(update_id, admin_id, f"extend_30:{user_id}")
+    if command == 'register_company':
+        return make_update(update_id, user_id, f'/register_company "Bench Co" sheet_{user_id}')
+    return make_update(update_id, user_id, f'/{command}')
+
+
+def total_statements():
+    return sum(entry['statements'] for entry in query_stats.snapshot().values())
+
+
+def flush_writers():
+    """Write buffered activity and presence so their statements are counted"""
+    db.flush_activity()
+    presence_tracker.flush()
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run_command(application, fake, command, args, update_ids):
+    """Run ``args.ops`` updates of one command, ``args.concurrency`` at a time.
+
+    An update's latency runs until its reply (the admin's edited message
+    for callbacks) reaches the fake Bot API, through the outbound scheduler.
+    """
+    admin_id = int(main.ADMIN_CHAT_ID)
+    users = itertools.cycle(range(args.first_user, args.first_user + args.users))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    unanswered = 0
+
+    async def one(user_id):
+        nonlocal unanswered
+        update = Update.de_json(build_update(command, next(update_ids), user_id, admin_id), application.bot)
+        async with semaphore:
+            replied = fake.expect_reply(admin_id if command == 'callback' else user_id)
+            started = time.perf_counter()
+            # Through the update processor, as polling and webhook updates are
+            await application.update_processor.process_update(update, application.process_update(update))
+            try:
+                latencies.append(await asyncio.wait_for(replied, REPLY_TIMEOUT) - started)
+            except asyncio.TimeoutError:
+                unanswered += 1
+
+    flush_writers()
+    statements, checkouts = total_statements(), pool_stats().get('checkouts', 0)
+    api_calls = sum(fake.calls.values())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(next(users)) for _ in range(args.ops)))
+    # Replies and notifications leave through the outbound scheduler
+    await outbound.drain(timeout=600)
+    elapsed = time.perf_counter() - started
+    await asyncio.to_thread(flush_writers)
+
+    latencies.sort()
+    if not latencies:
+        latencies.append(float('nan'))
+    return {
+        'command': command,
+        'ops': args.ops,
+        'unanswered': unanswered,
+        'ops_per_sec': args.ops / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'statements': (total_statements() - statements) / args.ops,
+        'checkouts': (pool_stats().get('checkouts', 0) - checkouts) / args.ops,
+        'api_calls': (sum(fake.calls.values()) - api_calls) / args.ops,
+    }
+
+
+async def run(args):
+    fake = FakeBotRequest(latency=args.api_latency / 1000)
+    application = main.build_application(request=fake)
+    await application.initialize()
+    # The real scheduler, with limits that suit a fake Bot API
+    outbound.start(application.bot, global_rate=args.send_rate, chat_rate=args.send_rate)
+    update_ids = itertools.count(1)
+    try:
+        results = []
+        for command in args.commands:
+            if args.warmup:
+                # Untimed pass: fills the user cache and opens pool connections
+                warmup = argparse.Namespace(**{**vars(args), 'ops': args.warmup})
+                await run_command(application, fake, command, warmup, update_ids)
+            results.append(await run_command(application, fake, command, args, update_ids))
+        return results
+    finally:
+        # Send what is still queued while the bot can, then shut down as
+        # the Application would (post_shutdown releases the DB executor)
+        await outbound.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
+def print_results(results, args):
+    print(f"{args.users} users, {args.ops} ops per command, concurrency {args.concurrency}, "
+          f"Bot API latency {args.api_latency:g}ms")
+    print(f"{'command':<18}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'stmts/op':>10}{'conns/op':>10}{'api/op':>8}")
+    for r in results:
+        print(f"{r['command']:<18}{r['ops_per_sec']:>9.0f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['statements']:>10.2f}{r['checkouts']:>10.2f}{r['api_calls']:>8.2f}")
+        if r['unanswered']:
+            print(f"  ⚠️ {r['unanswered']} {r['command']} updates got no reply within {REPLY_TIMEOUT}s")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the bot handlers against a local Postgres')
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS, default=list(COMMANDS))
+    parser.add_argument('--users', type=int, default=1000, help='benchmark users to seed')
+    parser.add_argument('--licensed', type=float, default=0.8, help='share of seeded users with a license')
+    parser.add_argument('--ops', type=int, default=500, help='updates per command')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed updates per command first')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--send-rate', type=float, default=10000,
+                        help='outbound messages/second, globally and per chat (Telegram: 30 and 1)')
+    parser.add_argument('--api-latency', type=float, default=0, help='simulated Bot API latency (ms)')
+    parser.add_argument('--first-user', type=int, default=8000000000,
+                        help='telegram_id of the first benchmark user')
+    parser.add_argument('--keep', action='store_true', help='leave the benchmark users in the database')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args(argv)
+    if 'DATABASE_URL' not in os.environ:
+        parser.error('set DATABASE_URL to a local (non-production) database')
+
+    db.initialize_simple_database()
+    seed_users(args.first_user, args.users, args.licensed)
+    if 'datrix_app' in args.commands and not db.get_active_release():
+        print("⚠️ No active release: /datrix_app measures the 'not available' reply")
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if not args.keep:
+            delete_users(args.first_user, args.users)
+        db.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results, args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,67 @@
+# bot_status.py
+# One shared, cached Telegram getMe probe for every dashboard
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# How long a probe result is served before Telegram is asked again
+BOT_STATUS_TTL = int(os.environ.get('BOT_STATUS_TTL', 60))
+BOT_STATUS_TIMEOUT = float(os.environ.get('BOT_STATUS_TIMEOUT', 5))
+# A forced refresh (the dashboard's "Test Connection") still reuses a result this fresh
+BOT_STATUS_MIN_INTERVAL = int(os.environ.get('BOT_STATUS_MIN_INTERVAL', 5))
+
+TELEGRAM_API = 'https://api.telegram.org'
+
+
+class BotStatusProbe:
+    """Calls getMe at most once per TTL per process, whatever the number
+    of dashboards polling; concurrent callers wait for the probe in flight.
+    """
+
+    def __init__(self, token, ttl=BOT_STATUS_TTL, timeout=BOT_STATUS_TIMEOUT):
+        self.token = token
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._status = None
+        self._checked = 0.0
+
+    def status(self, refresh=False):
+        max_age = BOT_STATUS_MIN_INTERVAL if refresh else self.ttl
+        if self._status is not None and time.monotonic() - self._checked < max_age:
+            return self._status
+        with self._lock:
+            # Another request may have probed while this one waited
+            if self._status is None or time.monotonic() - self._checked >= max_age:
+                self._status = self._probe()
+                self._checked = time.monotonic()
+            return self._status
+
+    def _probe(self):
+        status = {
+            'ok': False,
+            'username': None,
+            'error': None,
+            'checked_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }
+        try:
+            response = self._session.get(f"{TELEGRAM_API}/bot{self.token}/getMe", timeout=self.timeout)
+            data = response.json()
+            if data.get('ok'):
+                status['ok'] = True
+                status['username'] = data['result'].get('username')
+            else:
+                status['error'] = data.get('description', f"HTTP {response.status_code}")
+        except (requests.RequestException, ValueError) as e:
+            # The exception text can contain the URL, and with it the token
+            status['error'] = type(e).__name__
+            logger.error(f"Error probing bot status: {type(e).__name__}")
+        return status
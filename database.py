@@ -1,178 +1,112 @@
 # database.py
 # Clean DATRIX Database (Fixed - No first_name column)
 
-import os
-import psycopg2
+import json
+import base64
 import logging
 from datetime import datetime, timedelta
+from db_pool import get_db_connection, pool_stats, close_pool
+from metrics import ACTIVITY_DEFAULT_ROWS, timed_query
+from query_log import query_stats
+from batch_writer import activity_writer
+from presence import presence_tracker
+from user_cache import user_cache, notify_user_changed, notify_users_changed, notify_all_users_changed
+from migrations import LATEST_VERSION, migrate
+from events import publish_event
+from releases import (release_registry, read_active_release, read_releases, insert_release, activate_release,
+                      count_release_download, set_pending_upload, read_pending_upload, clear_pending_upload)
+from activity_store import run_maintenance, count_default_rows
+from license_expiry import expire_licenses, claim_expiry_reminders
+from outbound_store import (PRIORITY_BULK, insert_outbound, claim_outbound, delete_outbound, reschedule_outbound,
+                            prune_outbound, read_outbound_stats)
+from analytics import read_today_stats, read_series, rebuild_rollups, prune_rollups
+from stats import EMPTY_STATS, read_stats, count_stats, reconcile_stats, prune_stats
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    try:
-        return psycopg2.connect(os.environ['DATABASE_URL'])
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        return None
-
-def fix_database_schema():
-    """Fix missing columns in existing database"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
-    try:
-        with conn.cursor() as cur:
-            # Check if first_name column exists
-            cur.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'datrix_users' AND column_name = 'first_name'
-            """)
-            
-            if not cur.fetchone():
-                # Add first_name column if it doesn't exist
-                cur.execute("ALTER TABLE datrix_users ADD COLUMN first_name TEXT")
-                logger.info("✅ Added first_name column")
-            
-            # Check other missing columns
-            missing_columns = [
-                ('license_status', 'TEXT DEFAULT \'active\''),
-                ('app_version', 'TEXT'),
-            ]
-            
-            for col_name, col_def in missing_columns:
-                cur.execute(f"""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'datrix_users' AND column_name = '{col_name}'
-                """)
-                
-                if not cur.fetchone():
-                    cur.execute(f"ALTER TABLE datrix_users ADD COLUMN {col_name} {col_def}")
-                    logger.info(f"✅ Added {col_name} column")
-            
-            conn.commit()
-            logger.info("✅ Database schema fixed successfully")
-            return True
-            
-    except Exception as e:
-        logger.error(f"Error fixing database schema: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
-
+@timed_query
 def initialize_simple_database():
-    """Initialize database and fix schema issues"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
+    """Bring the schema up to date (see migrations.py)"""
     try:
-        with conn.cursor() as cur:
-            # Create table with all columns
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS datrix_users (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    user_name TEXT,
-                    first_name TEXT,
-                    company_name TEXT,
-                    google_sheet_id TEXT,
-                    license_expires DATE,
-                    license_status TEXT DEFAULT 'active',
-                    app_version TEXT,
-                    download_count INTEGER DEFAULT 0,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            # Create activity table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS user_activity (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT,
-                    activity_type TEXT,
-                    activity_data TEXT,
-                    timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-            """)
-            
-            conn.commit()
-            logger.info("✅ Database tables created/updated")
-            
-        # Fix any missing columns in existing database
-        fix_database_schema()
-        
+        applied = migrate()
+        if not applied:
+            logger.info(f"✅ Database schema up to date (version {LATEST_VERSION})")
+        # Partitions for this month onwards even before the bot's job first runs
+        run_database_maintenance()
         return True
         
     except Exception as e:
         logger.error(f"Database init failed: {e}")
         return False
-    finally:
-        conn.close()
 
+@timed_query
 def add_or_update_user(telegram_id, user_name, first_name=None):
-    """Add or update user - no first_name column"""
-    conn = get_db_connection()
-    if not conn:
-        return False
+    """Add or update user - no first_name column
+
+    Only new users are written immediately; name and last_seen changes of
+    existing users are coalesced by the presence tracker.
+    """
+    # Use first_name as user_name if user_name is empty
+    display_name = user_name or first_name or f"User_{telegram_id}"
+
+    if presence_tracker.is_known(telegram_id):
+        presence_tracker.touch(telegram_id, display_name)
+        return True
         
     try:
-        with conn.cursor() as cur:
-            # Use first_name as user_name if user_name is empty
-            display_name = user_name or first_name or f"User_{telegram_id}"
-            
+        with get_db_connection() as conn, conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO datrix_users (telegram_id, user_name, last_seen)
                 VALUES (%s, %s, NOW())
-                ON CONFLICT (telegram_id) 
-                DO UPDATE SET 
-                    user_name = EXCLUDED.user_name,
-                    last_seen = NOW()
+                ON CONFLICT (telegram_id) DO NOTHING
+                RETURNING telegram_id
             """, (telegram_id, display_name))
+            inserted = cur.fetchone() is not None
+            if inserted:
+                publish_event(cur, 'user_created', telegram_id=telegram_id)
             
             conn.commit()
-            return True
     except Exception as e:
         logger.error(f"Error adding user: {e}")
         return False
-    finally:
-        conn.close()
 
+    if inserted:
+        presence_tracker.mark_written(telegram_id, display_name)
+    else:
+        presence_tracker.touch(telegram_id, display_name)
+    return True
+
+@timed_query
 def update_user_company(telegram_id, company_name, google_sheet_id):
     """Update user company info"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-        
     try:
-        with conn.cursor() as cur:
+        with get_db_connection() as conn, conn.cursor() as cur:
             cur.execute("""
                 UPDATE datrix_users 
                 SET company_name = %s, google_sheet_id = %s, last_seen = NOW()
                 WHERE telegram_id = %s
             """, (company_name, google_sheet_id, telegram_id))
+            notify_user_changed(cur, telegram_id)
+            publish_event(cur, 'user_updated', telegram_id=telegram_id)
             
             conn.commit()
-            return True
     except Exception as e:
         logger.error(f"Error updating company: {e}")
         return False
-    finally:
-        conn.close()
 
+    user_cache.invalidate(telegram_id)
+    # last_seen was written with the row; drop any pending presence update
+    presence_tracker.mark_written(telegram_id)
+    return True
+
+@timed_query
 def get_user_info(telegram_id):
-    """Get user information - no first_name"""
-    conn = get_db_connection()
-    if not conn:
-        return None
+    """Get user information - no first_name (cached, see user_cache.py)"""
+    return user_cache.get_or_load(telegram_id, _load_user_info)
         
+def _load_user_info(telegram_id):
     try:
-        with conn.cursor() as cur:
+        with get_db_connection() as conn, conn.cursor() as cur:
             cur.execute("""
                 SELECT telegram_id, user_name, company_name, 
                        google_sheet_id, license_expires, download_count, 
@@ -197,17 +131,12 @@ def get_user_info(telegram_id):
     except Exception as e:
         logger.error(f"Error getting user: {e}")
         return None
-    finally:
-        conn.close()
 
+@timed_query
 def extend_user_license(telegram_id, days):
     """Extend user license"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-        
     try:
-        with conn.cursor() as cur:
+        with get_db_connection() as conn, conn.cursor() as cur:
             new_expiry = datetime.now().date() + timedelta(days=days)
             
             cur.execute("""
@@ -215,51 +144,174 @@ def extend_user_license(telegram_id, days):
                 SET license_expires = %s, license_status = 'active', last_seen = NOW()
                 WHERE telegram_id = %s
             """, (new_expiry, telegram_id))
+            notify_user_changed(cur, telegram_id)
+            publish_event(cur, 'license_extended', telegram_id=telegram_id, license_expires=new_expiry)
             
             conn.commit()
-            return True
     except Exception as e:
         logger.error(f"Error extending license: {e}")
         return False
-    finally:
-        conn.close()
 
-def track_download(telegram_id):
-    """Track download"""
-    conn = get_db_connection()
-    if not conn:
-        return False
+    user_cache.invalidate(telegram_id)
+    presence_tracker.mark_written(telegram_id)
+    return True
+
+@timed_query
+def bulk_extend_licenses(days, telegram_ids=None, company=None, expiring_before=None, from_expiry=False,
+                         message_for=None):
+    """Extend every license matching all the given filters in one statement.
+
+    The new expiry is today + ``days`` (like extend_user_license), or the
+    current expiry + ``days`` with ``from_expiry``. ``message_for(result)``
+    returns the text to queue for each extended user (or None); messages
+    are queued in the same transaction. Returns per-user results, or None
+    on error.
+    """
+    conditions, params = [], {'days': days, 'from_expiry': from_expiry}
+    if telegram_ids is not None:
+        conditions.append("telegram_id = ANY(%(telegram_ids)s)")
+        params['telegram_ids'] = list(telegram_ids)
+    if company:
+        conditions.append("lower(company_name) = lower(%(company)s)")
+        params['company'] = company
+    if expiring_before:
+        conditions.append("license_expires < %(expiring_before)s")
+        params['expiring_before'] = expiring_before
+    if not conditions:
+        raise ValueError("bulk_extend_licenses needs at least one filter")
         
     try:
-        with conn.cursor() as cur:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                WITH target AS (
+                    SELECT telegram_id, license_expires AS previous
+                    FROM datrix_users
+                    WHERE {' AND '.join(conditions)}
+                    FOR UPDATE
+                )
+                UPDATE datrix_users u
+                SET license_expires = CASE
+                        WHEN %(from_expiry)s THEN GREATEST(target.previous, CURRENT_DATE)
+                        ELSE CURRENT_DATE
+                    END + %(days)s,
+                    license_status = 'active'
+                FROM target
+                WHERE u.telegram_id = target.telegram_id
+                RETURNING u.telegram_id, u.user_name, u.company_name, target.previous, u.license_expires
+            """, params)
+            results = [
+                {'telegram_id': row[0], 'user_name': row[1], 'company_name': row[2],
+                 'previous_expires': row[3], 'license_expires': row[4], 'status': 'extended'}
+                for row in cur.fetchall()
+            ]
+
+            messages = []
+            for result in results if message_for else ():
+                text = message_for(result)
+                if text:
+                    messages.append({'chat_id': result['telegram_id'], 'priority': PRIORITY_BULK,
+                                     'params': {'text': text, 'parse_mode': 'Markdown'}})
+            insert_outbound(cur, messages)
+
+            extended = [result['telegram_id'] for result in results]
+            if results:
+                notify_users_changed(cur, extended)
+                publish_event(cur, 'licenses_extended', count=len(results))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error extending licenses in bulk: {e}")
+        return None
+
+    user_cache.invalidate_many(extended)
+    if telegram_ids is not None:
+        extended = set(extended)
+        results.extend({'telegram_id': telegram_id, 'status': 'not_matched'}
+                       for telegram_id in dict.fromkeys(telegram_ids) if telegram_id not in extended)
+    logger.info(f"✅ Bulk license extension: {len(messages)} notifications queued, "
+                f"{sum(r['status'] == 'extended' for r in results)} users extended by {days} days")
+    return results
+
+@timed_query
+def sweep_license_expiry(remind_days, expired_text, reminder_text, send_rate=10):
+    """Mark lapsed licenses expired and queue reminders for those ending soon.
+
+    Works in batches (one transaction each) over the users due for a
+    change only. ``expired_text(expires)`` / ``reminder_text(expires)``
+    give each message; each is scheduled 1/``send_rate`` seconds after the
+    previous one so a large sweep does not crowd out other messages.
+    """
+    counts = {'expired': 0, 'reminded': 0, 'queued': 0}
+
+    def sweep(claim, key, text_for):
+        while True:
+            with get_db_connection() as conn, conn.cursor() as cur:
+                rows = claim(cur)
+                if not rows:
+                    conn.rollback()
+                    return
+                # rows: (telegram_id, license_expires, whether to send a message)
+                messages = [
+                    {'chat_id': telegram_id, 'priority': PRIORITY_BULK,
+                     'params': {'text': text_for(expires), 'parse_mode': 'Markdown'}}
+                    for telegram_id, expires, send in rows if send
+                ]
+                for i, message in enumerate(messages):
+                    message['delay'] = (counts['queued'] + i) / send_rate
+                insert_outbound(cur, messages)
+                notify_all_users_changed(cur)
+                publish_event(cur, 'licenses_swept', **{key: len(rows)})
+                conn.commit()
+            user_cache.clear()
+            counts[key] += len(rows)
+            counts['queued'] += len(messages)
+
+    try:
+        sweep(expire_licenses, 'expired', expired_text)
+        sweep(lambda cur: claim_expiry_reminders(cur, remind_days), 'reminded', reminder_text)
+    except Exception as e:
+        logger.error(f"Error sweeping license expiry: {e}")
+        return None
+
+    if counts['expired'] or counts['reminded']:
+        logger.info(f"✅ License sweep: {counts['expired']} expired, {counts['reminded']} reminded, "
+                    f"{counts['queued']} messages queued")
+    return counts
+
+@timed_query
+def track_download(telegram_id, release=None):
+    """Track download (of ``release``, the delivered release dict)"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
             cur.execute("""
                 UPDATE datrix_users 
-                SET download_count = download_count + 1, last_seen = NOW()
+                SET download_count = download_count + 1, last_seen = NOW(),
+                    app_version = COALESCE(%s, app_version)
                 WHERE telegram_id = %s
-            """, (telegram_id,))
-            
-            # Log activity
-            cur.execute("""
-                INSERT INTO user_activity (telegram_id, activity_type, activity_data)
-                VALUES (%s, %s, %s)
-            """, (telegram_id, 'download', 'DATRIX app downloaded'))
+            """, (release['version'] if release else None, telegram_id))
+            if release:
+                count_release_download(cur, release['id'])
+            notify_user_changed(cur, telegram_id)
+            publish_event(cur, 'download', telegram_id=telegram_id,
+                          version=release['version'] if release else None)
             
             conn.commit()
-            return True
     except Exception as e:
         logger.error(f"Error tracking download: {e}")
         return False
-    finally:
-        conn.close()
 
+    user_cache.invalidate(telegram_id)
+    presence_tracker.mark_written(telegram_id)
+
+    # Log activity (written in the background)
+    version = f" {release['version']}" if release else ""
+    activity_writer.enqueue(telegram_id, 'download', f"DATRIX app{version} downloaded")
+    return True
+
+@timed_query
 def get_all_datrix_users():
     """Get all users for dashboard - with fallback"""
-    conn = get_db_connection()
-    if not conn:
-        return []
-        
     try:
-        with conn.cursor() as cur:
+        with get_db_connection() as conn, conn.cursor() as cur:
             # Try with first_name first
             try:
                 cur.execute("""
@@ -303,6 +355,8 @@ def get_all_datrix_users():
             except Exception as column_error:
                 # Fallback without first_name if column doesn't exist
                 logger.warning(f"Using fallback query: {column_error}")
+                # The failed statement aborted the transaction
+                conn.rollback()
                 cur.execute("""
                     SELECT 
                         telegram_id,
@@ -341,82 +395,457 @@ def get_all_datrix_users():
     except Exception as e:
         logger.error(f"Error getting users: {e}")
         return []
-    finally:
-        conn.close()
 
+# Keyset pagination for the dashboard users API.
+# Each sort key is NULL-safe so it matches its expression index exactly
+# (see _user_indexes in migrations.py).
+USER_SORT_KEYS = {
+    'last_seen': ("COALESCE(last_seen, '-infinity'::timestamptz)", 'timestamptz'),
+    'created_at': ("COALESCE(created_at, '-infinity'::timestamptz)", 'timestamptz'),
+    'license_expires': ("COALESCE(license_expires, '-infinity'::date)", 'date'),
+}
+
+LICENSE_FILTERS = {
+    'active': "license_expires > CURRENT_DATE",
+    'expiring': "license_expires > CURRENT_DATE AND license_expires <= CURRENT_DATE + %(expiring_days)s",
+    'expired': "license_expires <= CURRENT_DATE",
+    'none': "license_expires IS NULL",
+}
+
+USERS_PAGE_MAX = 500
+
+def encode_users_cursor(sort, order, sort_key, telegram_id):
+    """Opaque cursor pointing just after the given row"""
+    raw = json.dumps([sort, order, sort_key, telegram_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_users_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_order, sort_key, telegram_id = json.loads(raw)
+    except Exception:
+        raise ValueError("invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ValueError("cursor does not match sort order")
+    return str(sort_key), int(telegram_id)
+
+def format_user_row(row):
+    """Dashboard fields for one datrix_users row (see get_datrix_users_page)"""
+    license_expires, created_at, last_seen = row[5], row[9], row[10]
+    return {
+        'telegram_id': row[0],
+        'user_name': row[1] or row[2] or f'User_{row[0]}',  # user_name or first_name
+        'company_name': row[3],
+        'google_sheet_id': row[4],
+        'license_expires': license_expires,
+        'license_status': row[6],
+        'app_version': row[7],
+        'total_downloads': row[8] or 0,
+        'created_at': created_at,
+        'last_seen': last_seen,
+        'is_app_user': bool(row[11]),
+        'days_remaining': row[12],
+        'license_expires_formatted': license_expires.strftime('%Y-%m-%d') if license_expires else 'Not set',
+        'last_seen_formatted': last_seen.strftime('%Y-%m-%d %H:%M') if last_seen else 'Never',
+        'created_at_formatted': created_at.strftime('%Y-%m-%d') if created_at else 'Unknown',
+    }
+
+@timed_query
+def get_datrix_users_page(limit=100, cursor=None, sort='last_seen', order='desc',
+                          license=None, company=None, active_hours=None,
+                          expiring_days=7, telegram_id=None):
+    """One page of users plus the cursor of the next page (None at the end).
+
+    Raises ValueError for invalid arguments; returns None on database errors.
+    """
+    if sort not in USER_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(USER_SORT_KEYS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+    if license is not None and license not in LICENSE_FILTERS:
+        raise ValueError(f"license must be one of {', '.join(LICENSE_FILTERS)}")
+    limit = max(1, min(int(limit), USERS_PAGE_MAX))
+
+    key_expr, key_type = USER_SORT_KEYS[sort]
+    params = {'limit': limit + 1, 'expiring_days': int(expiring_days)}
+    conditions = []
+
+    if cursor:
+        params['cursor_key'], params['cursor_id'] = decode_users_cursor(cursor, sort, order)
+        op = '<' if order == 'desc' else '>'
+        conditions.append(
+            f"({key_expr}, telegram_id) {op} (%(cursor_key)s::{key_type}, %(cursor_id)s)"
+        )
+    if license:
+        conditions.append(LICENSE_FILTERS[license])
+    if company:
+        conditions.append("lower(company_name) = lower(%(company)s)")
+        params['company'] = company
+    if active_hours:
+        conditions.append("last_seen > NOW() - %(active_hours)s * INTERVAL '1 hour'")
+        params['active_hours'] = float(active_hours)
+    if telegram_id is not None:
+        conditions.append("telegram_id = %(telegram_id)s")
+        params['telegram_id'] = int(telegram_id)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT
+                    telegram_id,
+                    user_name,
+                    first_name,
+                    company_name,
+                    google_sheet_id,
+                    license_expires,
+                    COALESCE(license_status, 'active') as license_status,
+                    app_version,
+                    download_count,
+                    created_at,
+                    last_seen,
+                    COALESCE(license_expires > CURRENT_DATE, false) as is_app_user,
+                    license_expires - CURRENT_DATE as days_remaining,
+                    {key_expr}::text as sort_key
+                FROM datrix_users
+                {where}
+                ORDER BY {key_expr} {order}, telegram_id {order}
+                LIMIT %(limit)s
+            """, params)
+            rows = cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting users page: {e}")
+        return None
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_users_cursor(sort, order, last[13], last[0])
+    return [format_user_row(row) for row in rows], next_cursor
+
+@timed_query
 def get_basic_stats():
-    """Get basic statistics"""
-    conn = get_db_connection()
-    if not conn:
-        return {
-            'total_users': 0,
-            'active_users': 0,
-            'downloads_today': 0,
-            'licensed_users': 0
-        }
-        
+    """Get basic statistics (one read of the trigger-maintained counters)"""
     try:
-        with conn.cursor() as cur:
-            # Total users
-            cur.execute("SELECT COUNT(*) FROM datrix_users")
-            total_users = cur.fetchone()[0]
-            
-            # Active users (24h)
-            cur.execute("""
-                SELECT COUNT(*) FROM datrix_users 
-                WHERE last_seen > NOW() - INTERVAL '24 hours'
-            """)
-            active_users = cur.fetchone()[0]
-            
-            # Total downloads
-            cur.execute("""
-                SELECT COALESCE(SUM(download_count), 0) FROM datrix_users
-            """)
-            total_downloads = cur.fetchone()[0]
-            
-            # Licensed users
-            cur.execute("""
-                SELECT COUNT(*) FROM datrix_users 
-                WHERE license_expires > CURRENT_DATE
-            """)
-            licensed_users = cur.fetchone()[0]
-            
-            return {
-                'total_users': total_users,
-                'active_users': active_users,
-                'downloads_today': total_downloads,
-                'licensed_users': licensed_users
-            }
+        with get_db_connection() as conn, conn.cursor() as cur:
+            stats = read_stats(cur)
+            if stats is None:
+                # Counters not installed yet - fall back to a full count
+                stats = count_stats(cur)
+            return stats
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
-        return {
-            'total_users': 0,
-            'active_users': 0,
-            'downloads_today': 0,
-            'licensed_users': 0
-        }
-    finally:
-        conn.close()
+        return dict(EMPTY_STATS)
 
-def log_user_activity(telegram_id, activity_type, activity_data=""):
-    """Log user activity"""
-    conn = get_db_connection()
-    if not conn:
-        return False
+@timed_query
+def get_live_stats():
+    """Overview figures for both dashboards (counter and rollup reads only).
         
+    The basic figures keep get_basic_stats' meaning; the rollup figures sit
+    under 'today_stats', as in get_dashboard_analytics.
+    """
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO user_activity (telegram_id, activity_type, activity_data)
-                VALUES (%s, %s, %s)
-            """, (telegram_id, activity_type, activity_data))
+        with get_db_connection() as conn, conn.cursor() as cur:
+            stats = read_stats(cur) or count_stats(cur)
+            stats['today_stats'] = read_today_stats(cur)
+            return stats
+    except Exception as e:
+        logger.error(f"Error getting live stats: {e}")
+        return {**EMPTY_STATS, 'today_stats': {}}
             
+@timed_query
+def reconcile_basic_stats():
+    """Recount the stats counters from datrix_users and fix any drift"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            result = reconcile_stats(cur)
+            prune_stats(cur)
+            conn.commit()
+            return result
+    except Exception as e:
+        logger.error(f"Error reconciling stats: {e}")
+        return None
+
+@timed_query
+def get_dashboard_analytics(range_name='7d', granularity=None):
+    """Overview figures plus an activity time series, all from rollups.
+
+    Raises ValueError for an unknown range/granularity; returns None on
+    database errors.
+    """
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            result = read_series(cur, range_name, granularity)
+            result['today_stats'] = read_today_stats(cur)
+            return result
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting analytics: {e}")
+        return None
+
+@timed_query
+def rebuild_activity_rollups(days=7):
+    """Recompute the last ``days`` days of rollups from raw user_activity"""
+    since = datetime.utcnow().date() - timedelta(days=days)
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            rebuild_rollups(cur, since)
+            conn.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error rebuilding rollups: {e}")
+        return False
+
+# Streaming exports: rows come from a server-side (named) cursor in
+# EXPORT_FETCH_SIZE chunks, so memory use does not grow with the table
+EXPORT_FETCH_SIZE = 2000
+
+USER_EXPORT_COLUMNS = [
+    'telegram_id', 'user_name', 'company_name', 'google_sheet_id',
+    'license_expires', 'license_status', 'app_version', 'download_count',
+    'created_at', 'last_seen'
+]
+
+ACTIVITY_EXPORT_COLUMNS = ['id', 'telegram_id', 'activity_type', 'activity_data', 'timestamp']
+
+def _iter_named_cursor(name, query, params=None):
+    with get_db_connection() as conn:
+        with conn.cursor(name=name) as cur:
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+
+def iter_users_export():
+    """Yield every datrix_users row (USER_EXPORT_COLUMNS order)"""
+    return _iter_named_cursor('datrix_export_users', """
+        SELECT telegram_id, COALESCE(user_name, first_name), company_name, google_sheet_id,
+               license_expires, COALESCE(license_status, 'active'), app_version,
+               download_count, created_at, last_seen
+        FROM datrix_users
+        ORDER BY telegram_id
+    """)
+
+def iter_activity_export(since=None, until=None, telegram_id=None, activity_type=None):
+    """Yield user_activity rows (ACTIVITY_EXPORT_COLUMNS order), oldest first"""
+    conditions = []
+    params = {}
+    if since is not None:
+        conditions.append("timestamp >= %(since)s")
+        params['since'] = since
+    if until is not None:
+        conditions.append("timestamp < %(until)s")
+        params['until'] = until
+    if telegram_id is not None:
+        conditions.append("telegram_id = %(telegram_id)s")
+        params['telegram_id'] = telegram_id
+    if activity_type:
+        conditions.append("activity_type = %(activity_type)s")
+        params['activity_type'] = activity_type
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return _iter_named_cursor('datrix_export_activity', f"""
+        SELECT id, telegram_id, activity_type, activity_data, timestamp
+        FROM user_activity
+        {where}
+        ORDER BY timestamp, id
+    """, params)
+
+# Release registry (see releases.py)
+@timed_query
+def get_active_release(fresh=False):
+    """Active release from this process's in-memory copy.
+
+    ``fresh`` reads it from the database instead, for a current download count.
+    """
+    if not fresh:
+        return release_registry.active()
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            return read_active_release(cur)
+    except Exception as e:
+        logger.error(f"Error getting active release: {e}")
+        return None
+
+@timed_query
+def expect_release_upload(telegram_id, version):
+    """Remember that the admin's next document is release ``version``"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            set_pending_upload(cur, telegram_id, version)
+            conn.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error saving pending upload: {e}")
+        return False
+
+@timed_query
+def get_pending_upload(telegram_id):
+    """Version the admin's next document is for, or None"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            return read_pending_upload(cur, telegram_id)
+    except Exception as e:
+        logger.error(f"Error getting pending upload: {e}")
+        return None
+
+@timed_query
+def publish_release(version, file_id, file_unique_id=None, filename=None, file_size=None, uploaded_by=None):
+    """Record an uploaded file as the new active release (ends the uploader's pending upload)"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            release = insert_release(cur, version, file_id, file_unique_id, filename, file_size, uploaded_by)
+            if uploaded_by is not None:
+                clear_pending_upload(cur, uploaded_by)
+            publish_event(cur, 'release', id=release['id'], version=release['version'])
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error publishing release: {e}")
+        return None
+
+    release_registry.set_active(release)
+    logger.info(f"✅ Release {release['version']} published")
+    return release
+
+@timed_query
+def set_active_release(release_id):
+    """Make an earlier release the delivered one again"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            release = activate_release(cur, release_id)
+            if release:
+                publish_event(cur, 'release', id=release['id'], version=release['version'])
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error activating release: {e}")
+        return None
+
+    if release:
+        release_registry.set_active(release)
+    return release
+
+@timed_query
+def get_releases(limit=50):
+    """Release history with per-version download counts"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            return read_releases(cur, limit)
+    except Exception as e:
+        logger.error(f"Error getting releases: {e}")
+        return []
+
+# Outbound message queue (see outbound.py)
+@timed_query
+def queue_messages(messages, delay=0):
+    """Queue messages for the bot process to send (rate limited, retried)"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            queued = insert_outbound(cur, messages, delay)
+            conn.commit()
+            return queued
+    except Exception as e:
+        logger.error(f"Error queueing messages: {e}")
+        return 0
+
+@timed_query
+def claim_outbound_messages(limit, lease):
+    """Lease due queued messages to this sender"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            messages = claim_outbound(cur, limit, lease)
+            conn.commit()
+            return messages
+    except Exception as e:
+        logger.error(f"Error claiming queued messages: {e}")
+        return []
+
+@timed_query
+def complete_outbound_message(message_id):
+    """Remove a queued message once delivered"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            delete_outbound(cur, message_id)
             conn.commit()
             return True
     except Exception as e:
-        logger.error(f"Error logging activity: {e}")
+        logger.error(f"Error completing queued message {message_id}: {e}")
         return False
-    finally:
-        conn.close()
+
+@timed_query
+def retry_outbound_message(message_id, delay, error, failed=False):
+    """Schedule another attempt for a queued message (or give up on it)"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            reschedule_outbound(cur, message_id, delay, error, failed)
+            conn.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error rescheduling queued message {message_id}: {e}")
+        return False
+
+@timed_query
+def get_outbound_queue_stats():
+    """Pending, due and failed queued messages"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            return read_outbound_stats(cur)
+    except Exception as e:
+        logger.error(f"Error getting outbound queue stats: {e}")
+        return {}
+
+def log_user_activity(telegram_id, activity_type, activity_data=""):
+    """Log user activity (buffered, inserted in batches)"""
+    return activity_writer.enqueue(telegram_id, activity_type, activity_data)
+
+def flush_activity():
+    """Write buffered activity rows now"""
+    return activity_writer.flush()
+
+def get_activity_writer_stats():
+    """Buffered activity writer statistics for this process"""
+    return activity_writer.stats()
+
+@timed_query
+def run_database_maintenance():
+    """Periodic housekeeping: activity partitions/retention, rollups, stats buckets and failed messages"""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            if run_maintenance(cur):
+                prune_rollups(cur)
+                prune_stats(cur)
+                prune_outbound(cur)
+                stray = count_default_rows(cur)
+                ACTIVITY_DEFAULT_ROWS.set(stray)
+                if stray:
+                    logger.warning(f"{stray} activity rows are in the default partition (outside every monthly partition)")
+            conn.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Database maintenance failed: {e}")
+        return False
+
+def get_pool_stats():
+    """Connection pool statistics for this process"""
+    return pool_stats()
+
+def get_query_stats():
+    """Per-function statement counts, rows and timings for this process"""
+    return query_stats.snapshot()
+
+def get_user_cache_stats():
+    """get_user_info cache hit/miss counters for this process"""
+    return user_cache.stats()
+
+def get_presence_stats():
+    """Presence tracker statistics for this process"""
+    return presence_tracker.stats()
+
+def shutdown():
+    """Flush buffered writes and release pooled connections (call on process exit)"""
+    activity_writer.close()
+    presence_tracker.close()
+    close_pool()
 
 # NO BROADCAST FUNCTIONS - COMPLETELY REMOVED
@@ -0,0 +1,137 @@
+# db_listener.py
+# Postgres LISTEN/NOTIFY fan-in shared by every cache in a process
+
+import os
+import time
+import select
+import logging
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+LISTENER_RECONNECT_DELAY = float(os.environ.get('LISTENER_RECONNECT_DELAY', 5))
+
+
+def notify(cur, channel, payload=''):
+    """Queue a notification; it is delivered when the transaction commits"""
+    cur.execute("SELECT pg_notify(%s, %s)", (channel, str(payload)))
+
+
+class NotificationListener:
+    """Background thread holding one LISTEN connection per process.
+
+    ``subscribe(channel, callback)`` registers ``callback(payload)`` for a
+    channel. Callbacks passed to ``on_reset`` run whenever notifications
+    may have been missed (before the first connect and after every
+    reconnect), so caches can drop everything they hold.
+    """
+
+    def __init__(self, reconnect_delay=LISTENER_RECONNECT_DELAY):
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._reset_callbacks = []
+        self._listening = set()
+        self._thread = None
+        self._pid = None
+        self._connected = threading.Event()
+        self._stopping = False
+
+    @property
+    def connected(self):
+        """True while notifications are being received in this process"""
+        return self._pid == os.getpid() and self._connected.is_set()
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+
+    def on_reset(self, callback):
+        with self._lock:
+            self._reset_callbacks.append(callback)
+
+    def start(self):
+        """Start the listener thread for this process (idempotent)"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._connected = threading.Event()
+            self._listening = set()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='datrix-db-listener', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Notification handler for {channel} failed: {e}")
+
+    def _reset(self):
+        with self._lock:
+            callbacks = list(self._reset_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Notification reset handler failed: {e}")
+
+    def _listen_new_channels(self, conn):
+        with self._lock:
+            channels = set(self._callbacks) - self._listening
+        if not channels:
+            return
+        with conn.cursor() as cur:
+            for channel in channels:
+                cur.execute(f'LISTEN "{channel}"')
+        self._listening |= channels
+
+    def _run(self):
+        while not self._stopping:
+            conn = None
+            try:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                self._listening = set()
+                self._listen_new_channels(conn)
+                # Anything sent before LISTEN took effect was missed
+                self._reset()
+                self._connected.set()
+                logger.info("✅ Database notification listener connected")
+
+                while not self._stopping:
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            note = conn.notifies.pop(0)
+                            self._dispatch(note.channel, note.payload)
+                    self._listen_new_channels(conn)
+            except Exception as e:
+                if self._connected.is_set():
+                    logger.error(f"Database notification listener lost: {e}")
+                self._connected.clear()
+                self._reset()
+            finally:
+                self._connected.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            if not self._stopping:
+                time.sleep(self.reconnect_delay)
+
+
+listener = NotificationListener()
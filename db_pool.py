@@ -0,0 +1,341 @@
+# db_pool.py
+# Shared PostgreSQL connection pool (bounded, thread-safe, fork-aware)
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+from metrics import DB_ERRORS, DB_POOL_CONNECTIONS, DB_POOL_EVENTS, DB_POOL_WAIT_SECONDS, current_query
+from query_log import InstrumentedCursor
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# Idle connections older than this (seconds) are pinged before being handed out
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30))
+
+
+class PoolTimeout(PoolError):
+    """Raised when no connection becomes available within the timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of psycopg2 connections.
+
+    Connections are created lazily up to ``maxconn``; callers block (up to
+    ``timeout`` seconds) when every connection is checked out. Idle
+    connections are health-checked on checkout, and a forked child never
+    reuses sockets inherited from its parent.
+    """
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, check_after=DB_POOL_CHECK_AFTER):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("invalid pool size")
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, last_used) - LIFO so hot connections stay warm
+        self._size = 0   # idle + checked out + being opened
+        self._in_use = set()
+        self._closed = False
+        # Connections inherited over fork(); kept referenced so they are
+        # never finalized (which would terminate the parent's session)
+        self._inherited = []
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'connect_failures': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+        }
+
+    # ---------- metrics ----------
+
+    def _count(self, event):
+        # Local counter for stats() plus the cross-process Prometheus one
+        self._stats[event] += 1
+        DB_POOL_EVENTS.labels(event=event).inc()
+
+    def _publish_occupancy(self):
+        # Called with self._cond held
+        DB_POOL_CONNECTIONS.labels(state='idle').set(len(self._idle))
+        DB_POOL_CONNECTIONS.labels(state='in_use').set(self._size - len(self._idle))
+
+    # ---------- connection lifecycle ----------
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn, cursor_factory=InstrumentedCursor)
+        except Exception:
+            with self._cond:
+                self._count('connect_failures')
+            raise
+        with self._cond:
+            self._count('connections_opened')
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._count('connections_closed')
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+
+    def _reset_after_fork(self):
+        """Forget every connection inherited from the parent process"""
+        self._inherited.extend(conn for conn, _ in self._idle)
+        self._inherited.extend(self._in_use)
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = set()
+        self._size = 0
+        self._stats = dict.fromkeys(self._stats, 0)
+
+    # ---------- public API ----------
+
+    def warm(self):
+        """Open connections until ``minconn`` are idle"""
+        self._check_fork()
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self, timeout=None):
+        """Check out a healthy connection, waiting if the pool is exhausted"""
+        self._check_fork()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+                waited = False
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._count('timeouts')
+                        raise PoolTimeout(
+                            f"no connection available within {timeout:.1f}s "
+                            f"(pool size {self.maxconn})"
+                        )
+                    if not waited:
+                        self._count('waits')
+                        waited = True
+                    self._cond.wait(remaining)
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._count('health_check_failures')
+                    self._size -= 1
+                    self._cond.notify()
+                self._close(conn)
+                continue
+
+            with self._cond:
+                self._count('checkouts')
+                self._in_use.add(conn)
+                self._publish_occupancy()
+            DB_POOL_WAIT_SECONDS.observe(time.monotonic() - started)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool (or discard it when ``close``)"""
+        self._check_fork()
+        with self._cond:
+            if conn not in self._in_use:
+                # Checked out before a fork; the child must not touch it
+                if conn not in self._inherited:
+                    self._inherited.append(conn)
+                return
+            self._in_use.discard(conn)
+
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+        if conn.closed:
+            close = True
+
+        with self._cond:
+            if close or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._publish_occupancy()
+            self._cond.notify()
+
+        if close or self._closed:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager yielding a pooled connection.
+
+        Uncommitted work is rolled back when the block exits; connections
+        that raised a connection-level error are discarded.
+        """
+        try:
+            conn = self.getconn(timeout)
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}")
+            DB_ERRORS.labels(function=current_query()).inc()
+            raise
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            DB_ERRORS.labels(function=current_query()).inc()
+            raise
+        except psycopg2.Error:
+            DB_ERRORS.labels(function=current_query()).inc()
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        """Close idle connections and refuse further checkouts"""
+        self._check_fork()
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._publish_occupancy()
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of pool counters and current occupancy"""
+        self._check_fork()
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pid': self._pid,
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+            })
+        return stats
+
+
+# =================== SHARED POOL ===================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+                try:
+                    _pool.warm()
+                except Exception as e:
+                    logger.error(f"Database connection failed: {e}")
+    return _pool
+
+
+def get_db_connection(timeout=None):
+    """Context manager checking a connection out of the shared pool"""
+    return get_pool().connection(timeout)
+
+
+def pool_stats():
+    """Statistics of the shared pool (empty if it was never used)"""
+    return _pool.stats() if _pool is not None else {}
+
+
+def close_pool():
+    """Close the shared pool; a new one is created on next use"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.closeall()
+
+
+def _after_fork_in_child():
+    global _pool_lock
+    _pool_lock = threading.Lock()
+    if _pool is not None:
+        _pool._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,172 @@
+# events.py
+# Live dashboard events: Postgres NOTIFY in, Server-Sent Events out
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+
+from db_listener import listener
+from serving import WEB_THREADS
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'datrix_events'
+# Numbers every event, so processes agree on what they have seen (http_cache)
+EVENTS_SCHEMA = """
+    CREATE SEQUENCE IF NOT EXISTS datrix_events_seq;
+"""
+# Events buffered per dashboard; a client that falls further behind is
+# told to resync instead of slowing everyone else down
+EVENTS_CLIENT_QUEUE = int(os.environ.get('EVENTS_CLIENT_QUEUE', 100))
+# Every open stream holds a request thread for as long as it stays open, so
+# dashboards get at most a quarter of them; the rest keep serving the API,
+# webhooks and health checks
+EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS', max(WEB_THREADS // 4, 1)))
+# Seconds a refused dashboard waits before trying again
+EVENTS_RETRY_AFTER = int(os.environ.get('EVENTS_RETRY_AFTER', 30))
+EVENTS_KEEPALIVE = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+# At most one stats event per interval, and only after something changed
+EVENTS_STATS_INTERVAL = float(os.environ.get('EVENTS_STATS_INTERVAL', 5))
+
+
+def install_events_schema(cur):
+    cur.execute(EVENTS_SCHEMA)
+
+
+def publish_event(cur, event_type, **data):
+    """Queue a dashboard event; it is delivered when the transaction commits.
+
+    The payload gets a 'seq' from datrix_events_seq.
+    """
+    cur.execute(
+        "SELECT pg_notify(%s, (%s::jsonb || jsonb_build_object('seq', nextval('datrix_events_seq')))::text)",
+        (EVENTS_CHANNEL, json.dumps({'type': event_type, **data}, default=str))
+    )
+
+
+class TooManyClients(Exception):
+    pass
+
+
+class EventBroker:
+    """Fans the events channel out to every connected dashboard.
+
+    One listener subscription per process feeds all clients; each client
+    has a bounded queue. A stats thread turns bursts of changes into one
+    ``stats`` event per EVENTS_STATS_INTERVAL from a single stats query.
+    """
+
+    def __init__(self, stats_loader, max_clients=EVENTS_MAX_CLIENTS):
+        self.stats_loader = stats_loader
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._next_id = 0
+        self._stats_dirty = threading.Event()
+        self._stats_pid = None
+        self._counters = {'published': 0, 'resyncs': 0}
+        listener.subscribe(EVENTS_CHANNEL, self._on_notify)
+        listener.on_reset(self._on_reset)
+
+    def subscribe(self):
+        listener.start()
+        self._ensure_stats_thread()
+        client = queue.Queue(EVENTS_CLIENT_QUEUE)
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                raise TooManyClients()
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, event):
+        """Send an event dict (with a 'type') to every connected client"""
+        with self._lock:
+            self._next_id += 1
+            event_id = self._next_id
+            clients = list(self._clients)
+            self._counters['published'] += 1
+        message = (event_id, event['type'], event)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                self._resync(client)
+
+    def _resync(self, client):
+        """Replace a backed-up client's queue with a single resync request"""
+        try:
+            while True:
+                client.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            client.put_nowait((None, 'resync', {'type': 'resync'}))
+        except queue.Full:
+            pass  # another publisher refilled it; resync on the next overflow
+        with self._lock:
+            self._counters['resyncs'] += 1
+
+    def _on_notify(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if not self._clients:
+            return
+        self.publish(event)
+        self._stats_dirty.set()
+
+    def _on_reset(self):
+        # Notifications may have been missed: clients reload everything
+        if self._clients:
+            self.publish({'type': 'resync'})
+
+    def _ensure_stats_thread(self):
+        if self._stats_pid == os.getpid():
+            return
+        with self._lock:
+            if self._stats_pid == os.getpid():
+                return
+            self._stats_pid = os.getpid()
+            threading.Thread(target=self._stats_loop, name='datrix-events-stats', daemon=True).start()
+
+    def _stats_loop(self):
+        while True:
+            self._stats_dirty.wait()
+            time.sleep(EVENTS_STATS_INTERVAL)
+            self._stats_dirty.clear()
+            if not self._clients:
+                continue
+            try:
+                self.publish({'type': 'stats', **self.stats_loader()})
+            except Exception as e:
+                logger.error(f"Error publishing stats event: {e}")
+
+    def stream(self, client):
+        """SSE body for one client; unsubscribes when the client goes away"""
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event_id, event_type, event = client.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                head = f"id: {event_id}\n" if event_id is not None else ""
+                yield f"{head}event: {event_type}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            self.unsubscribe(client)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['clients'] = len(self._clients)
+        stats['listener_connected'] = listener.connected
+        return stats
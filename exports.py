@@ -0,0 +1,72 @@
+# exports.py
+# Chunked CSV / NDJSON rendering (optionally gzipped) for streaming exports
+
+import io
+import csv
+import json
+import zlib
+from datetime import date, datetime
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Rendered output is yielded in pieces of roughly this many bytes
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if value is None else _plain(value) for value in row])
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(rows, columns):
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps({column: _plain(value) for column, value in zip(columns, row)},
+                          ensure_ascii=False) + '\n'
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts).encode('utf-8')
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def render_export(rows, columns, fmt='csv', gzip=False):
+    """Return (chunk iterator, mimetype, file extension) for an export"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    chunks = _csv_chunks(rows, columns) if fmt == 'csv' else _ndjson_chunks(rows, columns)
+    if gzip:
+        return _gzip_chunks(chunks), 'application/gzip', extension + '.gz'
+    return chunks, mimetype, extension
@@ -0,0 +1,78 @@
+# fake_telegram.py
+# Posts synthetic Telegram updates to a local webhook for testing
+
+import os
+import sys
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from webhook import WEBHOOK_PATH, default_secret
+
+
+def make_update(update_id, user_id, text):
+    """A private-chat message update as Telegram would send it"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'Test {user_id}', 'username': f'test_{user_id}'}
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+        'from': user,
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Send fake Telegram updates to the webhook')
+    parser.add_argument('--url', default=f"http://127.0.0.1:{os.environ.get('PORT', 8080)}{WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET'),
+                        help='defaults to the secret derived from TELEGRAM_BOT_TOKEN')
+    parser.add_argument('--text', default='/help')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--users', type=int, default=10, help='distinct fake user ids')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--first-user', type=int, default=900000000)
+    args = parser.parse_args(argv)
+    if not args.secret:
+        if 'TELEGRAM_BOT_TOKEN' not in os.environ:
+            parser.error('set --secret, WEBHOOK_SECRET or TELEGRAM_BOT_TOKEN')
+        args.secret = default_secret(os.environ['TELEGRAM_BOT_TOKEN'])
+
+    session = requests.Session()
+    update_ids = itertools.count(int(time.time()))
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret}
+
+    def send(i):
+        update = make_update(next(update_ids), args.first_user + i % args.users, args.text)
+        started = time.perf_counter()
+        try:
+            status = session.post(args.url, json=update, headers=headers, timeout=10).status_code
+        except requests.RequestException:
+            status = 'error'
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(send, range(args.count)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(latency for _, latency in results)
+    print(f"Sent {args.count} updates in {elapsed:.2f}s ({args.count / elapsed:.0f}/s)")
+    print(f"Status codes: {statuses}")
+    print(f"Latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+    return 0 if set(statuses) == {200} else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
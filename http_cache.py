@@ -0,0 +1,159 @@
+# http_cache.py
+# ETags from data change markers, 304 answers and response compression
+
+import os
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import threading
+from functools import wraps
+
+from flask import make_response, request
+
+from db_listener import listener
+from events import EVENTS_CHANNEL
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+# Responses smaller than this are sent as they are
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+
+# Which cached views each dashboard event can change
+EVENT_TOPICS = {
+    'user_created': ('users', 'stats'),
+    'user_updated': ('users',),
+    'license_extended': ('users', 'stats'),
+    'licenses_extended': ('users', 'stats'),
+    'licenses_swept': ('users',),
+    'download': ('users', 'stats', 'releases'),
+    'presence': ('users', 'stats'),
+    'release': ('releases', 'stats'),
+}
+
+
+class ChangeMarkers:
+    """Version of each topic, the same in every process.
+
+    Every dashboard event carries a 'seq' from datrix_events_seq, and a
+    topic's version is the seq of the last event that touched it.
+    Notifications reach every listener in commit order, so all web workers
+    agree and an ETag from one is honoured by the others.
+
+    Markers are only trusted while the notification listener is connected.
+    After every (re)connect, topics without a new event get this process's
+    fresh random baseline, so ETags handed out before it never match.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline = uuid.uuid4().hex[:8]
+        self._versions = {}
+
+    def bump(self, seq, *topics):
+        with self._lock:
+            for topic in topics:
+                self._versions[topic] = str(seq)
+
+    def reset(self):
+        with self._lock:
+            self._baseline = uuid.uuid4().hex[:8]
+            self._versions.clear()
+
+    def marker(self, topics):
+        """Opaque marker for the topics, or None if changes may be missed"""
+        listener.start()
+        if not listener.connected:
+            return None
+        with self._lock:
+            return '.'.join(self._versions.get(topic, self._baseline) for topic in topics)
+
+    def _on_event(self, payload):
+        try:
+            event = json.loads(payload)
+            topics = EVENT_TOPICS.get(event.get('type'))
+            seq = event.get('seq')
+        except (ValueError, AttributeError):
+            topics = seq = None
+        if topics and seq is not None:
+            self.bump(seq, *topics)
+        else:
+            # Unknown change: nothing handed out so far can be trusted
+            self.reset()
+
+
+changes = ChangeMarkers()
+# Subscribed before any SSE broker, so markers move before dashboards hear of a change
+listener.subscribe(EVENTS_CHANNEL, changes._on_event)
+listener.on_reset(changes.reset)
+
+
+def conditional(*topics, max_age=None):
+    """Answer If-None-Match with 304 (without running the view) while
+    none of ``topics`` changed.
+
+    ``max_age`` (seconds) also rotates the ETag on that period, for views
+    whose output depends on the clock (e.g. "active in the last 24h").
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            marker = changes.marker(topics)
+            if marker is None:
+                return view(*args, **kwargs)
+
+            period = int(time.time() // max_age) if max_age else 0
+            query = hashlib.sha1(request.full_path.encode()).hexdigest()[:12]
+            etag = f"{marker}-{period}-{query}"
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook: brotli/gzip large, non-streamed bodies"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype == 'text/event-stream'):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    if encoding == 'br':
+        body = brotli.compress(body, quality=min(COMPRESS_LEVEL, 11))
+    else:
+        body = gzip.compress(body, compresslevel=COMPRESS_LEVEL)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
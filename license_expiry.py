@@ -0,0 +1,63 @@
+# license_expiry.py
+# Expired-license status updates and expiry reminders, in batches
+
+import os
+
+LICENSE_SWEEP_BATCH = int(os.environ.get('LICENSE_SWEEP_BATCH', 500))
+# A license is expired from its license_expires day on (the bot refuses
+# downloads when license_expires <= today, and "licensed" means > today).
+# Users whose license expired longer ago than this are marked expired
+# without a message (e.g. on the first sweep of an old database)
+LICENSE_EXPIRED_NOTICE_DAYS = int(os.environ.get('LICENSE_EXPIRED_NOTICE_DAYS', 7))
+
+LICENSE_EXPIRY_SCHEMA = """
+    -- The license_expires value the last reminder was sent for
+    ALTER TABLE datrix_users ADD COLUMN IF NOT EXISTS expiry_reminded_for DATE;
+
+    -- Only licenses still marked active are ever swept, so every scan is a
+    -- range over the users due for a change rather than the whole table
+    CREATE INDEX IF NOT EXISTS datrix_users_active_expiry_idx
+        ON datrix_users (license_expires) WHERE license_status = 'active';
+"""
+
+
+def install_license_expiry_schema(cur):
+    cur.execute(LICENSE_EXPIRY_SCHEMA)
+
+
+def expire_licenses(cur, limit=LICENSE_SWEEP_BATCH):
+    """Mark up to ``limit`` licenses ending today or earlier expired; [(telegram_id, license_expires, notify)]"""
+    cur.execute("""
+        UPDATE datrix_users u
+        SET license_status = 'expired'
+        FROM (
+            SELECT telegram_id FROM datrix_users
+            WHERE license_status = 'active' AND license_expires <= CURRENT_DATE
+            ORDER BY license_expires
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE u.telegram_id = due.telegram_id
+        RETURNING u.telegram_id, u.license_expires, u.license_expires >= CURRENT_DATE - %s
+    """, (limit, LICENSE_EXPIRED_NOTICE_DAYS))
+    return cur.fetchall()
+
+
+def claim_expiry_reminders(cur, days, limit=LICENSE_SWEEP_BATCH):
+    """Record a reminder for up to ``limit`` licenses ending after today and within ``days``; [(telegram_id, license_expires, True)]"""
+    cur.execute("""
+        UPDATE datrix_users u
+        SET expiry_reminded_for = u.license_expires
+        FROM (
+            SELECT telegram_id FROM datrix_users
+            WHERE license_status = 'active'
+              AND license_expires > CURRENT_DATE AND license_expires <= CURRENT_DATE + %s
+              AND expiry_reminded_for IS DISTINCT FROM license_expires
+            ORDER BY license_expires
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE u.telegram_id = due.telegram_id
+        RETURNING u.telegram_id, u.license_expires, TRUE
+    """, (days, limit))
+    return cur.fetchall()
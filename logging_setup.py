@@ -0,0 +1,244 @@
+# logging_setup.py
+# Queue-based JSON logging with rotation, shared by the web and bot processes
+
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import itertools
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): forked children log per pid
+    fcntl = None
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Each process role writes its own file (datrix-web.log, datrix-bot.log, ...);
+# empty disables file logging
+LOG_FILE = os.environ.get('LOG_FILE', 'datrix.log')
+# Size-based rotation by default; a TimedRotatingFileHandler 'when'
+# (e.g. 'midnight', 'H') rotates on time instead
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', '')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', 5))
+# Human-readable copy on stderr
+LOG_CONSOLE = os.environ.get('LOG_CONSOLE', '1') in ('1', 'true', 'yes')
+# Records waiting for the writer thread; further ones are dropped, never waited for
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Share of INFO/DEBUG records kept per logger (and its children), e.g.
+# "httpx=0.1,telegram.ext=0.5"; warnings and errors are always kept
+LOG_SAMPLE = os.environ.get('LOG_SAMPLE', 'httpx=0.1')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_traceback_formatter = logging.Formatter()
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, rate = item.partition('=')
+        rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra={...} fields are kept as keys"""
+
+    def __init__(self, role):
+        super().__init__()
+        self.role = role
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'role': self.role,
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of INFO/DEBUG records from chatty loggers"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first, so 'telegram.ext' wins over 'telegram'
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + '.'):
+                if random.random() < rate:
+                    return True
+                self.sampled_out += 1
+                return False
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records (counting them) when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but the traceback stays separate from the message
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingPipeline:
+    """Root logger -> bounded queue -> one writer thread per process.
+
+    Producers (event loop, request threads) only format the message and
+    enqueue it; the file and console writes happen on the listener thread.
+    A forked child (gunicorn worker) gets its own queue, thread and file,
+    named after the lowest worker slot no live process holds, so recycled
+    workers reuse the files of the ones they replace.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._role = None
+        self._pid = None
+        self._handler = None
+        self._listener = None
+        self._slot_file = None
+        self._sampler = SamplingFilter(parse_sample_rates(LOG_SAMPLE))
+
+    def configure(self, role):
+        with self._lock:
+            if self._role == role and self._pid == os.getpid():
+                return
+            self._stop_listener()
+            self._role = role
+            self._start(role)
+
+    def _log_path(self, role):
+        base, ext = os.path.splitext(LOG_FILE)
+        return f"{base}-{role}{ext or '.log'}"
+
+    def _start(self, role):
+        self._pid = os.getpid()
+        outputs = []
+        if LOG_FILE:
+            path = self._log_path(role)
+            if LOG_ROTATE_WHEN:
+                file_handler = TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS,
+                                                        encoding='utf-8')
+            else:
+                file_handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                                   encoding='utf-8')
+            file_handler.setFormatter(JsonFormatter(role))
+            outputs.append(file_handler)
+        if LOG_CONSOLE:
+            console = logging.StreamHandler(sys.stderr)
+            console.setFormatter(logging.Formatter(TEXT_FORMAT))
+            outputs.append(console)
+
+        handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(self._sampler)
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+
+        self._handler = handler
+        self._listener = QueueListener(handler.queue, *outputs, respect_handler_level=True)
+        self._listener.start()
+
+    def _stop_listener(self):
+        listener, self._listener = self._listener, None
+        if listener is None:
+            return
+        if self._pid == os.getpid():
+            listener.stop()  # writes what is still queued
+        for output in listener.handlers:
+            output.close()
+
+    def _claim_slot(self, role):
+        """Lowest free worker slot for ``role``; held (flock) until this process exits"""
+        if self._slot_file is not None:
+            self._slot_file.close()  # the parent's slot, inherited through fork
+            self._slot_file = None
+        if fcntl is None or not LOG_FILE:
+            return str(os.getpid())
+        for slot in itertools.count(1):
+            slot_file = open(self._log_path(f"{role}-{slot}") + '.lock', 'a')
+            try:
+                fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                slot_file.close()
+                continue
+            self._slot_file = slot_file
+            return str(slot)
+
+    def _after_fork(self):
+        # The writer thread did not survive the fork: new queue, thread and file
+        self._lock = threading.Lock()
+        if self._role is not None and self._listener is not None:
+            self._listener = None
+            self._start(f"{self._role}-{self._claim_slot(self._role)}")
+
+    def stop(self):
+        with self._lock:
+            self._stop_listener()
+
+    def stats(self):
+        handler = self._handler
+        return {
+            'role': self._role,
+            'queued': handler.queue.qsize() if handler else 0,
+            'dropped': handler.dropped if handler else 0,
+            'sampled_out': self._sampler.sampled_out,
+        }
+
+
+pipeline = LoggingPipeline()
+os.register_at_fork(after_in_child=pipeline._after_fork)
+atexit.register(pipeline.stop)
+
+
+def setup_logging(role):
+    """Send this process's logs through the pipeline, to datrix-<role>.log"""
+    pipeline.configure(role)
+
+
+def logging_stats():
+    return pipeline.stats()
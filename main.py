@@ -2,25 +2,33 @@
 # Clean DATRIX Bot + Web Dashboard (No Broadcast)
 
 import os
+import sys
+import signal
 import logging
 import threading
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, Response
 from functools import wraps
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, TypeHandler
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 import database as db
-
-# Logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('datrix.log'),
-        logging.StreamHandler()
-    ]
-)
+import async_db as adb
+import metrics
+import serving
+from metrics import InstrumentedHTTPXRequest, count_update, timed_handler
+from exports import render_export
+from events import EVENTS_RETRY_AFTER, EventBroker, TooManyClients
+import http_cache
+from http_cache import conditional
+from webhook import WEBHOOK_PATH, WebhookBridge, default_secret
+from outbound import PRIORITY_ADMIN, PRIORITY_REPLY, outbound
+from logging_setup import setup_logging
+from static_assets import AssetRegistry
+from bot_status import BotStatusProbe
+from update_processor import UserOrderedUpdateProcessor
+
+# Logging (configured per process by setup_logging, see logging_setup.py)
 logger = logging.getLogger(__name__)
 
 # Configuration
@@ -28,18 +36,38 @@ BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '7803291138:AAExEBQq9uZhq6X_ncI
 ADMIN_CHAT_ID = os.environ.get('ADMIN_TELEGRAM_ID', '811896458')
 WEB_USER = os.environ.get('WEB_USER', 'admin')
 WEB_PASS = os.environ.get('WEB_PASS', 'datrix2024')
-
-# Global variable to store current file info
-CURRENT_FILE = {
+# 'polling' runs the bot in its own process; 'webhook' takes updates on the web server
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or default_secret(BOT_TOKEN)
+# License expiry sweep: reminders this many days ahead, queued at this many per second
+LICENSE_REMIND_DAYS = int(os.environ.get('LICENSE_REMIND_DAYS', 3))
+LICENSE_REMINDER_RATE = float(os.environ.get('LICENSE_REMINDER_RATE', 10))
+LICENSE_SWEEP_MINUTES = int(os.environ.get('LICENSE_SWEEP_MINUTES', 60))
+
+# Shown by /api/file_info until the first release is uploaded
+NO_RELEASE = {
     'file_id': None,
-    'version': 'v2.1.6',
+    'version': None,
     'size': 'Unknown',
     'filename': 'DATRIX_Setup.exe',
-    'upload_date': None
+    'upload_date': None,
+    'download_count': 0
 }
 
 # =================== FLASK WEB APP ===================
-web_app = Flask(__name__)
+# /static is served by static_assets (fingerprinted, precompressed), not by Flask
+web_app = Flask(__name__, static_folder=None)
+# gzip/brotli for large JSON and HTML responses
+http_cache.init_app(web_app)
+# Per-route latency histograms
+metrics.init_app(web_app)
+
+# One producer per web process feeds every live dashboard
+event_broker = EventBroker(stats_loader=db.get_live_stats)
+# Dashboard page and assets, compressed once per process
+static_assets = AssetRegistry()
+# One getMe probe per process instead of one per browser
+bot_status = BotStatusProbe(BOT_TOKEN)
 
 def check_auth(username, password): 
     return username == WEB_USER and password == WEB_PASS
@@ -55,177 +83,15 @@ def login_required(f):
 
 @web_app.route('/')
 @login_required
-def dashboard(): 
-    # Try to load template, fallback to embedded HTML
-    try:
-        return render_template('dashboard.html')
-    except:
-        # Embedded dashboard if template not found
-        return """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>DATRIX Control Panel</title>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1">
-            <style>
-                * { margin: 0; padding: 0; box-sizing: border-box; }
-                body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif; background: #f8f9fa; }
-                .container { max-width: 1200px; margin: 0 auto; padding: 20px; }
-                .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; border-radius: 12px; margin-bottom: 30px; text-align: center; }
-                .header h1 { font-size: 2.5rem; margin-bottom: 10px; }
-                .header p { opacity: 0.9; font-size: 1.1rem; }
-                .stats { display: grid; grid-template-columns: repeat(auto-fit, minmax(250px, 1fr)); gap: 20px; margin-bottom: 30px; }
-                .stat { background: white; padding: 25px; border-radius: 12px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); text-align: center; }
-                .stat h3 { font-size: 2rem; margin-bottom: 5px; color: #333; }
-                .stat p { color: #666; font-weight: 500; }
-                .stat.users h3 { color: #3498db; }
-                .stat.active h3 { color: #2ecc71; }
-                .stat.licensed h3 { color: #e74c3c; }
-                .stat.downloads h3 { color: #f39c12; }
-                .section { background: white; border-radius: 12px; padding: 25px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-                .section h2 { margin-bottom: 20px; color: #333; }
-                .table { width: 100%; border-collapse: collapse; }
-                .table th, .table td { padding: 12px; text-align: left; border-bottom: 1px solid #eee; }
-                .table th { background: #f8f9fa; font-weight: 600; }
-                .table tr:hover { background: #f8f9fa; }
-                .btn { background: #3498db; color: white; border: none; padding: 8px 16px; border-radius: 6px; cursor: pointer; font-size: 14px; }
-                .btn:hover { background: #2980b9; }
-                .btn.success { background: #2ecc71; }
-                .btn.success:hover { background: #27ae60; }
-                .status.active { color: #2ecc71; font-weight: 600; }
-                .status.expired { color: #e74c3c; font-weight: 600; }
-                .loading { text-align: center; padding: 50px; color: #666; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🤖 DATRIX Control Panel</h1>
-                    <p>Bot Management & User Analytics Dashboard</p>
-                </div>
-                
-                <div class="stats">
-                    <div class="stat users">
-                        <h3 id="totalUsers">-</h3>
-                        <p>Total Users</p>
-                    </div>
-                    <div class="stat active">
-                        <h3 id="activeUsers">-</h3>
-                        <p>Active Users (24h)</p>
-                    </div>
-                    <div class="stat licensed">
-                        <h3 id="licensedUsers">-</h3>
-                        <p>Licensed Users</p>
-                    </div>
-                    <div class="stat downloads">
-                        <h3 id="downloads">-</h3>
-                        <p>Total Downloads</p>
-                    </div>
-                </div>
-                
-                <div class="section">
-                    <h2>📋 Users Management</h2>
-                    <div id="usersContainer">
-                        <div class="loading">Loading users data...</div>
-                    </div>
-                </div>
-            </div>
-            
-            <script>
-                // Load stats
-                fetch('/api/bot_stats')
-                    .then(r => r.json())
-                    .then(data => {
-                        document.getElementById('totalUsers').textContent = data.total_users || 0;
-                        document.getElementById('activeUsers').textContent = data.active_users || 0;
-                        document.getElementById('licensedUsers').textContent = data.licensed_users || 0;
-                        document.getElementById('downloads').textContent = data.downloads_today || 0;
-                    })
-                    .catch(e => console.error('Error loading stats:', e));
-                
-                // Load users
-                fetch('/api/datrix_users')
-                    .then(r => r.json())
-                    .then(users => {
-                        const container = document.getElementById('usersContainer');
-                        
-                        if (users.length === 0) {
-                            container.innerHTML = '<div class="loading">No users found</div>';
-                            return;
-                        }
-                        
-                        const table = `
-                            <table class="table">
-                                <thead>
-                                    <tr>
-                                        <th>User ID</th>
-                                        <th>Name</th>
-                                        <th>Company</th>
-                                        <th>License Status</th>
-                                        <th>Downloads</th>
-                                        <th>Last Seen</th>
-                                        <th>Actions</th>
-                                    </tr>
-                                </thead>
-                                <tbody>
-                                    ${users.map(user => `
-                                        <tr>
-                                            <td>${user.telegram_id}</td>
-                                            <td>${user.user_name || 'Unknown'}</td>
-                                            <td>${user.company_name || 'Not set'}</td>
-                                            <td class="status ${user.is_app_user ? 'active' : 'expired'}">
-                                                ${user.is_app_user ? '✅ Active' : '❌ Expired'}
-                                            </td>
-                                            <td>${user.total_downloads || 0}</td>
-                                            <td>${user.last_seen_formatted || 'Never'}</td>
-                                            <td>
-                                                <button class="btn" onclick="extendLicense(${user.telegram_id}, 30)">+30d</button>
-                                                <button class="btn success" onclick="extendLicense(${user.telegram_id}, 90)">+90d</button>
-                                            </td>
-                                        </tr>
-                                    `).join('')}
-                                </tbody>
-                            </table>
-                        `;
-                        
-                        container.innerHTML = table;
-                    })
-                    .catch(e => {
-                        console.error('Error loading users:', e);
-                        document.getElementById('usersContainer').innerHTML = '<div class="loading">Error loading users</div>';
-                    });
-                
-                function extendLicense(userId, days) {
-                    if (!confirm(`Extend license for user ${userId} by ${days} days?`)) return;
-                    
-                    fetch('/api/extend_license', {
-                        method: 'POST',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({user_id: userId, days: days})
-                    })
-                    .then(r => r.json())
-                    .then(data => {
-                        if (data.success) {
-                            alert('License extended successfully!');
-                            location.reload();
-                        } else {
-                            alert('Error: ' + (data.error || 'Unknown error'));
-                        }
-                    })
-                    .catch(e => {
-                        alert('Network error: ' + e.message);
-                    });
-                }
-                
-                // Refresh data every 30 seconds
-                setInterval(() => {
-                    location.reload();
-                }, 30000);
-            </script>
-        </body>
-        </html>
-        """
+def dashboard():
+    return static_assets.serve_page('dashboard.html')
+
+@web_app.route('/static/<path:filename>')
+@login_required
+def static_file(filename):
+    """Fingerprinted dashboard CSS/JS, cached by the browser for a year"""
+    return static_assets.serve_asset(filename)
+
 @web_app.route('/api/extend_license', methods=['POST'])
 @login_required
 def api_extend_license():
@@ -250,14 +116,102 @@ def api_extend_license():
         logger.error(f"Error extending license: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Most telegram_ids accepted by one bulk request
+BULK_LICENSE_MAX_IDS = int(os.environ.get('BULK_LICENSE_MAX_IDS', 10000))
+
+@web_app.route('/api/licenses/bulk_extend', methods=['POST'])
+@login_required
+def api_bulk_extend_licenses():
+    """Extend many licenses at once: by telegram_ids, company and/or expiring_before.
+
+    Every given filter must match. Users are notified through the outbound
+    queue unless ``notify`` is false.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON body required'}), 400
+
+    days = data.get('days', 30)
+    if not isinstance(days, int) or isinstance(days, bool) or not 1 <= days <= 3650:
+        return jsonify({'error': 'days must be an integer between 1 and 3650'}), 400
+
+    telegram_ids = data.get('telegram_ids')
+    if telegram_ids is not None:
+        if (not isinstance(telegram_ids, list) or len(telegram_ids) > BULK_LICENSE_MAX_IDS
+                or not all(isinstance(i, int) and not isinstance(i, bool) for i in telegram_ids)):
+            return jsonify({'error': f'telegram_ids must be a list of at most {BULK_LICENSE_MAX_IDS} integers'}), 400
+
+    company = data.get('company')
+    if company is not None and (not isinstance(company, str) or not company.strip()):
+        return jsonify({'error': 'company must be a non-empty string'}), 400
+
+    expiring_before = data.get('expiring_before')
+    if expiring_before is not None:
+        try:
+            expiring_before = datetime.strptime(expiring_before, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return jsonify({'error': 'expiring_before must be YYYY-MM-DD'}), 400
+
+    if telegram_ids is None and not company and expiring_before is None:
+        return jsonify({'error': 'Give telegram_ids, company or expiring_before'}), 400
+
+    message_for = None
+    if data.get('notify', True):
+        message_for = lambda result: license_granted_text(days, result['license_expires'].strftime('%Y-%m-%d'))
+
+    results = db.bulk_extend_licenses(
+        days,
+        telegram_ids=telegram_ids,
+        company=company and company.strip(),
+        expiring_before=expiring_before,
+        from_expiry=bool(data.get('from_expiry', False)),
+        message_for=message_for
+    )
+    if results is None:
+        return jsonify({'error': 'Failed to extend licenses'}), 500
+
+    for result in results:
+        for key in ('previous_expires', 'license_expires'):
+            if result.get(key):
+                result[key] = result[key].isoformat()
+    extended = sum(result['status'] == 'extended' for result in results)
+    return jsonify({
+        'success': True,
+        'extended': extended,
+        'notified': extended if message_for else 0,
+        'results': results
+    })
+
 @web_app.route('/api/file_info')
 @login_required
+@conditional('releases')
 def api_file_info():
     """Get current file info"""
-    return jsonify(CURRENT_FILE)
+    return jsonify(db.get_active_release(fresh=True) or NO_RELEASE)
+
+@web_app.route('/api/releases')
+@login_required
+@conditional('releases')
+def api_releases():
+    """Release history with per-version download counts"""
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify(db.get_releases(limit))
+
+@web_app.route('/api/releases/<int:release_id>/activate', methods=['POST'])
+@login_required
+def api_activate_release(release_id):
+    """Deliver an earlier release again"""
+    release = db.set_active_release(release_id)
+    if not release:
+        return jsonify({'error': 'Release not found'}), 404
+    return jsonify(release)
 
 @web_app.route('/api/bot_stats')
 @login_required
+@conditional('stats', max_age=60)
 def api_bot_stats():
     """Get basic bot statistics"""
     try:
@@ -272,20 +226,185 @@ def api_bot_stats():
             'licensed_users': 0
         })
 
+@web_app.route('/api/datrix_analytics')
+@login_required
+def api_datrix_analytics():
+    """Dashboard analytics (?range=24h|7d|30d|90d&granularity=hour|day)"""
+    try:
+        analytics = db.get_dashboard_analytics(
+            request.args.get('range', '7d'),
+            request.args.get('granularity') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if analytics is None:
+        return jsonify({'error': 'Failed to load analytics'}), 500
+    return jsonify(analytics)
+
+@web_app.route('/api/reconcile_stats', methods=['POST'])
+@login_required
+def api_reconcile_stats():
+    """Recount the stats counters and report any drift"""
+    result = db.reconcile_basic_stats()
+    if result is None:
+        return jsonify({'error': 'Failed to reconcile stats'}), 500
+    return jsonify(result)
+
+@web_app.route('/api/datrix_users')
+@login_required
+@conditional('users', max_age=3600)
+def api_datrix_users():
+    """Users list with keyset pagination (next page cursor in X-Next-Cursor)"""
+    args = request.args
+    try:
+        result = db.get_datrix_users_page(
+            limit=args.get('limit', 100, type=int),
+            cursor=args.get('cursor'),
+            sort=args.get('sort', 'last_seen'),
+            order=args.get('order', 'desc'),
+            license=args.get('license') or None,
+            company=args.get('company') or None,
+            active_hours=args.get('active_hours', type=float),
+            expiring_days=args.get('expiring_days', 7, type=int),
+            telegram_id=args.get('telegram_id', type=int)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if result is None:
+        return jsonify({'error': 'Failed to load users'}), 500
+
+    users, next_cursor = result
+    response = jsonify(users)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def export_response(rows, columns, name):
+    """Stream an export in the format requested by ?format=csv|ndjson&gzip=1"""
+    chunks, mimetype, extension = render_export(
+        rows, columns,
+        fmt=request.args.get('format', 'csv'),
+        gzip=request.args.get('gzip') in ('1', 'true', 'yes')
+    )
+    filename = f"{name}_{datetime.now().strftime('%Y-%m-%d')}.{extension}"
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no'
+    })
+
+@web_app.route('/api/export/users')
+@login_required
+def api_export_users():
+    """Stream all users as CSV/NDJSON"""
+    try:
+        return export_response(db.iter_users_export(), db.USER_EXPORT_COLUMNS, 'datrix_users')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@web_app.route('/api/export/activity')
+@login_required
+def api_export_activity():
+    """Stream user activity as CSV/NDJSON (?since=&until=&telegram_id=&activity_type=)"""
+    args = request.args
+    try:
+        since = datetime.fromisoformat(args['since']) if args.get('since') else None
+        until = datetime.fromisoformat(args['until']) if args.get('until') else None
+        rows = db.iter_activity_export(
+            since=since,
+            until=until,
+            telegram_id=args.get('telegram_id', type=int),
+            activity_type=args.get('activity_type') or None
+        )
+        return export_response(rows, db.ACTIVITY_EXPORT_COLUMNS, 'datrix_activity')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
 # Original compatibility routes (empty implementations)
 @web_app.route('/api/bot_users')
 @login_required
 def api_bot_users(): 
     return api_datrix_users()
 
+@web_app.route('/metrics')
+@login_required
+def prometheus_metrics():
+    """Prometheus metrics of every process (web workers and bot)"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+@web_app.route('/api/query_stats')
+@login_required
+def api_query_stats():
+    """Statement counts and timings per database function (this worker only)"""
+    return jsonify({'pid': os.getpid(), 'functions': db.get_query_stats()})
+
+@web_app.route('/api/events')
+@login_required
+def api_events():
+    """Server-Sent Events stream of user, license, download and stats changes"""
+    try:
+        client = event_broker.subscribe()
+    except TooManyClients:
+        # No thread to spare for another stream; the dashboard retries later
+        return Response(
+            f"retry: {EVENTS_RETRY_AFTER * 1000}\n\n",
+            status=503,
+            mimetype='text/event-stream',
+            headers={'Retry-After': str(EVENTS_RETRY_AFTER), 'Cache-Control': 'no-cache'}
+        )
+    return Response(
+        event_broker.stream(client),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@web_app.route('/api/events/stats')
+@login_required
+def api_events_stats():
+    return jsonify(event_broker.stats())
+
+@web_app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Telegram update delivery in webhook mode (authenticated by secret token)"""
+    if BOT_MODE != 'webhook':
+        return jsonify({'error': 'Webhook mode is disabled'}), 404
+    if not webhook_bridge.check_secret(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+        return jsonify({'error': 'Forbidden'}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid update'}), 400
+    # Non-2xx makes Telegram redeliver, possibly to another worker
+    if not webhook_bridge.submit(data):
+        return jsonify({'error': 'Bot not running'}), 503
+    return jsonify({'ok': True})
+
+@web_app.route('/api/webhook_stats')
+@login_required
+def api_webhook_stats():
+    return jsonify({'mode': BOT_MODE, **webhook_bridge.stats()})
+
+@web_app.route('/api/bot_status')
+@login_required
+def api_bot_status():
+    """Cached getMe result; ?refresh=1 probes again unless a result is only seconds old"""
+    return jsonify(bot_status.status(refresh=request.args.get('refresh') == '1'))
+
+@web_app.route('/api/outbound_stats')
+@login_required
+def api_outbound_stats():
+    """Queued message backlog (and this worker's scheduler in webhook mode)"""
+    return jsonify({'queue': db.get_outbound_queue_stats(), 'scheduler': outbound.stats()})
+
 # =================== TELEGRAM BOT ===================
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Register user
-    db.add_or_update_user(user.id, user.username, user.first_name)
-    db.log_user_activity(user.id, 'start', 'User started bot')
+    await adb.add_or_update_user(user.id, user.username, user.first_name)
+    await adb.log_user_activity(user.id, 'start', 'User started bot')
     
     welcome_message = """🤖 **مرحباً بك في DATRIX Bot**
 
@@ -301,14 +420,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 💡 **للبدء:** استخدم `/register_company` لتسجيل شركتك"""
     
-    await update.message.reply_text(welcome_message, parse_mode='Markdown')
+    await outbound.reply(update, welcome_message, parse_mode='Markdown')
     logger.info(f"✅ User {user.id} started the bot")
 
 async def register_company(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if len(context.args) < 2:
-        await update.message.reply_text(
+        await outbound.reply(update,
             "📝 **استخدام الأمر:**\n"
             "`/register_company \"اسم الشركة\" google_sheet_id`\n\n"
             "**مثال:**\n"
@@ -334,16 +453,16 @@ async def register_company(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sheet_id = context.args[1] if len(context.args) > 1 else None
     
     if not sheet_id:
-        await update.message.reply_text("❌ **يرجى إدخال Google Sheet ID**", parse_mode='Markdown')
+        await outbound.reply(update, "❌ **يرجى إدخال Google Sheet ID**", parse_mode='Markdown')
         return
     
     # Update user info
-    success = db.update_user_company(user.id, company_name, sheet_id)
+    success = await adb.update_user_company(user.id, company_name, sheet_id)
     
     if success:
-        db.log_user_activity(user.id, 'register_company', f'{company_name} - {sheet_id}')
+        await adb.log_user_activity(user.id, 'register_company', f'{company_name} - {sheet_id}')
         
-        await update.message.reply_text(
+        await outbound.reply(update,
             f"✅ **تم تسجيل بيانات الشركة!**\n\n"
             f"🏢 **الشركة:** {company_name}\n"
             f"📊 **Sheet ID:** `{sheet_id}`\n\n"
@@ -359,26 +478,24 @@ async def register_company(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📊 `{sheet_id}`
 📅 {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
         
-        try:
-            await context.bot.send_message(ADMIN_CHAT_ID, admin_msg, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Failed to notify admin: {e}")
+        # Queued: delivered (and retried) by the outbound scheduler
+        await outbound.send_message(ADMIN_CHAT_ID, admin_msg, priority=PRIORITY_ADMIN, parse_mode='Markdown')
     else:
-        await update.message.reply_text("❌ حدث خطأ في التسجيل. يرجى المحاولة مرة أخرى.")
+        await outbound.reply(update, "❌ حدث خطأ في التسجيل. يرجى المحاولة مرة أخرى.")
 
 async def request_license(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    user_info = db.get_user_info(user.id)
+    user_info = await adb.get_user_info(user.id)
     
     if not user_info or not user_info.get('company_name'):
-        await update.message.reply_text(
+        await outbound.reply(update,
             "❌ **يجب تسجيل بيانات الشركة أولاً**\n\n"
             "استخدم: `/register_company \"اسم الشركة\" sheet_id`",
             parse_mode='Markdown'
         )
         return
     
-    db.log_user_activity(user.id, 'request_license', f"Company: {user_info['company_name']}")
+    await adb.log_user_activity(user.id, 'request_license', f"Company: {user_info['company_name']}")
     
     # Create admin keyboard
     keyboard = [
@@ -403,12 +520,19 @@ async def request_license(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 ⏰ **يرجى اختيار فترة التمديد:**"""
     
-    try:
-        await context.bot.send_message(ADMIN_CHAT_ID, admin_msg, reply_markup=markup, parse_mode='Markdown')
-        await update.message.reply_text("✅ **تم إرسال طلب التمديد للمراجعة**\n\n📧 سيتم إشعارك فور الموافقة", parse_mode='Markdown')
-    except Exception as e:
-        logger.error(f"Failed to send license request: {e}")
-        await update.message.reply_text("❌ حدث خطأ في إرسال الطلب")
+    # Queued: delivered (and retried) by the outbound scheduler, which logs a give-up
+    await outbound.send_message(ADMIN_CHAT_ID, admin_msg, priority=PRIORITY_ADMIN, reply_markup=markup,
+                                parse_mode='Markdown')
+    await outbound.reply(update, "✅ **تم إرسال طلب التمديد للمراجعة**\n\n📧 سيتم إشعارك فور الموافقة", parse_mode='Markdown')
+
+def license_granted_text(days, expiry_date):
+    """Message telling a user their license was granted or extended"""
+    return (
+        f"🎉 **تم قبول طلب الترخيص!**\n\n"
+        f"⏰ **المدة الممنوحة:** {days} يوم\n"
+        f"📅 **ينتهي في:** {expiry_date}\n\n"
+        f"✅ يمكنك الآن تحميل DATRIX باستخدام `/datrix_app`"
+    )
 
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -424,39 +548,26 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
         
         if action == "extend_deny":
             await query.edit_message_text(f"❌ **تم رفض طلب الترخيص للمستخدم {user_id}**")
-            try:
-                await context.bot.send_message(user_id, "❌ **تم رفض طلب تمديد الترخيص**\n\nيرجى التواصل مع الإدارة للمزيد من المعلومات.")
-            except:
-                pass
+            await outbound.send_message(user_id, "❌ **تم رفض طلب تمديد الترخيص**\n\nيرجى التواصل مع الإدارة للمزيد من المعلومات.")
         else:
             days_map = {"extend_30": 30, "extend_90": 90, "extend_365": 365}
             days = days_map.get(action, 30)
             
-            success = db.extend_user_license(user_id, days)
+            success = await adb.extend_user_license(user_id, days)
             
             if success:
                 expiry_date = (datetime.now().date() + timedelta(days=days)).strftime('%Y-%m-%d')
                 await query.edit_message_text(f"✅ **تم منح ترخيص {days} يوم للمستخدم {user_id}**\n📅 **ينتهي في:** {expiry_date}")
-                try:
-                    await context.bot.send_message(
-                        user_id,
-                        f"🎉 **تم قبول طلب الترخيص!**\n\n"
-                        f"⏰ **المدة الممنوحة:** {days} يوم\n"
-                        f"📅 **ينتهي في:** {expiry_date}\n\n"
-                        f"✅ يمكنك الآن تحميل DATRIX باستخدام `/datrix_app`",
-                        parse_mode='Markdown'
-                    )
-                except:
-                    pass
+                await outbound.send_message(user_id, license_granted_text(days, expiry_date), parse_mode='Markdown')
             else:
                 await query.edit_message_text(f"❌ **فشل في منح الترخيص للمستخدم {user_id}**")
 
 async def my_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    user_info = db.get_user_info(user.id)
+    user_info = await adb.get_user_info(user.id)
     
     if not user_info:
-        await update.message.reply_text("❌ **لم يتم العثور على بياناتك**\n\nاستخدم `/start` للتسجيل", parse_mode='Markdown')
+        await outbound.reply(update, "❌ **لم يتم العثور على بياناتك**\n\nاستخدم `/start` للتسجيل", parse_mode='Markdown')
         return
     
     # Calculate license status
@@ -484,53 +595,54 @@ async def my_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/request_license` - طلب تمديد الترخيص
 • `/datrix_app` - تحميل التطبيق (إذا كان الترخيص نشط)"""
     
-    await update.message.reply_text(status_msg, parse_mode='Markdown')
+    await outbound.reply(update, status_msg, parse_mode='Markdown')
 
 async def get_datrix_app(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Check if user exists
-    user_info = db.get_user_info(user.id)
+    user_info = await adb.get_user_info(user.id)
     if not user_info:
-        await update.message.reply_text("❌ **يجب التسجيل أولاً**\nاستخدم `/start`", parse_mode='Markdown')
+        await outbound.reply(update, "❌ **يجب التسجيل أولاً**\nاستخدم `/start`", parse_mode='Markdown')
         return
     
     # Check license
     if user_info.get('license_expires'):
         if user_info['license_expires'] <= datetime.now().date():
-            await update.message.reply_text(
+            await outbound.reply(update,
                 "🔒 **الترخيص منتهي الصلاحية**\n\nاستخدم `/request_license` لطلب تمديد الترخيص",
                 parse_mode='Markdown'
             )
             return
     else:
-        await update.message.reply_text(
+        await outbound.reply(update,
             "🔒 **لا يوجد ترخيص نشط**\n\nاستخدم `/request_license` لطلب ترخيص جديد",
             parse_mode='Markdown'
         )
         return
     
-    # Check if file is available
-    if not CURRENT_FILE.get('file_id'):
-        await update.message.reply_text("❌ **التطبيق غير متاح حالياً**\n\nيرجى المحاولة لاحقاً أو التواصل مع الإدارة", parse_mode='Markdown')
+    # Check if file is available (in-memory copy of the release registry)
+    release = await adb.get_active_release()
+    if not release:
+        await outbound.reply(update, "❌ **التطبيق غير متاح حالياً**\n\nيرجى المحاولة لاحقاً أو التواصل مع الإدارة", parse_mode='Markdown')
         return
     
     try:
-        # Send the file directly
-        await context.bot.send_document(
-            chat_id=update.effective_chat.id,
-            document=CURRENT_FILE['file_id'],
-            caption=f"✅ **{CURRENT_FILE['filename']}**\n\n🔢 **الإصدار:** {CURRENT_FILE['version']}\n💾 **الحجم:** {CURRENT_FILE['size']}\n📅 **تاريخ الرفع:** {CURRENT_FILE['upload_date']}\n\n🚀 **استمتع باستخدام DATRIX!**"
+        # Send the file directly (waits for delivery, so failures are reported below)
+        await outbound.send(
+            update.effective_chat.id, 'sendDocument', PRIORITY_REPLY, wait=True,
+            document=release['file_id'],
+            caption=f"✅ **{release['filename']}**\n\n🔢 **الإصدار:** {release['version']}\n💾 **الحجم:** {release['size']}\n📅 **تاريخ الرفع:** {release['upload_date']}\n\n🚀 **استمتع باستخدام DATRIX!**"
         )
         
         # Track download
-        db.track_download(user.id)
+        await adb.track_download(user.id, release)
         
         logger.info(f"✅ DATRIX delivered to user {user.id} ({user.username})")
         
     except Exception as e:
         logger.error(f"Error delivering file to {user.id}: {e}")
-        await update.message.reply_text("❌ **خطأ في التحميل**\n\nيرجى المحاولة مرة أخرى أو التواصل مع الإدارة", parse_mode='Markdown')
+        await outbound.reply(update, "❌ **خطأ في التحميل**\n\nيرجى المحاولة مرة أخرى أو التواصل مع الإدارة", parse_mode='Markdown')
 
 # Admin commands
 async def set_file_waiting(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -540,11 +652,12 @@ async def set_file_waiting(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     version = context.args[0] if context.args else "v2.1.6"
     
-    # Set waiting state
-    context.user_data['waiting_for_file'] = True
-    context.user_data['file_version'] = version
+    # Set waiting state (in the database: the document may reach another worker)
+    if not await adb.expect_release_upload(update.effective_user.id, version):
+        await outbound.reply(update, "❌ **خطأ في حفظ الحالة**", parse_mode='Markdown')
+        return
     
-    await update.message.reply_text(
+    await outbound.reply(update,
         f"✅ **جاهز لاستقبال ملف DATRIX {version}**\n\n"
         f"📤 أرسل الملف الآن وسيتم حفظه تلقائياً",
         parse_mode='Markdown'
@@ -558,62 +671,66 @@ async def handle_file_upload(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if user_id != ADMIN_CHAT_ID:
         return
     
-    # Check if admin is waiting to upload a file
-    if not context.user_data.get('waiting_for_file'):
-        return
-    
     document = update.message.document
     if not document:
         return
     
+    # Check if admin is waiting to upload a file
+    version = await adb.get_pending_upload(update.effective_user.id)
+    if not version:
+        return
+    
     try:
-        # Save file info globally
-        CURRENT_FILE.update({
-            'file_id': document.file_id,
-            'version': context.user_data.get('file_version', 'v2.1.6'),
-            'size': f"{document.file_size // (1024*1024)}MB" if document.file_size else "Unknown",
-            'filename': document.file_name or 'DATRIX_Setup.exe',
-            'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M')
-        })
-        
-        # Clear waiting state
-        context.user_data['waiting_for_file'] = False
+        # Save file info in the release registry (shared by every process)
+        release = await adb.publish_release(
+            version,
+            document.file_id,
+            file_unique_id=document.file_unique_id,
+            filename=document.file_name or 'DATRIX_Setup.exe',
+            file_size=document.file_size,
+            uploaded_by=update.effective_user.id
+        )
+        if not release:
+            await outbound.reply(update, "❌ **خطأ في حفظ الملف**", parse_mode='Markdown')
+            return
         
-        await update.message.reply_text(
+        await outbound.reply(update,
             f"✅ **تم حفظ الملف بنجاح!**\n\n"
-            f"📄 **الملف:** {CURRENT_FILE['filename']}\n"
-            f"🔢 **الإصدار:** {CURRENT_FILE['version']}\n"
-            f"💾 **الحجم:** {CURRENT_FILE['size']}\n"
-            f"📅 **تاريخ الرفع:** {CURRENT_FILE['upload_date']}\n\n"
+            f"📄 **الملف:** {release['filename']}\n"
+            f"🔢 **الإصدار:** {release['version']}\n"
+            f"💾 **الحجم:** {release['size']}\n"
+            f"📅 **تاريخ الرفع:** {release['upload_date']}\n\n"
             f"🚀 **الملف متاح الآن للمستخدمين المرخصين!**",
             parse_mode='Markdown'
         )
         
-        logger.info(f"✅ Admin uploaded new file: {CURRENT_FILE['filename']} ({CURRENT_FILE['version']})")
+        logger.info(f"✅ Admin uploaded new file: {release['filename']} ({release['version']})")
         
     except Exception as e:
         logger.error(f"Error handling file upload: {e}")
-        await update.message.reply_text("❌ **خطأ في حفظ الملف**", parse_mode='Markdown')
+        await outbound.reply(update, "❌ **خطأ في حفظ الملف**", parse_mode='Markdown')
 
 async def current_file_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show current file info (admin only)"""
     if str(update.effective_user.id) != ADMIN_CHAT_ID:
         return
     
-    if CURRENT_FILE.get('file_id'):
+    release = await adb.get_active_release()
+    if release:
         info = f"""📁 **معلومات الملف الحالي:**
 
-📄 **اسم الملف:** {CURRENT_FILE['filename']}
-🔢 **الإصدار:** {CURRENT_FILE['version']}
-💾 **الحجم:** {CURRENT_FILE['size']}
-📅 **تاريخ الرفع:** {CURRENT_FILE['upload_date']}
-🆔 **File ID:** `{CURRENT_FILE['file_id'][:20]}...`
+📄 **اسم الملف:** {release['filename']}
+🔢 **الإصدار:** {release['version']}
+💾 **الحجم:** {release['size']}
+📅 **تاريخ الرفع:** {release['upload_date']}
+📦 **التحميلات:** {release['download_count']}
+🆔 **File ID:** `{release['file_id'][:20]}...`
 
 ✅ **الحالة:** متاح للتحميل من قبل المستخدمين المرخصين"""
     else:
         info = "❌ **لا يوجد ملف محفوظ حالياً**\n\nاستخدم `/set_file [version]` ثم أرسل الملف لرفع نسخة جديدة"
     
-    await update.message.reply_text(info, parse_mode='Markdown')
+    await outbound.reply(update, info, parse_mode='Markdown')
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show admin statistics"""
@@ -621,7 +738,8 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        stats = db.get_basic_stats()
+        stats = await adb.get_basic_stats()
+        release = await adb.get_active_release() or NO_RELEASE
         
         stats_msg = f"""📊 **إحصائيات DATRIX Bot**
 
@@ -634,16 +752,16 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • إجمالي التحميلات: {stats['downloads_today']}
 
 📁 **الملف الحالي:**
-• الإصدار: {CURRENT_FILE.get('version', 'غير محدد')}
-• الحالة: {'✅ متاح' if CURRENT_FILE.get('file_id') else '❌ غير متاح'}
+• الإصدار: {release['version'] or 'غير محدد'}
+• الحالة: {'✅ متاح' if release['file_id'] else '❌ غير متاح'}
 
 📅 **التاريخ:** {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
         
-        await update.message.reply_text(stats_msg, parse_mode='Markdown')
+        await outbound.reply(update, stats_msg, parse_mode='Markdown')
         
     except Exception as e:
         logger.error(f"Error getting admin stats: {e}")
-        await update.message.reply_text("❌ خطأ في جلب الإحصائيات")
+        await outbound.reply(update, "❌ خطأ في جلب الإحصائيات")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if str(update.effective_user.id) == ADMIN_CHAT_ID:
@@ -688,70 +806,130 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **تحتاج مساعدة؟**
 تواصل مع فريق الدعم إذا واجهت أي مشاكل."""
     
-    await update.message.reply_text(help_text, parse_mode='Markdown')
+    await outbound.reply(update, help_text, parse_mode='Markdown')
 
 # =================== MAIN FUNCTION ===================
 
+async def database_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    """Job: create upcoming activity partitions and expire old ones"""
+    await adb.run_database_maintenance()
+
+def license_expiring_text(expires):
+    days_left = (expires - datetime.now().date()).days
+    return (
+        f"⏰ **ترخيص DATRIX ينتهي قريباً**\n\n"
+        f"📅 **ينتهي في:** {expires.strftime('%Y-%m-%d')} ({days_left} يوم متبقي)\n\n"
+        f"استخدم `/request_license` لطلب تمديد الترخيص"
+    )
+
+def license_expired_text(expires):
+    return (
+        f"🔒 **انتهت صلاحية ترخيص DATRIX**\n\n"
+        f"📅 **انتهى في:** {expires.strftime('%Y-%m-%d')}\n\n"
+        f"استخدم `/request_license` لطلب تمديد الترخيص"
+    )
+
+async def license_expiry_sweep(context: ContextTypes.DEFAULT_TYPE):
+    """Job: mark lapsed licenses expired and queue reminders for those ending soon"""
+    await adb.sweep_license_expiry(
+        LICENSE_REMIND_DAYS, license_expired_text, license_expiring_text, send_rate=LICENSE_REMINDER_RATE
+    )
+
+async def post_init(application: Application):
+    """Start sending queued and new messages once the bot is initialized"""
+    outbound.start(application.bot)
+
+async def post_shutdown(application: Application):
+    """Store unsent messages, then release database resources when the bot stops"""
+    await outbound.stop()
+    await adb.shutdown()
+
+def build_application(request=None):
+    """Create the bot Application with every handler and job registered.
+    
+    ``request`` replaces the Bot API transport (benchmark.py passes a fake one).
+    """
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Bot API latency and errors per method (see metrics.py)
+        .request(request or InstrumentedHTTPXRequest(connection_pool_size=256))
+        .get_updates_request(request or InstrumentedHTTPXRequest())
+        # Different users' updates in parallel, each user's in order (see update_processor.py)
+        .concurrent_updates(UserOrderedUpdateProcessor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Count every update before the handlers see it
+    application.add_handler(TypeHandler(Update, count_update), group=-1)
+    
+    # Add user handlers
+    application.add_handler(CommandHandler("start", timed_handler("start", start)))
+    application.add_handler(CommandHandler("register_company", timed_handler("register_company", register_company)))
+    application.add_handler(CommandHandler("request_license", timed_handler("request_license", request_license)))
+    application.add_handler(CommandHandler("my_status", timed_handler("my_status", my_status)))
+    application.add_handler(CommandHandler("datrix_app", timed_handler("datrix_app", get_datrix_app)))
+    application.add_handler(CommandHandler("help", timed_handler("help", help_command)))
+    
+    # Add admin handlers
+    application.add_handler(CommandHandler("set_file", timed_handler("set_file", set_file_waiting)))
+    application.add_handler(CommandHandler("current_file", timed_handler("current_file", current_file_info)))
+    application.add_handler(CommandHandler("admin_stats", timed_handler("admin_stats", admin_stats)))
+    
+    # File upload handler (admin only)
+    application.add_handler(MessageHandler(filters.Document.ALL, timed_handler("file_upload", handle_file_upload)))
+    
+    # Callback handler for license approval
+    application.add_handler(CallbackQueryHandler(timed_handler("callback_query", callback_query_handler)))
+    
+    # Background jobs
+    application.job_queue.run_repeating(database_maintenance, interval=timedelta(hours=6), first=60)
+    application.job_queue.run_repeating(
+        license_expiry_sweep, interval=timedelta(minutes=LICENSE_SWEEP_MINUTES), first=120
+    )
+    
+    return application
+
+# Webhook mode: every web worker runs its own Application (see webhook.py)
+webhook_bridge = WebhookBridge(build_application, WEBHOOK_SECRET)
+
+def run_bot_process():
+    """Polling-mode bot process; restarted by the supervisor if it dies"""
+    setup_logging('bot')
+    try:
+        build_application().run_polling(drop_pending_updates=True)
+    except Exception as e:
+        logger.error(f"❌ Bot process error: {e}")
+        sys.exit(1)
+
 def main():
+    setup_logging('web')
+    # Before any metric is used, so every process shares one samples directory
+    metrics.setup()
     try:
         # Initialize database
         db.initialize_simple_database()
         
-        # Create Telegram application
-        application = Application.builder().token(BOT_TOKEN).build()
-        
-        # Add user handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("register_company", register_company))
-        application.add_handler(CommandHandler("request_license", request_license))
-        application.add_handler(CommandHandler("my_status", my_status))
-        application.add_handler(CommandHandler("datrix_app", get_datrix_app))
-        application.add_handler(CommandHandler("help", help_command))
-        
-        # Add admin handlers
-        application.add_handler(CommandHandler("set_file", set_file_waiting))
-        application.add_handler(CommandHandler("current_file", current_file_info))
-        application.add_handler(CommandHandler("admin_stats", admin_stats))
-        
-        # File upload handler (admin only)
-        application.add_handler(MessageHandler(filters.Document.ALL, handle_file_upload))
-        
-        # Callback handler for license approval
-        application.add_handler(CallbackQueryHandler(callback_query_handler))
-        
         print("🚀 DATRIX Bot + Web Dashboard Starting...")
         print(f"🤖 Bot Token: {BOT_TOKEN[:10]}...")
         print(f"👤 Admin ID: {ADMIN_CHAT_ID}")
         print(f"🌐 Web User: {WEB_USER}")
+        print(f"📡 Bot Mode: {BOT_MODE}")
+        print(f"🖥️ Web Server: {serving.WEB_SERVER}")
         print("✅ System ready!")
         
-        # Start bot in a separate process using multiprocessing
-        import multiprocessing
-        import asyncio
-        
-        def run_bot_process():
-            """Run bot in separate process"""
-            try:
-                # Create new event loop for this process
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                # Run the bot
-                application.run_polling(drop_pending_updates=True)
-            except Exception as e:
-                print(f"❌ Bot process error: {e}")
+        # SIGTERM: stop serving, drain webhook updates, stop the bot process
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
         
-        # Start bot process
-        bot_process = multiprocessing.Process(target=run_bot_process, daemon=True)
-        bot_process.start()
-        
-        # Start web app in main process
-        web_app.run(
-            host='0.0.0.0', 
-            port=int(os.environ.get('PORT', 8080)),
-            debug=False,
-            use_reloader=False
-        )
+        if BOT_MODE == 'webhook':
+            # Updates arrive on the web server, in every worker
+            serving.serve(web_app, on_worker_start=webhook_bridge.start, on_worker_exit=webhook_bridge.stop)
+        else:
+            # Bot polls in its own process, restarted automatically if it dies
+            bot_supervisor = serving.ProcessSupervisor('bot', run_bot_process)
+            serving.serve(web_app, supervisors=[bot_supervisor])
         
     except Exception as e:
         logger.error(f"Failed to start: {e}")
@@ -0,0 +1,300 @@
+# metrics.py
+# Prometheus metrics shared by the web, bot and gunicorn worker processes
+
+import os
+import sys
+import time
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+from functools import wraps
+
+from telegram import Update
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Every process writes its samples to files in one directory and /metrics
+# (served by any of them) sums them up. setup() picks the directory before
+# prometheus_client is first imported; children inherit it through the
+# environment. Without PROMETHEUS_MULTIPROC_DIR it creates a temporary one,
+# removed when the process that created it exits; a configured directory
+# is only ever cleaned by clear_stale_files().
+_owner_pid = None
+_temp_dir = None
+_lock = threading.Lock()
+
+
+def setup():
+    """Choose the shared samples directory (idempotent).
+
+    main() and serving.serve() call this before any metric is used.
+    Without it, metrics are kept in this process's memory only.
+    """
+    global _owner_pid, _temp_dir
+    if 'prometheus_client' in sys.modules and not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        logger.warning("prometheus_client was imported before metrics.setup(); samples stay per process")
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    else:
+        _owner_pid = os.getpid()
+        _temp_dir = tempfile.mkdtemp(prefix='datrix-metrics-')
+        os.environ['PROMETHEUS_MULTIPROC_DIR'] = _temp_dir
+
+
+class LazyMetric:
+    """A prometheus_client metric, created the first time it is used.
+
+    Modules define and label metrics at import time, before setup() ran;
+    the real metric (and prometheus_client itself) comes later.
+    """
+
+    def __init__(self, kind, *args, **kwargs):
+        self._spec = (kind, args, kwargs)
+        self._metric = None
+
+    def _real(self):
+        if self._metric is None:
+            import prometheus_client
+            with _lock:
+                if self._metric is None:
+                    kind, args, kwargs = self._spec
+                    self._metric = getattr(prometheus_client, kind)(*args, **kwargs)
+        return self._metric
+
+    def labels(self, *args, **kwargs):
+        return LazyChild(self, args, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._real(), name)
+
+
+class LazyChild:
+    """``metric.labels(...)`` of a LazyMetric"""
+
+    def __init__(self, parent, args, kwargs):
+        self._parent = parent
+        self._labels = (args, kwargs)
+        self._child = None
+
+    def __getattr__(self, name):
+        if self._child is None:
+            args, kwargs = self._labels
+            self._child = self._parent._real().labels(*args, **kwargs)
+        return getattr(self._child, name)
+
+
+# =================== METRICS ===================
+
+BOT_UPDATES = LazyMetric(
+    'Counter', 'datrix_bot_updates_total', 'Telegram updates received', ['type']
+)
+BOT_HANDLER_SECONDS = LazyMetric(
+    'Histogram', 'datrix_bot_handler_seconds', 'Bot handler latency', ['handler']
+)
+BOT_HANDLER_ERRORS = LazyMetric(
+    'Counter', 'datrix_bot_handler_errors_total', 'Bot handlers that raised', ['handler']
+)
+HTTP_REQUEST_SECONDS = LazyMetric(
+    'Histogram', 'datrix_http_request_seconds', 'Web request latency', ['route', 'method', 'status']
+)
+DB_QUERY_SECONDS = LazyMetric(
+    'Histogram', 'datrix_db_query_seconds', 'Latency of database.py functions', ['function']
+)
+DB_ROWS = LazyMetric(
+    'Counter', 'datrix_db_rows_total', 'Rows returned or changed by statements', ['function']
+)
+DB_SLOW_QUERIES = LazyMetric(
+    'Counter', 'datrix_db_slow_queries_total', 'Statements over SLOW_QUERY_MS', ['function']
+)
+DB_ERRORS = LazyMetric(
+    'Counter', 'datrix_db_errors_total', 'Failed checkouts and queries', ['function']
+)
+DB_POOL_EVENTS = LazyMetric(
+    'Counter', 'datrix_db_pool_events_total', 'Connection pool events', ['event']
+)
+DB_POOL_WAIT_SECONDS = LazyMetric(
+    'Histogram', 'datrix_db_pool_wait_seconds', 'Time spent waiting for a pooled connection'
+)
+DB_POOL_CONNECTIONS = LazyMetric(
+    'Gauge', 'datrix_db_pool_connections', 'Pooled connections by state (summed over live processes)',
+    ['state'], multiprocess_mode='livesum'
+)
+TELEGRAM_API_SECONDS = LazyMetric(
+    'Histogram', 'datrix_telegram_api_seconds', 'Telegram Bot API call latency', ['method']
+)
+TELEGRAM_API_ERRORS = LazyMetric(
+    'Counter', 'datrix_telegram_api_errors_total', 'Failed Telegram Bot API calls', ['method', 'reason']
+)
+BOT_UPDATES_IN_FLIGHT = LazyMetric(
+    'Gauge', 'datrix_bot_updates_in_flight', 'Updates being handled or waiting for their turn',
+    ['state'], multiprocess_mode='livesum'
+)
+OUTBOUND_MESSAGES = LazyMetric(
+    'Counter', 'datrix_outbound_messages_total', 'Outbound scheduler outcomes', ['result']
+)
+ACTIVITY_DEFAULT_ROWS = LazyMetric(
+    'Gauge', 'datrix_activity_default_partition_rows', 'user_activity rows outside every monthly partition',
+    multiprocess_mode='mostrecent'
+)
+
+# The database.py function currently running in this thread
+_current = threading.local()
+
+
+def current_query():
+    return getattr(_current, 'function', None) or 'unknown'
+
+
+# =================== INSTRUMENTATION ===================
+
+def timed_query(fn):
+    """Time a database.py function; pool errors inside it are counted under its name"""
+    name = fn.__name__
+    histogram = DB_QUERY_SECONDS.labels(function=name)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_current, 'function', None)
+        _current.function = outer or name
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            _current.function = outer
+    return wrapper
+
+
+def timed_handler(name, callback):
+    """Wrap an async bot handler callback with a latency histogram"""
+    histogram = BOT_HANDLER_SECONDS.labels(handler=name)
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            BOT_HANDLER_ERRORS.labels(handler=name).inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+async def count_update(update: Update, context):
+    """TypeHandler callback (group -1): update throughput by kind"""
+    kind = next((attr for attr in ('message', 'callback_query', 'edited_message', 'my_chat_member',
+                                   'inline_query', 'channel_post') if getattr(update, attr, None)), 'other')
+    BOT_UPDATES.labels(type=kind).inc()
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and failures per Bot API method"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1] or 'unknown'
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            TELEGRAM_API_ERRORS.labels(method=api_method, reason=type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.labels(method=api_method).observe(time.perf_counter() - started)
+        if code >= 400:
+            TELEGRAM_API_ERRORS.labels(method=api_method, reason=str(code)).inc()
+        return code, payload
+
+
+def init_app(app):
+    """Per-route latency for every Flask request"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(
+                route=route, method=request.method, status=str(response.status_code)
+            ).observe(time.perf_counter() - started)
+        return response
+
+
+def process_exited(pid):
+    """Drop a dead process's live gauges (its counters keep counting)"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+
+
+def _process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def clear_stale_files():
+    """Remove sample files left by processes that are no longer running.
+
+    Called by serving.serve() before any worker or bot process starts. A
+    directory holding anything but prometheus_client's <kind>_<pid>.db
+    files is left alone (it is probably not a metrics directory), and so
+    are the files of live processes, e.g. another service sharing it.
+    """
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    try:
+        names = os.listdir(directory)
+    except OSError as e:
+        logger.error(f"Error listing metrics directory: {e}")
+        return 0
+    pids = {}
+    for name in names:
+        pid = name[:-len('.db')].rpartition('_')[2] if name.endswith('.db') else ''
+        if not pid.isdigit():
+            logger.warning(f"{directory} holds more than metrics files ({name}); not clearing it")
+            return 0
+        pids[name] = int(pid)
+    removed = 0
+    for name, pid in pids.items():
+        if not _process_running(pid):
+            try:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+            except OSError:
+                pass  # already gone
+    if removed:
+        logger.info(f"✅ Removed {removed} stale metrics files")
+    return removed
+
+
+def _at_exit():
+    # Runs in every process that exits normally, forked children included
+    process_exited(os.getpid())
+    if _temp_dir is not None and os.getpid() == _owner_pid:
+        shutil.rmtree(_temp_dir, ignore_errors=True)
+
+
+atexit.register(_at_exit)
+
+
+def render():
+    """(body, content type) of every process's metrics, aggregated"""
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,144 @@
+# migrations.py
+# Versioned schema migrations, applied once under an advisory lock
+
+import os
+import logging
+
+from db_pool import get_db_connection
+from activity_store import install_activity_store, install_default_partition
+from analytics import install_analytics_schema
+from events import install_events_schema
+from license_expiry import install_license_expiry_schema
+from outbound_store import install_outbound_schema
+from releases import install_releases_schema, install_pending_uploads_schema
+from stats import install_stats_schema
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary key so only one instance migrates at a time
+MIGRATION_LOCK_KEY = 0x44415459  # 'DATY'
+# DDL gives up instead of queueing behind live traffic (and blocking it)
+MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '10s')
+
+
+def _base_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS datrix_users (
+            id SERIAL PRIMARY KEY,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            user_name TEXT,
+            first_name TEXT,
+            company_name TEXT,
+            google_sheet_id TEXT,
+            license_expires DATE,
+            license_status TEXT DEFAULT 'active',
+            app_version TEXT,
+            download_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+
+        -- Columns missing from databases created by early versions
+        ALTER TABLE datrix_users ADD COLUMN IF NOT EXISTS first_name TEXT;
+        ALTER TABLE datrix_users ADD COLUMN IF NOT EXISTS license_status TEXT DEFAULT 'active';
+        ALTER TABLE datrix_users ADD COLUMN IF NOT EXISTS app_version TEXT;
+    """)
+
+
+def _user_indexes(cur):
+    # Behind the users API (keyset pagination and filters)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS datrix_users_last_seen_key_idx
+            ON datrix_users ((COALESCE(last_seen, '-infinity'::timestamptz)), telegram_id);
+        CREATE INDEX IF NOT EXISTS datrix_users_created_at_key_idx
+            ON datrix_users ((COALESCE(created_at, '-infinity'::timestamptz)), telegram_id);
+        CREATE INDEX IF NOT EXISTS datrix_users_license_expires_key_idx
+            ON datrix_users ((COALESCE(license_expires, '-infinity'::date)), telegram_id);
+        CREATE INDEX IF NOT EXISTS datrix_users_company_last_seen_idx
+            ON datrix_users (lower(company_name), (COALESCE(last_seen, '-infinity'::timestamptz)), telegram_id);
+    """)
+
+
+# (version, description, apply(cur)) in order; never edit or reorder a
+# released entry, append a new one instead. The first five are idempotent
+# so databases created before versioning adopt them safely.
+MIGRATIONS = [
+    (1, 'datrix_users table and late-added columns', _base_tables),
+    (2, 'partitioned user_activity', install_activity_store),
+    (3, 'users API indexes', _user_indexes),
+    (4, 'stats counters and trigger', install_stats_schema),
+    (5, 'activity rollups', install_analytics_schema),
+    (6, 'release registry', install_releases_schema),
+    (7, 'outbound message queue', install_outbound_schema),
+    (8, 'license expiry sweep', install_license_expiry_schema),
+    (9, 'sharded stats counters', install_stats_schema),
+    (10, 'user_activity default partition', install_default_partition),
+    (11, 'pending release uploads', install_pending_uploads_schema),
+    (12, 'dashboard event numbers', install_events_schema),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(cur):
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+
+def _apply_pending(conn, cur):
+    """Apply every migration newer than the recorded version, one transaction each"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """)
+    conn.commit()
+
+    # Another instance may have migrated while we waited for the lock
+    current = _current_version(cur)
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"🔄 Applying migration {version}: {description}")
+        cur.execute("SET LOCAL lock_timeout = %s", (MIGRATION_LOCK_TIMEOUT,))
+        apply(cur)
+        cur.execute(
+            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+            (version, description)
+        )
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+def migrate():
+    """Bring the schema up to LATEST_VERSION; returns the versions applied.
+
+    The common case is a single version lookup. Raises if a migration
+    fails; migrations applied before it stay committed.
+    """
+    with get_db_connection() as conn, conn.cursor() as cur:
+        current = _current_version(cur)
+        conn.commit()
+        if current >= LATEST_VERSION:
+            return []
+
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            applied = _apply_pending(conn, cur)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+
+    if applied:
+        logger.info(f"✅ Schema migrated to version {applied[-1]}")
+    return applied
@@ -0,0 +1,400 @@
+# outbound.py
+# Rate-limited, prioritised Telegram message sending with retries
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import async_db as adb
+from db_listener import listener
+from metrics import OUTBOUND_MESSAGES
+from outbound_store import OUTBOUND_CHANNEL, PRIORITY_ADMIN, PRIORITY_BULK, PRIORITY_NOTICE, PRIORITY_REPLY
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages/second per bot and 1/second per chat
+OUTBOUND_GLOBAL_RATE = float(os.environ.get('OUTBOUND_GLOBAL_RATE', 25))
+OUTBOUND_CHAT_RATE = float(os.environ.get('OUTBOUND_CHAT_RATE', 1))
+OUTBOUND_CHAT_BURST = int(os.environ.get('OUTBOUND_CHAT_BURST', 3))
+# Concurrent Bot API calls
+OUTBOUND_WORKERS = int(os.environ.get('OUTBOUND_WORKERS', 8))
+# Attempts (in memory, then again from the queue table) before giving up
+OUTBOUND_MAX_ATTEMPTS = int(os.environ.get('OUTBOUND_MAX_ATTEMPTS', 5))
+OUTBOUND_RETRY_DELAY = float(os.environ.get('OUTBOUND_RETRY_DELAY', 2))
+OUTBOUND_MAX_RETRY_DELAY = float(os.environ.get('OUTBOUND_MAX_RETRY_DELAY', 600))
+# Queue table polling (a NOTIFY wakes the poller sooner)
+OUTBOUND_POLL_INTERVAL = float(os.environ.get('OUTBOUND_POLL_INTERVAL', 5))
+OUTBOUND_CLAIM_BATCH = int(os.environ.get('OUTBOUND_CLAIM_BATCH', 50))
+# A claimed message is sent again if not confirmed within this many seconds
+OUTBOUND_LEASE = int(os.environ.get('OUTBOUND_LEASE', 300))
+OUTBOUND_DRAIN_TIMEOUT = float(os.environ.get('OUTBOUND_DRAIN_TIMEOUT', 10))
+
+BOT_METHODS = {
+    'sendMessage': 'send_message',
+    'sendDocument': 'send_document',
+}
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take a token: 0 if one was available, else seconds until one is"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutboundMessage:
+    __slots__ = ('chat_id', 'method', 'params', 'priority', 'persist', 'future', 'row_id', 'attempts')
+
+    def __init__(self, chat_id, method, params, priority, persist=True, future=None, row_id=None, attempts=0):
+        self.chat_id = chat_id
+        self.method = method
+        self.params = params
+        self.priority = priority
+        self.persist = persist
+        self.future = future
+        self.row_id = row_id
+        self.attempts = attempts
+
+    def as_row(self):
+        return {'chat_id': self.chat_id, 'method': self.method, 'params': self.params, 'priority': self.priority}
+
+
+class OutboundScheduler:
+    """Sends every bot message through one queue per process.
+
+    Messages leave in priority order within a global and a per-chat token
+    bucket; a chat that is over its limit is set aside without holding up
+    the others. Each chat has at most one message queued, set aside or
+    being sent at a time; its later messages wait behind it in order (one
+    handed to the queue table after failed attempts stops holding them).
+    RetryAfter pauses all sending for the time Telegram asks.
+    Messages that still fail are stored in the outbound_queue table, which
+    is also how other processes (the web API, scheduled jobs) hand over
+    messages: every running scheduler claims due rows from it.
+    """
+
+    def __init__(self):
+        self._bot = None
+        self._loop = None
+        self._tasks = []
+        self._stats = dict.fromkeys(('sent', 'retried', 'failed', 'flood_waits', 'persisted', 'claimed'), 0)
+        listener.subscribe(OUTBOUND_CHANNEL, self._on_notify)
+
+    # ---------- lifecycle ----------
+
+    def start(self, bot, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE):
+        """Start sending with ``bot`` on the running event loop"""
+        self._bot = bot
+        self._chat_rate = chat_rate
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._wake = asyncio.Event()
+        self._global = TokenBucket(global_rate, max(global_rate, 1))
+        self._chats = {}
+        self._delayed = {}  # message -> timer handle
+        self._chat_owner = {}  # chat_id -> the one message of that chat in the scheduler
+        self._chat_waiting = {}  # chat_id -> deque of its later messages
+        self._deliveries = set()  # Bot API calls under way
+        self._seq = 0
+        self._paused_until = 0.0
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(OUTBOUND_WORKERS)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+        listener.start()
+        logger.info(f"✅ Outbound scheduler started ({global_rate:g}/s, {OUTBOUND_WORKERS} workers)")
+
+    @property
+    def running(self):
+        return bool(self._tasks) and self._loop is asyncio.get_running_loop()
+
+    async def drain(self, timeout=OUTBOUND_DRAIN_TIMEOUT):
+        """Wait until nothing is queued, set aside or being sent"""
+        deadline = time.monotonic() + timeout
+        while self._queue.qsize() or self._delayed or self._chat_waiting or self._deliveries:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def stop(self, timeout=OUTBOUND_DRAIN_TIMEOUT):
+        """Send what is pending for up to ``timeout``, then store the rest.
+
+        Calls already made to the Bot API are waited for (up to ``timeout``
+        again) so their outcome is recorded, not lost.
+        """
+        if not self._tasks:
+            return
+        self._tasks.pop().cancel()  # the poller: claim nothing more
+        await self.drain(timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._deliveries:
+            await asyncio.wait(set(self._deliveries), timeout=timeout)
+
+        leftover = []
+        for message, handle in self._delayed.items():
+            handle.cancel()
+            leftover.append(message)
+        self._delayed.clear()
+        while not self._queue.empty():
+            leftover.append(self._queue.get_nowait()[2])
+        for waiting in self._chat_waiting.values():
+            leftover.extend(waiting)
+        self._chat_waiting.clear()
+        self._chat_owner.clear()
+        # Claimed rows go back when their lease runs out
+        rows = [m.as_row() for m in leftover if m.persist and m.row_id is None]
+        for message in leftover:
+            if message.future and not message.future.done():
+                message.future.set_exception(RuntimeError('Outbound scheduler stopped before the message was sent'))
+        if rows and await adb.queue_messages(rows):
+            self._count('persisted', len(rows))
+            logger.info(f"🔄 Stored {len(rows)} unsent messages for later")
+
+    # ---------- sending ----------
+
+    async def send(self, chat_id, method='sendMessage', priority=PRIORITY_NOTICE, wait=False, persist=None, **params):
+        """Queue a Bot API call (``params`` as for the Bot method).
+
+        With ``wait`` the result (e.g. the sent Message) is returned and a
+        failure raised; otherwise the message is fire-and-forget and, unless
+        ``persist`` is False, survives failures and restarts.
+        """
+        if persist is None:
+            persist = not wait
+        markup = params.get('reply_markup')
+        if markup is not None and hasattr(markup, 'to_dict'):
+            params['reply_markup'] = markup.to_dict()
+
+        if not self.running:
+            if wait or not persist:
+                raise RuntimeError('Outbound scheduler is not running in this process')
+            await adb.queue_messages([{'chat_id': chat_id, 'method': method, 'params': params,
+                                       'priority': priority}])
+            return None
+
+        future = self._loop.create_future() if wait else None
+        self._submit(OutboundMessage(chat_id, method, params, priority, persist, future))
+        return await future if future else None
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_NOTICE, wait=False, persist=None, **params):
+        return await self.send(chat_id, 'sendMessage', priority, wait, persist, text=text, **params)
+
+    async def reply(self, update, text, **params):
+        """Answer the user behind ``update`` (highest priority, not stored; a failure is only logged)"""
+        return await self.send(update.effective_chat.id, 'sendMessage', PRIORITY_REPLY, persist=False,
+                               text=text, **params)
+
+    def _submit(self, message):
+        """Queue a new message, or line it up behind its chat's current one"""
+        if message.chat_id in self._chat_owner:
+            self._chat_waiting.setdefault(message.chat_id, deque()).append(message)
+            return
+        self._chat_owner[message.chat_id] = message
+        self._put(message)
+
+    def _done(self, message):
+        """``message`` left the scheduler (sent, stored or given up): its chat's next one may go"""
+        chat_id = message.chat_id
+        if self._chat_owner.get(chat_id) is not message:
+            return
+        waiting = self._chat_waiting.get(chat_id)
+        if not waiting:
+            del self._chat_owner[chat_id]
+            return
+        following = self._chat_owner[chat_id] = waiting.popleft()
+        if not waiting:
+            del self._chat_waiting[chat_id]
+        self._put(following)
+
+    def _put(self, message):
+        self._seq += 1
+        self._queue.put_nowait((message.priority, self._seq, message))
+
+    def _set_aside(self, message, delay):
+        self._delayed[message] = self._loop.call_later(delay, self._requeue, message)
+
+    def _requeue(self, message):
+        if self._delayed.pop(message, None) is not None:
+            self._put(message)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                self._chats = {key: b for key, b in self._chats.items() if not b.full()}
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, OUTBOUND_CHAT_BURST)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            message = (await self._queue.get())[2]
+            try:
+                ready = await self._wait_turn(message)
+            except asyncio.CancelledError:
+                self._put(message)  # stopping: stop() keeps it with the rest
+                raise
+            if not ready:
+                continue
+            # Shielded: stopping cancels the worker, not a call Telegram may already have acted on
+            delivery = asyncio.ensure_future(self._deliver(message))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+            try:
+                await asyncio.shield(delivery)
+            except Exception as e:
+                logger.error(f"Outbound worker error: {e}")
+
+    async def _wait_turn(self, message):
+        """Wait out the flood pause and the global limit; False if the chat is over its limit (set aside)"""
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        wait = self._chat_bucket(message.chat_id).take()
+        if wait:
+            self._set_aside(message, wait)
+            return False
+        while True:
+            wait = self._global.take()
+            if not wait:
+                return True
+            await asyncio.sleep(wait)
+
+    async def _call(self, message):
+        params = dict(message.params)
+        if isinstance(params.get('reply_markup'), dict):
+            params['reply_markup'] = InlineKeyboardMarkup.de_json(params['reply_markup'], self._bot)
+        send = getattr(self._bot, BOT_METHODS[message.method])
+        return await send(chat_id=message.chat_id, **params)
+
+    async def _deliver(self, message):
+        try:
+            result = await self._call(message)
+        except RetryAfter as e:
+            self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+            self._count('flood_waits')
+            logger.warning(f"⏳ Flood limit hit: pausing outbound messages for {e.retry_after}s")
+            self._put(message)
+            return
+        except (BadRequest, Forbidden) as e:
+            # Blocked bot, deleted chat, malformed message: retrying cannot help
+            await self._failed(message, e, permanent=True)
+            return
+        except NetworkError as e:
+            await self._failed(message, e)
+            return
+        except Exception as e:
+            await self._failed(message, e, permanent=True)
+            return
+
+        self._count('sent')
+        self._done(message)
+        if message.row_id is not None:
+            await adb.complete_outbound_message(message.row_id)
+        if message.future and not message.future.done():
+            message.future.set_result(result)
+
+    def _backoff(self, attempts):
+        return min(OUTBOUND_RETRY_DELAY * 2 ** (attempts - 1), OUTBOUND_MAX_RETRY_DELAY)
+
+    async def _failed(self, message, error, permanent=False):
+        if message.row_id is None:
+            message.attempts += 1
+        give_up = permanent or message.attempts >= OUTBOUND_MAX_ATTEMPTS
+
+        if message.row_id is not None:
+            # The claim counted the attempt; the row carries the retry schedule
+            self._done(message)
+            await adb.retry_outbound_message(message.row_id, self._backoff(message.attempts), str(error), give_up)
+            if not give_up:
+                self._count('retried')
+                return
+        elif not give_up:
+            self._count('retried')
+            self._set_aside(message, self._backoff(message.attempts))
+            return
+        elif message.persist and not permanent:
+            # Out of quick retries: keep trying from the queue table
+            self._done(message)
+            if await adb.queue_messages([message.as_row()], self._backoff(message.attempts)):
+                self._count('persisted')
+                return
+
+        self._done(message)
+        self._count('failed')
+        logger.error(f"Gave up sending {message.method} to {message.chat_id} "
+                     f"after {max(message.attempts, 1)} attempt(s): {error}")
+        if message.future and not message.future.done():
+            message.future.set_exception(error)
+
+    # ---------- queue table ----------
+
+    def _on_notify(self, payload):
+        # Listener thread: messages were queued by some process
+        loop = self._loop
+        if self._tasks and loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake.set)
+
+    async def _poll(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), OUTBOUND_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._queue.qsize() >= OUTBOUND_CLAIM_BATCH:
+                continue
+            rows = await adb.claim_outbound_messages(OUTBOUND_CLAIM_BATCH, OUTBOUND_LEASE)
+            for row in rows:
+                self._submit(OutboundMessage(row['chat_id'], row['method'], row['params'], row['priority'],
+                                          row_id=row['id'], attempts=row['attempts']))
+            self._count('claimed', len(rows))
+            if len(rows) == OUTBOUND_CLAIM_BATCH:
+                self._wake.set()  # more may be due
+
+    def _count(self, key, n=1):
+        if n:
+            self._stats[key] += n
+            OUTBOUND_MESSAGES.labels(result=key).inc(n)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['running'] = bool(self._tasks)
+        if self._tasks:
+            stats.update({
+                'queued': self._queue.qsize(),
+                'delayed': len(self._delayed),
+                'waiting_for_chat': sum(len(waiting) for waiting in self._chat_waiting.values()),
+                'in_flight': len(self._deliveries),
+                'paused_for': round(max(self._paused_until - time.monotonic(), 0), 1),
+            })
+        return stats
+
+
+outbound = OutboundScheduler()
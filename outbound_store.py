@@ -0,0 +1,118 @@
+# outbound_store.py
+# Persistent queue of Telegram messages waiting to be (re)sent
+
+import os
+
+from psycopg2.extras import Json, execute_values
+
+from db_listener import notify
+
+OUTBOUND_CHANNEL = 'datrix_outbound'
+
+# Lanes, most urgent first: replies to the user who is waiting, then
+# notifications to users, then notices to the admin, then bulk sends
+PRIORITY_REPLY, PRIORITY_NOTICE, PRIORITY_ADMIN, PRIORITY_BULK = range(4)
+
+# Days messages that gave up are kept for inspection
+OUTBOUND_FAILED_RETENTION_DAYS = float(os.environ.get('OUTBOUND_FAILED_RETENTION_DAYS', 30))
+
+OUTBOUND_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbound_queue (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        method TEXT NOT NULL,
+        params JSONB NOT NULL,
+        priority SMALLINT NOT NULL DEFAULT 1,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        last_error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        failed_at TIMESTAMP WITH TIME ZONE
+    );
+
+    -- Only pending messages are ever scanned
+    CREATE INDEX IF NOT EXISTS outbound_queue_due_idx
+        ON outbound_queue (priority, next_attempt_at) WHERE failed_at IS NULL;
+"""
+
+
+def install_outbound_schema(cur):
+    cur.execute(OUTBOUND_SCHEMA)
+
+
+def insert_outbound(cur, messages, delay=0):
+    """Queue message dicts (chat_id, method, params, priority, delay); sent once the transaction commits.
+
+    A message's own 'delay' (seconds) overrides ``delay``.
+    """
+    if not messages:
+        return 0
+    execute_values(cur, """
+        INSERT INTO outbound_queue (chat_id, method, params, priority, next_attempt_at)
+        VALUES %s
+    """, [
+        (m['chat_id'], m.get('method', 'sendMessage'), Json(m['params']), m.get('priority', PRIORITY_NOTICE),
+         m.get('delay', delay))
+        for m in messages
+    ], template="(%s, %s, %s, %s, NOW() + make_interval(secs => %s))", page_size=1000)
+    notify(cur, OUTBOUND_CHANNEL)
+    return len(messages)
+
+
+def claim_outbound(cur, limit, lease):
+    """Lease up to ``limit`` due messages for ``lease`` seconds, most urgent first.
+
+    A message whose sender dies is sent again once its lease runs out.
+    """
+    cur.execute("""
+        UPDATE outbound_queue q
+        SET attempts = q.attempts + 1,
+            next_attempt_at = NOW() + make_interval(secs => %s)
+        FROM (
+            SELECT id FROM outbound_queue
+            WHERE failed_at IS NULL AND next_attempt_at <= NOW()
+            ORDER BY priority, next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) due
+        WHERE q.id = due.id
+        RETURNING q.id, q.chat_id, q.method, q.params, q.priority, q.attempts
+    """, (lease, limit))
+    return [
+        {'id': row[0], 'chat_id': row[1], 'method': row[2], 'params': row[3], 'priority': row[4],
+         'attempts': row[5]}
+        for row in cur.fetchall()
+    ]
+
+
+def delete_outbound(cur, message_id):
+    cur.execute("DELETE FROM outbound_queue WHERE id = %s", (message_id,))
+
+
+def reschedule_outbound(cur, message_id, delay, error, failed=False):
+    """Retry after ``delay`` seconds, or give up on the message if ``failed``"""
+    cur.execute("""
+        UPDATE outbound_queue
+        SET next_attempt_at = NOW() + make_interval(secs => %s),
+            last_error = %s,
+            failed_at = CASE WHEN %s THEN NOW() END
+        WHERE id = %s
+    """, (delay, error[:500], failed, message_id))
+
+
+def prune_outbound(cur, days=OUTBOUND_FAILED_RETENTION_DAYS):
+    cur.execute("""
+        DELETE FROM outbound_queue
+        WHERE failed_at < NOW() - make_interval(secs => %s)
+    """, (days * 86400,))
+
+
+def read_outbound_stats(cur):
+    cur.execute("""
+        SELECT COUNT(*) FILTER (WHERE failed_at IS NULL),
+               COUNT(*) FILTER (WHERE failed_at IS NULL AND next_attempt_at <= NOW()),
+               COUNT(*) FILTER (WHERE failed_at IS NOT NULL)
+        FROM outbound_queue
+    """)
+    pending, due, failed = cur.fetchone()
+    return {'pending': pending, 'due': due, 'failed': failed}
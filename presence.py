@@ -0,0 +1,126 @@
+# presence.py
+# Coalesced last_seen / user_name updates for datrix_users
+
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from psycopg2.extras import execute_values
+
+from batch_writer import BatchWriter
+from db_pool import get_db_connection
+from events import publish_event
+
+# Presence tracker configuration
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 30))
+PRESENCE_BATCH_SIZE = int(os.environ.get('PRESENCE_BATCH_SIZE', 1000))
+# last_seen is not rewritten more often than this (seconds) unless the name changed
+PRESENCE_RESOLUTION = float(os.environ.get('PRESENCE_RESOLUTION', 60))
+PRESENCE_CACHE_SIZE = int(os.environ.get('PRESENCE_CACHE_SIZE', 50000))
+
+
+class PresenceTracker(BatchWriter):
+    """Collects last_seen/user_name changes and writes them in batches.
+
+    Each flush is one ``UPDATE ... FROM (VALUES ...)`` per batch. Touches
+    that change nothing - same name and last_seen already written within
+    ``resolution`` seconds - never reach the database.
+    """
+
+    name = 'presence'
+
+    def __init__(self, flush_interval=PRESENCE_FLUSH_INTERVAL,
+                 batch_size=PRESENCE_BATCH_SIZE, resolution=PRESENCE_RESOLUTION,
+                 cache_size=PRESENCE_CACHE_SIZE):
+        super().__init__(flush_interval, batch_size)
+        self.resolution = timedelta(seconds=resolution)
+        self.cache_size = cache_size
+        self._dirty = {}               # telegram_id -> (user_name, seen_at)
+        self._written = OrderedDict()  # telegram_id -> (user_name, seen_at) as stored
+        self._counters.update({'touches': 0, 'skipped': 0, 'written': 0})
+
+    def is_known(self, telegram_id):
+        """True if this process has seen the user's row in the database"""
+        with self._cond:
+            return telegram_id in self._written or telegram_id in self._dirty
+
+    def touch(self, telegram_id, user_name=None):
+        """Record that a user was seen now (optionally under a new name)"""
+        self._ensure_started()
+        now = datetime.now(timezone.utc)
+        with self._cond:
+            self._counters['touches'] += 1
+            written = self._written.get(telegram_id)
+            if telegram_id not in self._dirty and written is not None:
+                name_unchanged = user_name is None or user_name == written[0]
+                if name_unchanged and now - written[1] < self.resolution:
+                    self._counters['skipped'] += 1
+                    return
+            pending = self._dirty.get(telegram_id)
+            if user_name is None and pending is not None:
+                user_name = pending[0]
+            self._dirty[telegram_id] = (user_name, now)
+
+    def mark_written(self, telegram_id, user_name=None):
+        """Note that a write path just stored last_seen (and name) itself"""
+        now = datetime.now(timezone.utc)
+        with self._cond:
+            pending = self._dirty.get(telegram_id)
+            if pending is not None and (pending[0] is None or pending[0] == user_name):
+                del self._dirty[telegram_id]
+            if user_name is None:
+                user_name = (self._written.get(telegram_id) or (None,))[0]
+            self._remember(telegram_id, user_name, now)
+
+    def _remember(self, telegram_id, user_name, seen_at):
+        self._written[telegram_id] = (user_name, seen_at)
+        self._written.move_to_end(telegram_id)
+        while len(self._written) > self.cache_size:
+            self._written.popitem(last=False)
+
+    def _pending(self):
+        return len(self._dirty)
+
+    def _drain(self):
+        items = []
+        for telegram_id in list(self._dirty)[:self.batch_size]:
+            user_name, seen_at = self._dirty.pop(telegram_id)
+            items.append((telegram_id, user_name, seen_at))
+        return items
+
+    def _write(self, items):
+        with get_db_connection() as conn, conn.cursor() as cur:
+            execute_values(cur, """
+                UPDATE datrix_users AS u
+                SET last_seen = GREATEST(u.last_seen, v.seen),
+                    user_name = COALESCE(v.user_name, u.user_name)
+                FROM (VALUES %s) AS v(telegram_id, user_name, seen)
+                WHERE u.telegram_id = v.telegram_id
+                  AND (u.last_seen IS NULL
+                       OR u.last_seen < v.seen
+                       OR (v.user_name IS NOT NULL AND v.user_name IS DISTINCT FROM u.user_name))
+            """, items,
+                template='(%s::bigint, %s::text, %s::timestamptz)',
+                page_size=self.batch_size)
+            # One event per batch: dashboards and ETags follow last_seen
+            publish_event(cur, 'presence', users=len(items))
+            conn.commit()
+        with self._cond:
+            for telegram_id, user_name, seen_at in items:
+                previous = self._written.get(telegram_id)
+                if user_name is None and previous is not None:
+                    user_name = previous[0]
+                self._remember(telegram_id, user_name, seen_at)
+            self._counters['written'] += len(items)
+
+    def _restore(self, items):
+        for telegram_id, user_name, seen_at in items:
+            # A newer touch since the drain wins
+            self._dirty.setdefault(telegram_id, (user_name, seen_at))
+
+    def _reset_buffer(self):
+        self._dirty = {}
+        self._written = OrderedDict()
+
+
+presence_tracker = PresenceTracker()
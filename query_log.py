@@ -0,0 +1,171 @@
+# query_log.py
+# Per-statement timing, slow-query log and optional EXPLAIN ANALYZE capture
+
+import os
+import re
+import time
+import logging
+import threading
+
+import psycopg2.extensions
+
+from metrics import DB_ROWS, DB_SLOW_QUERIES, current_query
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged (0 disables the log)
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# Also log the EXPLAIN ANALYZE plan of slow read-only SELECTs. The plan
+# re-runs the statement, so each distinct statement is explained at most
+# once per SLOW_QUERY_EXPLAIN_INTERVAL seconds
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', '0') in ('1', 'true', 'yes')
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 300))
+QUERY_LOG_SQL_CHARS = int(os.environ.get('QUERY_LOG_SQL_CHARS', 500))
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+# SELECTs that change state when executed (and so must never be re-run)
+_SIDE_EFFECTS = re.compile(r'pg_notify|advisory|setval|nextval|\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+SHARE\b',
+                           re.IGNORECASE)
+
+
+def redact_sql(sql):
+    """Statement text with literals replaced, whitespace collapsed and truncated"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _WHITESPACE.sub(' ', _LITERALS.sub('?', str(sql))).strip()
+    if len(sql) > QUERY_LOG_SQL_CHARS:
+        sql = sql[:QUERY_LOG_SQL_CHARS] + '...'
+    return sql
+
+
+def describe_params(params):
+    """Parameter types only - values never reach the log"""
+    if params is None:
+        return 'none'
+    if isinstance(params, dict):
+        return ', '.join(f"{key}: {type(value).__name__}" for key, value in params.items())
+    return ', '.join(type(value).__name__ for value in params)
+
+
+class QueryStats:
+    """Per-function statement counters for this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._explained = {}  # redacted statement -> last EXPLAIN time
+
+    def record(self, function, seconds, rows, failed=False, slow=False):
+        with self._lock:
+            entry = self._functions.get(function)
+            if entry is None:
+                entry = self._functions[function] = {
+                    'statements': 0, 'errors': 0, 'slow': 0, 'rows': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0
+                }
+            entry['statements'] += 1
+            entry['errors'] += failed
+            entry['slow'] += slow
+            entry['rows'] += max(rows, 0)
+            entry['total_ms'] += seconds * 1000
+            entry['max_ms'] = max(entry['max_ms'], seconds * 1000)
+
+    def should_explain(self, statement):
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(statement)
+            if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return False
+            self._explained[statement] = now
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            functions = {name: dict(entry) for name, entry in self._functions.items()}
+        for entry in functions.values():
+            entry['avg_ms'] = round(entry['total_ms'] / entry['statements'], 3)
+            entry['total_ms'] = round(entry['total_ms'], 3)
+            entry['max_ms'] = round(entry['max_ms'], 3)
+        return dict(sorted(functions.items(), key=lambda item: -item[1]['total_ms']))
+
+
+query_stats = QueryStats()
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that times every statement and logs the slow ones.
+
+    The calling function is the database.py function running in this
+    thread (see metrics.timed_query).
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception as e:
+            self._finish(query, vars, started, failed=True, error=e)
+            raise
+        self._finish(query, vars, started)
+        return result
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception as e:
+            self._finish(query, None, started, failed=True, error=e)
+            raise
+        self._finish(query, None, started)
+        return result
+
+    def _finish(self, query, vars, started, failed=False, error=None):
+        seconds = time.perf_counter() - started
+        function = current_query()
+        rows = self.rowcount if not failed else 0
+        slow = bool(SLOW_QUERY_MS) and seconds * 1000 >= SLOW_QUERY_MS
+        query_stats.record(function, seconds, rows, failed, slow)
+        if rows > 0:
+            DB_ROWS.labels(function=function).inc(rows)
+
+        if failed:
+            logger.error(f"Query failed in {function} after {seconds * 1000:.1f}ms "
+                         f"(SQLSTATE {getattr(error, 'pgcode', None)}): {redact_sql(query)} "
+                         f"[params: {describe_params(vars)}]")
+            return
+        if not slow:
+            return
+
+        DB_SLOW_QUERIES.labels(function=function).inc()
+        statement = redact_sql(query)
+        logger.warning(f"🐢 Slow query in {function}: {seconds * 1000:.1f}ms, {rows} rows: "
+                       f"{statement} [params: {describe_params(vars)}]")
+        if SLOW_QUERY_EXPLAIN and self.name is None and self._explainable(query):
+            if query_stats.should_explain(statement):
+                self._log_plan(query, vars, function)
+
+    @staticmethod
+    def _explainable(query):
+        text = query.decode('utf-8', 'replace') if isinstance(query, bytes) else str(query)
+        return text.lstrip().upper().startswith('SELECT') and not _SIDE_EFFECTS.search(text)
+
+    def _log_plan(self, query, vars, function):
+        """EXPLAIN ANALYZE on a separate cursor inside a savepoint"""
+        conn = self.connection
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            return
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            try:
+                cur.execute("SAVEPOINT query_log_explain")
+                cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + cur.mogrify(query, vars))
+                plan = '\n'.join(row[0] for row in cur.fetchall())
+                cur.execute("RELEASE SAVEPOINT query_log_explain")
+            except Exception as e:
+                try:
+                    cur.execute("ROLLBACK TO SAVEPOINT query_log_explain")
+                except Exception:
+                    pass  # the caller's own error handling will roll back
+                logger.error(f"EXPLAIN failed for slow query in {function}: {e}")
+                return
+        logger.warning(f"🐢 Plan for slow query in {function}:\n{plan}")
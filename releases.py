@@ -0,0 +1,222 @@
+# releases.py
+# Database-backed DATRIX release registry, mirrored in every process
+
+import os
+import time
+import logging
+import threading
+
+from db_pool import get_db_connection
+from db_listener import listener, notify
+
+logger = logging.getLogger(__name__)
+
+RELEASE_CHANGED_CHANNEL = 'datrix_release_changed'
+# Reload period while the notification listener is down
+RELEASE_REFRESH_INTERVAL = float(os.environ.get('RELEASE_REFRESH_INTERVAL', 30))
+
+RELEASES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS datrix_releases (
+        id SERIAL PRIMARY KEY,
+        version TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        file_unique_id TEXT,
+        filename TEXT,
+        file_size BIGINT,
+        uploaded_by BIGINT,
+        uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        is_active BOOLEAN NOT NULL DEFAULT FALSE,
+        download_count BIGINT NOT NULL DEFAULT 0
+    );
+
+    -- At most one release is delivered at a time
+    CREATE UNIQUE INDEX IF NOT EXISTS datrix_releases_active_idx
+        ON datrix_releases (is_active) WHERE is_active;
+"""
+
+# An admin's /set_file waiting for the document, shared by every process
+# (the upload can reach a different web worker than the command did)
+PENDING_UPLOADS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS datrix_pending_uploads (
+        telegram_id BIGINT PRIMARY KEY,
+        version TEXT NOT NULL,
+        requested_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    );
+"""
+
+RELEASE_COLUMNS = """
+    id, version, file_id, filename, file_size, uploaded_at, download_count, is_active
+"""
+
+
+def install_releases_schema(cur):
+    cur.execute(RELEASES_SCHEMA)
+
+
+def install_pending_uploads_schema(cur):
+    cur.execute(PENDING_UPLOADS_SCHEMA)
+
+
+def format_size(file_size):
+    return f"{file_size // (1024*1024)}MB" if file_size else "Unknown"
+
+
+def format_release(row):
+    """Release row as the dict handlers and /api/file_info use"""
+    return {
+        'id': row[0],
+        'version': row[1],
+        'file_id': row[2],
+        'filename': row[3] or 'DATRIX_Setup.exe',
+        'file_size': row[4],
+        'size': format_size(row[4]),
+        'upload_date': row[5].strftime('%Y-%m-%d %H:%M') if row[5] else None,
+        'download_count': int(row[6]),
+        'is_active': row[7]
+    }
+
+
+def read_active_release(cur):
+    cur.execute(f"SELECT {RELEASE_COLUMNS} FROM datrix_releases WHERE is_active")
+    row = cur.fetchone()
+    return format_release(row) if row else None
+
+
+def read_releases(cur, limit=50):
+    """Release history, newest first"""
+    cur.execute(f"""
+        SELECT {RELEASE_COLUMNS} FROM datrix_releases
+        ORDER BY uploaded_at DESC, id DESC
+        LIMIT %s
+    """, (limit,))
+    return [format_release(row) for row in cur.fetchall()]
+
+
+def insert_release(cur, version, file_id, file_unique_id, filename, file_size, uploaded_by):
+    """Add a release and make it the active one; the caller commits"""
+    cur.execute("UPDATE datrix_releases SET is_active = FALSE WHERE is_active")
+    cur.execute(f"""
+        INSERT INTO datrix_releases
+            (version, file_id, file_unique_id, filename, file_size, uploaded_by, is_active)
+        VALUES (%s, %s, %s, %s, %s, %s, TRUE)
+        RETURNING {RELEASE_COLUMNS}
+    """, (version, file_id, file_unique_id, filename, file_size, uploaded_by))
+    release = format_release(cur.fetchone())
+    notify(cur, RELEASE_CHANGED_CHANNEL, release['id'])
+    return release
+
+
+def activate_release(cur, release_id):
+    """Roll back (or forward) to an earlier upload; None if it does not exist"""
+    cur.execute("UPDATE datrix_releases SET is_active = FALSE WHERE is_active AND id <> %s", (release_id,))
+    cur.execute(f"""
+        UPDATE datrix_releases SET is_active = TRUE
+        WHERE id = %s
+        RETURNING {RELEASE_COLUMNS}
+    """, (release_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    notify(cur, RELEASE_CHANGED_CHANNEL, release_id)
+    return format_release(row)
+
+
+def set_pending_upload(cur, telegram_id, version):
+    """Expect a document from ``telegram_id`` as release ``version``"""
+    cur.execute("""
+        INSERT INTO datrix_pending_uploads (telegram_id, version)
+        VALUES (%s, %s)
+        ON CONFLICT (telegram_id) DO UPDATE SET
+            version = EXCLUDED.version,
+            requested_at = EXCLUDED.requested_at
+    """, (telegram_id, version))
+
+
+def read_pending_upload(cur, telegram_id):
+    """Version the admin's next document is for, or None"""
+    cur.execute("SELECT version FROM datrix_pending_uploads WHERE telegram_id = %s", (telegram_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def clear_pending_upload(cur, telegram_id):
+    cur.execute("DELETE FROM datrix_pending_uploads WHERE telegram_id = %s", (telegram_id,))
+
+
+def count_release_download(cur, release_id):
+    cur.execute("""
+        UPDATE datrix_releases SET download_count = download_count + 1
+        WHERE id = %s
+    """, (release_id,))
+
+
+class ReleaseRegistry:
+    """In-memory copy of the active release.
+
+    ``active()`` is served from memory. It is reloaded when any process
+    publishes a release (via NOTIFY), after listener reconnects, and every
+    RELEASE_REFRESH_INTERVAL seconds while the listener is down.
+    """
+
+    def __init__(self, refresh_interval=RELEASE_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._active = None
+        self._loaded_at = None
+        self._pid = None
+        # Refreshes can finish out of order; only the newest one is kept
+        self._started = 0
+        self._applied = 0
+
+    def _stale(self):
+        if self._pid != os.getpid() or self._loaded_at is None:
+            return True
+        if listener.connected:
+            return False
+        return time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def refresh(self):
+        """Reload the active release from the database; False on error"""
+        with self._lock:
+            self._started += 1
+            generation = self._started
+        try:
+            with get_db_connection() as conn, conn.cursor() as cur:
+                active = read_active_release(cur)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Error loading active release: {e}")
+            return False
+        self.set_active(active, generation)
+        return True
+
+    def set_active(self, release, generation=None):
+        with self._lock:
+            if generation is None:
+                self._started += 1
+                generation = self._started
+            if generation < self._applied:
+                return
+            self._applied = generation
+            self._active = release
+            self._loaded_at = time.monotonic()
+            self._pid = os.getpid()
+
+    def active(self):
+        """The active release dict, or None if nothing was uploaded yet"""
+        listener.start()
+        if self._stale():
+            self.refresh()
+        with self._lock:
+            return dict(self._active) if self._active else None
+
+
+release_registry = ReleaseRegistry()
+
+
+def _on_release_changed(payload):
+    release_registry.refresh()
+
+
+listener.subscribe(RELEASE_CHANGED_CHANNEL, _on_release_changed)
+listener.on_reset(release_registry.refresh)
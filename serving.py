@@ -0,0 +1,203 @@
+# serving.py
+# Production WSGI serving (waitress / gunicorn) and the bot process supervisor
+
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 'waitress' (threads, one process), 'gunicorn' (processes x threads)
+# or 'flask' (development server)
+WEB_SERVER = os.environ.get('WEB_SERVER', 'waitress')
+WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.environ.get('PORT', 8080))
+# gunicorn worker processes; every worker has its own DB pool and listener
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 2))
+# Request threads per process; each open live dashboard (SSE) holds one
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 16))
+# Open client connections per process before new ones wait in the backlog
+WEB_CONNECTION_LIMIT = int(os.environ.get('WEB_CONNECTION_LIMIT', 200))
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 60))
+# Seconds in-flight requests get to finish on shutdown / reload
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+# Recycle a gunicorn worker after this many requests (0 = never)
+WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+
+BOT_RESTART_DELAY = float(os.environ.get('BOT_RESTART_DELAY', 1))
+BOT_RESTART_MAX_DELAY = float(os.environ.get('BOT_RESTART_MAX_DELAY', 60))
+# A child that ran this long before dying restarts without backoff
+BOT_STABLE_AFTER = float(os.environ.get('BOT_STABLE_AFTER', 60))
+
+
+class ProcessSupervisor:
+    """Keeps one child process running, restarting it with backoff.
+
+    Children are started with 'spawn' so a restart never forks a parent
+    whose server threads may hold locks. Exit is detected through the
+    process sentinel, which keeps working even if something else in the
+    parent reaps the child.
+    """
+
+    def __init__(self, name, target, args=(), restart_delay=BOT_RESTART_DELAY,
+                 max_delay=BOT_RESTART_MAX_DELAY, stable_after=BOT_STABLE_AFTER):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.restart_delay = restart_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._restarts = 0
+        self._failures = 0
+        self._started_at = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'datrix-supervise-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._process = self._context.Process(target=self.target, args=self.args, name=f'datrix-{self.name}')
+            self._process.start()
+            self._started_at = time.monotonic()
+            logger.info(f"✅ {self.name} process started (pid {self._process.pid})")
+
+            wait([self._process.sentinel])
+            self._process.join(1)  # reap it for the exit code
+            metrics.process_exited(self._process.pid)
+            if self._stopping.is_set():
+                break
+
+            ran_for = time.monotonic() - self._started_at
+            self._failures = 0 if ran_for >= self.stable_after else self._failures + 1
+            delay = min(self.restart_delay * (2 ** max(self._failures - 1, 0)), self.max_delay) if self._failures else 0
+            logger.error(f"{self.name} process exited (code {self._process.exitcode}) after {ran_for:.0f}s; "
+                         f"restarting in {delay:.0f}s")
+            if self._stopping.wait(delay):
+                break
+            self._restarts += 1
+
+    def stop(self, timeout=WEB_GRACEFUL_TIMEOUT):
+        """Ask the child to stop (SIGTERM), killing it after ``timeout``"""
+        self._stopping.set()
+        process = self._process
+        if process is None or not process.is_alive():
+            return
+        process.terminate()
+        process.join(timeout)
+        if process.is_alive():
+            logger.error(f"{self.name} process did not stop in {timeout}s, killing it")
+            process.kill()
+            process.join()
+
+    def stats(self):
+        process = self._process
+        return {
+            'name': self.name,
+            'pid': process.pid if process else None,
+            'alive': bool(process and process.is_alive()),
+            'restarts': self._restarts,
+            'uptime': round(time.monotonic() - self._started_at) if self._started_at else None
+        }
+
+
+def _serve_waitress(app):
+    from waitress import serve
+    serve(
+        app,
+        host=WEB_HOST,
+        port=WEB_PORT,
+        threads=WEB_THREADS,
+        connection_limit=WEB_CONNECTION_LIMIT,
+        channel_timeout=WEB_TIMEOUT,
+        ident='datrix'
+    )
+
+
+def _run_gunicorn(app, on_worker_start, on_worker_exit):
+    from gunicorn.app.base import BaseApplication
+
+    class DatrixGunicorn(BaseApplication):
+        def load_config(self):
+            config = {
+                'bind': f"{WEB_HOST}:{WEB_PORT}",
+                'workers': WEB_WORKERS,
+                'worker_class': 'gthread',
+                'threads': WEB_THREADS,
+                'worker_connections': WEB_CONNECTION_LIMIT,
+                'timeout': WEB_TIMEOUT,
+                'graceful_timeout': WEB_GRACEFUL_TIMEOUT,
+                'max_requests': WEB_MAX_REQUESTS,
+                'max_requests_jitter': WEB_MAX_REQUESTS // 10,
+                'proc_name': 'datrix-web',
+                # Drop a dead worker's live gauges from /metrics
+                'child_exit': lambda server, worker: metrics.process_exited(worker.pid),
+            }
+            if on_worker_start:
+                config['post_worker_init'] = lambda worker: on_worker_start()
+            if on_worker_exit:
+                config['worker_exit'] = lambda server, worker: on_worker_exit()
+            for key, value in config.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    DatrixGunicorn().run()
+
+
+def serve(app, supervisors=(), on_worker_start=None, on_worker_exit=None):
+    """Serve ``app`` with WEB_SERVER until it stops (SIGTERM: sys.exit).
+
+    ``supervisors`` are started once the server side is set up and stopped
+    on the way out. ``on_worker_start``/``on_worker_exit`` run in every
+    process that serves requests.
+
+    With gunicorn the arbiter runs in a child forked before any supervisor
+    thread exists, so it never reaps the bot process; SIGHUP is passed on
+    for a graceful reload of the workers.
+    """
+    logger.info(f"🌐 Serving with {WEB_SERVER} on {WEB_HOST}:{WEB_PORT}")
+    metrics.setup()
+    # Samples of processes from an earlier run would otherwise be summed in
+    metrics.clear_stale_files()
+    web = None
+    try:
+        if WEB_SERVER == 'gunicorn':
+            web = multiprocessing.get_context('fork').Process(
+                target=_run_gunicorn, args=(app, on_worker_start, on_worker_exit), name='datrix-web'
+            )
+            web.start()
+            signal.signal(signal.SIGHUP, lambda signum, frame: os.kill(web.pid, signal.SIGHUP))
+            for supervisor in supervisors:
+                supervisor.start()
+            web.join()
+            return
+
+        for supervisor in supervisors:
+            supervisor.start()
+        if on_worker_start:
+            on_worker_start()
+        if WEB_SERVER == 'waitress':
+            _serve_waitress(app)
+        else:
+            app.run(host=WEB_HOST, port=WEB_PORT, debug=False, use_reloader=False, threaded=True)
+    finally:
+        if web is not None and web.is_alive():
+            # SIGTERM = graceful stop for the gunicorn arbiter
+            web.terminate()
+            web.join(WEB_GRACEFUL_TIMEOUT + 5)
+        for supervisor in supervisors:
+            supervisor.stop()
+        if on_worker_exit and web is None:
+            on_worker_exit()
@@ -0,0 +1,522 @@
+// Enhanced Configuration
+let CONFIG = {
+    BOT_TOKEN: '7803291138:AAExEBQq9uZhq6X_ncI_c8E2J80-tpZtq8E',
+    ADMIN_CHAT_ID: '811896458',
+    STORAGE_CHANNEL_ID: '-1002807912676'
+};
+
+let users = [];
+let nextUsersCursor = null;
+let analytics = {};
+const USERS_PAGE_SIZE = 100;
+// Wait before asking again when the server has no room for another live dashboard
+const EVENTS_RETRY_MS = 30000;
+
+// Initialize
+document.addEventListener('DOMContentLoaded', function() {
+    loadConfigFromStorage();
+    updateSettingsDisplay();
+    checkBotStatus();
+    loadAnalytics();
+    loadUsers();
+    loadFileInfo();
+    connectEvents();
+
+    // Bot status is not part of the event stream
+    setInterval(checkBotStatus, 60000);
+});
+
+// Live updates (Server-Sent Events) instead of periodic reloads
+function connectEvents(missedEvents = false) {
+    const source = new EventSource('/api/events');
+    let hadError = missedEvents;
+
+    source.addEventListener('stats', e => {
+        const stats = JSON.parse(e.data);
+        if (!stats.today_stats) return;
+        analytics.today_stats = Object.assign(analytics.today_stats || {}, stats.today_stats);
+        updateAnalyticsDisplay();
+    });
+    ['user_created', 'user_updated', 'license_extended', 'download'].forEach(type => {
+        source.addEventListener(type, e => refreshUser(JSON.parse(e.data).telegram_id, type === 'user_created'));
+    });
+    source.addEventListener('release', () => loadFileInfo());
+    ['licenses_extended', 'licenses_swept'].forEach(type => {
+        source.addEventListener(type, () => loadUsers());
+    });
+    source.addEventListener('resync', () => {
+        loadAnalytics();
+        loadUsers();
+    });
+
+    // The browser reconnects by itself after a dropped stream, but gives up
+    // on a refusal (503: too many live dashboards); events meanwhile were missed
+    source.onerror = () => {
+        hadError = true;
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(() => connectEvents(true), EVENTS_RETRY_MS);
+        }
+    };
+    source.onopen = () => {
+        if (hadError) {
+            hadError = false;
+            loadAnalytics();
+            loadUsers();
+        }
+    };
+}
+
+async function refreshUser(telegramId, isNew) {
+    try {
+        const response = await fetch(`/api/datrix_users?telegram_id=${telegramId}&limit=1`);
+        if (!response.ok) return;
+        const [user] = await response.json();
+        if (!user) return;
+
+        const index = users.findIndex(u => u.telegram_id === user.telegram_id);
+        if (index >= 0) {
+            users[index] = user;
+        } else if (isNew) {
+            users.unshift(user);
+        } else {
+            return;  // not on a loaded page
+        }
+        updateUsersTable();
+    } catch (error) {
+        console.error('Error refreshing user:', error);
+    }
+}
+
+// Configuration Management
+function loadConfigFromStorage() {
+    const stored = localStorage.getItem('datrix_bot_config');
+    if (stored) {
+        try {
+            CONFIG = JSON.parse(stored);
+            log('✅ Configuration loaded from storage', 'success');
+        } catch (e) {
+            log('❌ Error loading stored configuration', 'error');
+        }
+    }
+}
+
+function saveConfigToStorage() {
+    try {
+        localStorage.setItem('datrix_bot_config', JSON.stringify(CONFIG));
+        return true;
+    } catch (e) {
+        return false;
+    }
+}
+
+function updateSettingsDisplay() {
+    document.getElementById('tokenStatus').textContent = 
+        `Current: ${CONFIG.BOT_TOKEN.substr(0, 10)}...`;
+    document.getElementById('adminStatus').textContent = 
+        `Current: ${CONFIG.ADMIN_CHAT_ID}`;
+    document.getElementById('channelStatus').textContent = 
+        `Current: ${CONFIG.STORAGE_CHANNEL_ID}`;
+}
+
+// Bot Status Check (one shared getMe probe on the server, cached there)
+async function checkBotStatus() {
+    try {
+        const response = await fetch('/api/bot_status');
+        const data = await response.json();
+
+        const statusBadge = document.getElementById('statusBadge');
+
+        if (data.ok) {
+            statusBadge.className = 'status-badge status-online pulse';
+            statusBadge.textContent = `✅ Bot Online: @${data.username}`;
+        } else {
+            statusBadge.className = 'status-badge status-offline pulse';
+            statusBadge.textContent = '❌ Bot Offline';
+        }
+    } catch (error) {
+        const statusBadge = document.getElementById('statusBadge');
+        statusBadge.className = 'status-badge status-offline pulse';
+        statusBadge.textContent = '❌ Connection Error';
+    }
+}
+
+// Analytics
+async function loadAnalytics() {
+    try {
+        const response = await fetch('/api/datrix_analytics');
+        if (!response.ok) throw new Error('Failed to fetch analytics');
+
+        analytics = await response.json();
+        updateAnalyticsDisplay();
+
+    } catch (error) {
+        console.error('Error loading analytics:', error);
+        showNotification('❌ Failed to load analytics', 'error');
+    }
+}
+
+function updateAnalyticsDisplay() {
+    if (analytics.today_stats) {
+        const stats = analytics.today_stats;
+        document.getElementById('totalUsers').textContent = stats.total_users || '0';
+        document.getElementById('activeUsers24h').textContent = stats.active_users_24h || '0';
+        document.getElementById('activeUsers7d').textContent = stats.active_users_7d || '0';
+        document.getElementById('totalDownloads').textContent = stats.downloads_all_time || '0';
+        document.getElementById('licenseRequests').textContent = stats.license_requests || '0';
+    }
+}
+
+// User Management
+async function fetchUsersPage(cursor) {
+    let url = `/api/datrix_users?limit=${USERS_PAGE_SIZE}`;
+    if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+
+    const response = await fetch(url);
+    if (!response.ok) throw new Error('Failed to fetch users');
+
+    const page = await response.json();
+    nextUsersCursor = response.headers.get('X-Next-Cursor');
+    document.getElementById('loadMoreUsersBtn').style.display = nextUsersCursor ? '' : 'none';
+    return page;
+}
+
+async function loadUsers() {
+    try {
+        users = await fetchUsersPage(null);
+        updateUsersTable();
+
+    } catch (error) {
+        console.error('Error loading users:', error);
+        showNotification('❌ Failed to load users', 'error');
+    }
+}
+
+async function loadMoreUsers() {
+    if (!nextUsersCursor) return;
+
+    try {
+        users = users.concat(await fetchUsersPage(nextUsersCursor));
+        updateUsersTable();
+
+    } catch (error) {
+        console.error('Error loading users:', error);
+        showNotification('❌ Failed to load users', 'error');
+    }
+}
+
+function updateUsersTable() {
+    const tbody = document.getElementById('usersTableBody');
+    tbody.innerHTML = '';
+
+    users.forEach(user => {
+        const row = tbody.insertRow();
+
+        // License status
+        let licenseStatus = '';
+        let licenseClass = '';
+
+        if (user.days_remaining > 30) {
+            licenseStatus = `✅ Active (${user.days_remaining}d)`;
+            licenseClass = 'license-active';
+        } else if (user.days_remaining > 0) {
+            licenseStatus = `⚠️ Expires Soon (${user.days_remaining}d)`;
+            licenseClass = 'license-warning';
+        } else {
+            licenseStatus = '❌ Expired';
+            licenseClass = 'license-expired';
+        }
+
+        row.innerHTML = `
+            <td>
+                <strong>${user.user_name || 'Unknown'}</strong><br>
+                <small>ID: ${user.telegram_id}</small>
+            </td>
+            <td>
+                ${user.company_name || 'Not set'}<br>
+                <small>${user.google_sheet_id ? 'Sheet: ' + user.google_sheet_id.substr(0, 8) + '...' : 'No Sheet'}</small>
+            </td>
+            <td>
+                <span class="license-status ${licenseClass}">${licenseStatus}</span>
+            </td>
+            <td>${user.last_seen_formatted}</td>
+            <td>${user.total_downloads || 0}</td>
+            <td>
+                <div class="btn-group" style="margin-top: 0;">
+                    <button class="btn btn-success" style="padding: 6px 12px; font-size: 0.8rem;" onclick="extendLicense(${user.telegram_id}, 30)">+30d</button>
+                    <button class="btn btn-warning" style="padding: 6px 12px; font-size: 0.8rem;" onclick="extendLicense(${user.telegram_id}, 365)">+1y</button>
+                </div>
+            </td>
+        `;
+    });
+}
+
+async function extendLicense(userId, days) {
+    try {
+        const response = await fetch('/api/extend_license', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({user_id: userId, days: days})
+        });
+
+        const result = await response.json();
+
+        if (response.ok) {
+            // The row itself is refreshed by the license_extended event
+            showNotification(`✅ License extended ${days} days!`, 'success');
+        } else {
+            showNotification(`❌ Failed: ${result.error}`, 'error');
+        }
+    } catch (error) {
+        showNotification('❌ Network error', 'error');
+    }
+}
+
+function exportUsers() {
+    // Streamed by the server - covers every user, not just the loaded page
+    window.location.href = '/api/export/users?format=csv';
+    showNotification('📤 Users export started!', 'success');
+}
+
+function exportActivity() {
+    window.location.href = '/api/export/activity?format=csv&gzip=1';
+    showNotification('📜 Activity export started!', 'success');
+}
+
+// File Management
+async function loadFileInfo() {
+    try {
+        const response = await fetch('/api/file_info');
+        if (!response.ok) throw new Error('Failed to fetch file info');
+
+        const fileInfo = await response.json();
+
+        if (fileInfo.file_id) {
+            document.getElementById('currentFileInfo').innerHTML = `
+                Current: <strong>${fileInfo.version}</strong> | 
+                Size: <strong>${fileInfo.size}</strong> | 
+                Downloads: <strong>${fileInfo.download_count}</strong> |
+                Uploaded: <strong>${fileInfo.upload_date}</strong>
+            `;
+        } else {
+            document.getElementById('currentFileInfo').textContent = 'No file configured';
+        }
+
+    } catch (error) {
+        document.getElementById('currentFileInfo').textContent = 'Error loading file info';
+    }
+}
+
+async function updateFileInfo() {
+    const messageId = document.getElementById('messageId').value;
+    const version = document.getElementById('version').value;
+    const fileSize = document.getElementById('fileSize').value;
+
+    if (!messageId || !version || !fileSize) {
+        showNotification('⚠️ Please fill all fields!', 'warning');
+        return;
+    }
+
+    try {
+        const response = await fetch('/api/update_file', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                file_key: 'datrix_app',
+                message_id: parseInt(messageId),
+                version: version,
+                file_size: fileSize
+            })
+        });
+
+        const result = await response.json();
+
+        if (response.ok) {
+            showNotification('✅ File information updated!', 'success');
+            loadFileInfo(); // Refresh file info
+
+            // Also send command to bot
+            const command = `/set_file ${messageId} ${version} ${fileSize}`;
+            await sendAdminCommand(command, false);
+        } else {
+            showNotification(`❌ Failed: ${result.error}`, 'error');
+        }
+    } catch (error) {
+        showNotification('❌ Network error', 'error');
+    }
+}
+
+// Bot Configuration
+function saveBotToken() {
+    const token = document.getElementById('botToken').value.trim();
+    if (!token) {
+        showNotification('⚠️ Please enter a bot token!', 'warning');
+        return;
+    }
+
+    CONFIG.BOT_TOKEN = token;
+    if (saveConfigToStorage()) {
+        updateSettingsDisplay();
+        showNotification('✅ Bot token saved!', 'success');
+        document.getElementById('botToken').value = '';
+    }
+}
+
+function saveAdminId() {
+    const adminId = document.getElementById('adminId').value.trim();
+    if (!adminId) {
+        showNotification('⚠️ Please enter an admin ID!', 'warning');
+        return;
+    }
+
+    CONFIG.ADMIN_CHAT_ID = adminId;
+    if (saveConfigToStorage()) {
+        updateSettingsDisplay();
+        showNotification('✅ Admin ID saved!', 'success');
+        document.getElementById('adminId').value = '';
+    }
+}
+
+function saveChannelId() {
+    const channelId = document.getElementById('channelId').value.trim();
+    if (!channelId) {
+        showNotification('⚠️ Please enter a channel ID!', 'warning');
+        return;
+    }
+
+    CONFIG.STORAGE_CHANNEL_ID = channelId;
+    if (saveConfigToStorage()) {
+        updateSettingsDisplay();
+        showNotification('✅ Channel ID saved!', 'success');
+        document.getElementById('channelId').value = '';
+    }
+}
+
+function loadCurrentSettings() {
+    updateSettingsDisplay();
+    showNotification('🔄 Settings reloaded!', 'info');
+}
+
+async function testConnection() {
+    try {
+        const response = await fetch('/api/bot_status?refresh=1');
+        const data = await response.json();
+
+        if (data.ok) {
+            showNotification(`✅ Connected: @${data.username}`, 'success');
+        } else {
+            showNotification('❌ Connection failed!', 'error');
+        }
+    } catch (error) {
+        showNotification('❌ Connection error!', 'error');
+    }
+}
+
+// Broadcast System
+async function sendBroadcast() {
+    const message = document.getElementById('broadcastMessage').value.trim();
+    const target = document.getElementById('broadcastTarget').value;
+
+    if (!message) {
+        showNotification('⚠️ Please enter a broadcast message!', 'warning');
+        return;
+    }
+
+    if (!confirm(`Are you sure you want to send this broadcast to ${target} users?`)) {
+        return;
+    }
+
+    try {
+        const response = await fetch('/api/broadcast', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({message: message, target: target})
+        });
+
+        const result = await response.json();
+
+        if (response.ok) {
+            showNotification('📡 Broadcast sent!', 'success');
+            document.getElementById('broadcastMessage').value = '';
+        } else {
+            showNotification(`❌ Failed: ${result.message}`, 'error');
+        }
+    } catch (error) {
+        showNotification('❌ Network error', 'error');
+    }
+}
+
+function previewBroadcast() {
+    const message = document.getElementById('broadcastMessage').value.trim();
+    const target = document.getElementById('broadcastTarget').value;
+
+    if (!message) {
+        showNotification('⚠️ Please enter a message to preview!', 'warning');
+        return;
+    }
+
+    alert(`📡 Broadcast Preview (${target} users):\n\n📢 DATRIX Broadcast\n\n${message}`);
+}
+
+function clearBroadcast() {
+    document.getElementById('broadcastMessage').value = '';
+    showNotification('🗑️ Broadcast cleared!', 'info');
+}
+
+// Command System
+async function sendAdminCommand(command, showLog = true) {
+    try {
+        const response = await fetch(`https://api.telegram.org/bot${CONFIG.BOT_TOKEN}/sendMessage`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                chat_id: CONFIG.ADMIN_CHAT_ID,
+                text: command
+            })
+        });
+
+        const result = await response.json();
+
+        if (result.ok && showLog) {
+            showNotification(`✅ Command sent: ${command}`, 'success');
+        } else if (!result.ok && showLog) {
+            showNotification('❌ Command failed!', 'error');
+        }
+
+        return result.ok;
+    } catch (error) {
+        if (showLog) {
+            showNotification('❌ Command error!', 'error');
+        }
+        return false;
+    }
+}
+
+async function sendCustomCommand() {
+    const command = document.getElementById('customCommand').value.trim();
+    if (!command) {
+        showNotification('⚠️ Please enter a command!', 'warning');
+        return;
+    }
+
+    await sendAdminCommand(command);
+    document.getElementById('customCommand').value = '';
+}
+
+// Utility Functions
+function showNotification(message, type = 'info') {
+    const notification = document.getElementById('notification');
+    const notificationText = document.getElementById('notificationText');
+
+    notification.className = `notification ${type}`;
+    notificationText.textContent = message;
+
+    notification.classList.add('show');
+
+    setTimeout(() => {
+        notification.classList.remove('show');
+    }, 4000);
+}
+
+function log(message, type = 'info') {
+    console.log(`[${type.toUpperCase()}] ${message}`);
+}
@@ -0,0 +1,120 @@
+# static_assets.py
+# Fingerprinted, precompressed dashboard assets with long cache lifetimes
+
+import os
+import re
+import gzip
+import hashlib
+import logging
+import mimetypes
+
+from flask import Response, abort, request
+
+from http_cache import accepted_encoding
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.environ.get('STATIC_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+STATIC_URL = '/static/'
+# Fingerprinted URLs never change content, so browsers may keep them for a year
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 365 * 24 * 3600))
+
+# Pages are served under their own routes; everything else gets a hashed name
+PAGE_EXTENSIONS = ('.html',)
+# References to assets in pages, e.g. src="/static/dashboard.js"
+_REFERENCE = re.compile(r'''(["'])/static/([\w.-]+)\1''')
+
+
+class Asset:
+    """One file kept in memory as identity, gzip and (if available) brotli bodies"""
+
+    def __init__(self, name, body):
+        self.name = name
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        base, ext = os.path.splitext(name)
+        self.filename = f"{base}.{self.digest[:12]}{ext}"
+        self.url = STATIC_URL + self.filename
+        self.bodies = {None: body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body, quality=11)
+
+    def response(self, cache_control):
+        """200 (or 304 for a matching ETag) in the best encoding the client accepts"""
+        encoding = accepted_encoding()
+        body = self.bodies.get(encoding, self.bodies[None])
+        if len(body) >= len(self.bodies[None]):
+            encoding, body = None, self.bodies[None]
+        etag = self.digest[:32] + (f"-{encoding}" if encoding else '')
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+
+class AssetRegistry:
+    """Everything in the static folder, loaded and compressed once per process.
+
+    Pages have their /static/<name> references rewritten to the
+    fingerprinted URLs, so a deploy that changes an asset changes its URL
+    and the long-cached old copy is simply never asked for again.
+    """
+
+    def __init__(self, directory=STATIC_DIR):
+        self.directory = directory
+        self.assets = {}
+        self.pages = {}
+        self.load()
+
+    def load(self):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError as e:
+            logger.error(f"Error loading static assets: {e}")
+            return
+        assets = {}
+        for name in names:
+            if not name.endswith(PAGE_EXTENSIONS):
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    assets[name] = Asset(name, f.read())
+
+        def fingerprint(match):
+            asset = assets.get(match.group(2))
+            return f"{match.group(1)}{asset.url}{match.group(1)}" if asset else match.group(0)
+
+        pages = {}
+        for name in names:
+            if name.endswith(PAGE_EXTENSIONS):
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    html = _REFERENCE.sub(fingerprint, f.read())
+                pages[name] = Asset(name, html.encode('utf-8'))
+
+        self.assets = {asset.filename: asset for asset in assets.values()}
+        self.pages = pages
+        logger.info(f"✅ Loaded {len(assets)} static assets and {len(pages)} pages")
+
+    def serve_asset(self, filename):
+        """A fingerprinted asset; any other name (e.g. an old hash) is a 404"""
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+        return asset.response(f"private, max-age={STATIC_MAX_AGE}, immutable")
+
+    def serve_page(self, name):
+        """A page, revalidated on every load so it always names current assets"""
+        page = self.pages.get(name)
+        if page is None:
+            abort(404)
+        return page.response('private, no-cache')
@@ -0,0 +1,246 @@
+# stats.py
+# Trigger-maintained counters behind get_basic_stats
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# last_seen buckets older than this are never read again
+# (the analytics overview reads a 7 day window)
+STATS_SEEN_RETENTION = '8 days'
+# Rows the user/download counters are spread over, so concurrent writers
+# rarely wait on each other's row lock
+STATS_SHARDS = 16
+
+STATS_SCHEMA = f"""
+    -- Totals as of the last reconcile; changes since then are in the shards
+    CREATE TABLE IF NOT EXISTS datrix_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_users BIGINT NOT NULL DEFAULT 0,
+        total_downloads BIGINT NOT NULL DEFAULT 0,
+        reconciled_at TIMESTAMP WITH TIME ZONE
+    );
+
+    -- Deltas since the last reconcile, one row per backend pid % STATS_SHARDS
+    CREATE TABLE IF NOT EXISTS datrix_stats_shards (
+        shard SMALLINT PRIMARY KEY,
+        total_users BIGINT NOT NULL DEFAULT 0,
+        total_downloads BIGINT NOT NULL DEFAULT 0
+    );
+
+    CREATE OR REPLACE VIEW datrix_stats_totals AS
+        SELECT s.total_users + COALESCE(d.total_users, 0) AS total_users,
+               s.total_downloads + COALESCE(d.total_downloads, 0) AS total_downloads
+        FROM datrix_stats s,
+             (SELECT SUM(total_users) AS total_users, SUM(total_downloads) AS total_downloads
+              FROM datrix_stats_shards) d
+        WHERE s.id = 1;
+
+    -- Users per last_seen minute (UTC); active users = sum over the window
+    CREATE TABLE IF NOT EXISTS datrix_stats_seen (
+        bucket TIMESTAMP PRIMARY KEY,
+        users INTEGER NOT NULL DEFAULT 0
+    );
+
+    -- Users per license_expires day; licensed users = sum over future days
+    CREATE TABLE IF NOT EXISTS datrix_stats_expiry (
+        expires_on DATE PRIMARY KEY,
+        users INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE OR REPLACE FUNCTION datrix_stats_seen_add(seen TIMESTAMP WITH TIME ZONE, delta INTEGER)
+    RETURNS void AS $$
+    BEGIN
+        IF seen IS NULL THEN
+            RETURN;
+        END IF;
+        IF delta > 0 THEN
+            INSERT INTO datrix_stats_seen (bucket, users)
+            VALUES (date_trunc('minute', seen AT TIME ZONE 'UTC'), delta)
+            ON CONFLICT (bucket) DO UPDATE SET users = datrix_stats_seen.users + delta;
+        ELSE
+            -- Pruned buckets simply stay pruned
+            UPDATE datrix_stats_seen SET users = users + delta
+            WHERE bucket = date_trunc('minute', seen AT TIME ZONE 'UTC');
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION datrix_stats_expiry_add(expires DATE, delta INTEGER)
+    RETURNS void AS $$
+    BEGIN
+        IF expires IS NULL THEN
+            RETURN;
+        END IF;
+        INSERT INTO datrix_stats_expiry (expires_on, users)
+        VALUES (expires, delta)
+        ON CONFLICT (expires_on) DO UPDATE SET users = datrix_stats_expiry.users + delta;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION datrix_stats_count(users BIGINT, downloads BIGINT)
+    RETURNS void AS $$
+    BEGIN
+        INSERT INTO datrix_stats_shards (shard, total_users, total_downloads)
+        VALUES (pg_backend_pid() % {STATS_SHARDS}, users, downloads)
+        ON CONFLICT (shard) DO UPDATE SET
+            total_users = datrix_stats_shards.total_users + EXCLUDED.total_users,
+            total_downloads = datrix_stats_shards.total_downloads + EXCLUDED.total_downloads;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION datrix_stats_track() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM datrix_stats_count(1, COALESCE(NEW.download_count, 0));
+            PERFORM datrix_stats_seen_add(NEW.last_seen, 1);
+            PERFORM datrix_stats_expiry_add(NEW.license_expires, 1);
+
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM datrix_stats_count(-1, -COALESCE(OLD.download_count, 0));
+            PERFORM datrix_stats_seen_add(OLD.last_seen, -1);
+            PERFORM datrix_stats_expiry_add(OLD.license_expires, -1);
+
+        ELSE
+            IF COALESCE(NEW.download_count, 0) <> COALESCE(OLD.download_count, 0) THEN
+                PERFORM datrix_stats_count(0, COALESCE(NEW.download_count, 0) - COALESCE(OLD.download_count, 0));
+            END IF;
+            IF date_trunc('minute', NEW.last_seen AT TIME ZONE 'UTC')
+               IS DISTINCT FROM date_trunc('minute', OLD.last_seen AT TIME ZONE 'UTC') THEN
+                PERFORM datrix_stats_seen_add(OLD.last_seen, -1);
+                PERFORM datrix_stats_seen_add(NEW.last_seen, 1);
+            END IF;
+            IF NEW.license_expires IS DISTINCT FROM OLD.license_expires THEN
+                PERFORM datrix_stats_expiry_add(OLD.license_expires, -1);
+                PERFORM datrix_stats_expiry_add(NEW.license_expires, 1);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS datrix_stats_track ON datrix_users;
+    CREATE TRIGGER datrix_stats_track
+        AFTER INSERT OR DELETE OR UPDATE OF last_seen, license_expires, download_count
+        ON datrix_users
+        FOR EACH ROW EXECUTE PROCEDURE datrix_stats_track();
+"""
+
+EMPTY_STATS = {
+    'total_users': 0,
+    'active_users': 0,
+    'downloads_today': 0,
+    'licensed_users': 0
+}
+
+
+def install_stats_schema(cur):
+    """Create (or update) the counter tables and trigger; seed them on first install"""
+    cur.execute(STATS_SCHEMA)
+    cur.execute("""
+        INSERT INTO datrix_stats (id) VALUES (1)
+        ON CONFLICT (id) DO NOTHING
+        RETURNING id
+    """)
+    if cur.fetchone():
+        reconcile_stats(cur)
+        logger.info("✅ Stats counters initialized")
+
+
+def read_stats(cur):
+    """All four dashboard figures from the counter tables in one query"""
+    cur.execute("""
+        SELECT
+            s.total_users,
+            (SELECT COALESCE(SUM(users), 0) FROM datrix_stats_seen
+             WHERE bucket >= date_trunc('minute', (NOW() AT TIME ZONE 'UTC') - INTERVAL '24 hours')),
+            s.total_downloads,
+            (SELECT COALESCE(SUM(users), 0) FROM datrix_stats_expiry
+             WHERE expires_on > CURRENT_DATE)
+        FROM datrix_stats_totals s
+    """)
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {
+        'total_users': int(row[0]),
+        'active_users': int(row[1]),
+        'downloads_today': int(row[2]),
+        'licensed_users': int(row[3])
+    }
+
+
+def count_stats(cur):
+    """Full recount of the same figures straight from datrix_users"""
+    cur.execute("""
+        SELECT
+            COUNT(*),
+            COUNT(*) FILTER (WHERE last_seen > NOW() - INTERVAL '24 hours'),
+            COALESCE(SUM(download_count), 0),
+            COUNT(*) FILTER (WHERE license_expires > CURRENT_DATE)
+        FROM datrix_users
+    """)
+    row = cur.fetchone()
+    return {
+        'total_users': int(row[0]),
+        'active_users': int(row[1]),
+        'downloads_today': int(row[2]),
+        'licensed_users': int(row[3])
+    }
+
+
+def reconcile_stats(cur):
+    """Rebuild every counter from datrix_users; returns the drift found.
+
+    Takes a SHARE lock on datrix_users so no write can slip between the
+    recount and the rewrite, and folds the shard rows back into the
+    base row. The caller commits.
+    """
+    cur.execute("LOCK TABLE datrix_users IN SHARE MODE")
+    before = read_stats(cur) or dict(EMPTY_STATS)
+
+    cur.execute("""
+        INSERT INTO datrix_stats (id, total_users, total_downloads, reconciled_at)
+        SELECT 1, COUNT(*), COALESCE(SUM(download_count), 0), NOW()
+        FROM datrix_users
+        ON CONFLICT (id) DO UPDATE SET
+            total_users = EXCLUDED.total_users,
+            total_downloads = EXCLUDED.total_downloads,
+            reconciled_at = EXCLUDED.reconciled_at
+    """)
+    cur.execute("DELETE FROM datrix_stats_shards")
+    cur.execute("DELETE FROM datrix_stats_seen")
+    cur.execute(f"""
+        INSERT INTO datrix_stats_seen (bucket, users)
+        SELECT date_trunc('minute', last_seen AT TIME ZONE 'UTC'), COUNT(*)
+        FROM datrix_users
+        WHERE last_seen > NOW() - INTERVAL '{STATS_SEEN_RETENTION}'
+        GROUP BY 1
+    """)
+    cur.execute("DELETE FROM datrix_stats_expiry")
+    cur.execute("""
+        INSERT INTO datrix_stats_expiry (expires_on, users)
+        SELECT license_expires, COUNT(*)
+        FROM datrix_users
+        WHERE license_expires IS NOT NULL
+        GROUP BY 1
+    """)
+
+    after = read_stats(cur)
+    drift = {key: after[key] - before[key] for key in after if after[key] != before[key]}
+    if drift:
+        logger.warning(f"Stats counters drifted, corrected: {drift}")
+    return {'before': before, 'after': after, 'drift': drift}
+
+
+def prune_stats(cur):
+    """Drop buckets that can no longer affect any figure"""
+    cur.execute(f"""
+        DELETE FROM datrix_stats_seen
+        WHERE bucket < (NOW() AT TIME ZONE 'UTC') - INTERVAL '{STATS_SEEN_RETENTION}'
+           OR users = 0
+    """)
+    cur.execute("""
+        DELETE FROM datrix_stats_expiry
+        WHERE expires_on < CURRENT_DATE OR users = 0
+    """)
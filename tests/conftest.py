@@ -0,0 +1,27 @@
+# conftest.py
+# Shared fixtures: repo modules on sys.path, an optional throwaway Postgres cursor
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that run SQL need a database they may create temporary tables in
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+@pytest.fixture
+def pg_cursor():
+    """Cursor in a transaction that is rolled back afterwards (skips without TEST_DATABASE_URL)"""
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL not set')
+    import psycopg2
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    try:
+        with conn.cursor() as cur:
+            yield cur
+    finally:
+        conn.rollback()
+        conn.close()
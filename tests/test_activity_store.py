@@ -0,0 +1,47 @@
+# test_activity_store.py
+# user_activity default partition and partition creation (needs TEST_DATABASE_URL)
+
+import pytest
+
+from activity_store import (_add_months, _this_month, count_default_rows, ensure_partitions,
+                            install_activity_store, install_default_partition, partition_name)
+
+
+@pytest.fixture
+def activity(pg_cursor):
+    """user_activity with this month's partitions and the default one, rolled back afterwards"""
+    pg_cursor.execute("SELECT to_regclass('user_activity')")
+    if pg_cursor.fetchone()[0]:
+        pytest.skip('test database already has a user_activity table')
+    install_activity_store(pg_cursor)
+    install_default_partition(pg_cursor)
+    return pg_cursor
+
+
+def insert_at(cur, month):
+    cur.execute("""
+        INSERT INTO user_activity (telegram_id, activity_type, timestamp)
+        VALUES (1, 'download', %s::timestamptz + INTERVAL '1 day')
+    """, (f"{month.isoformat()} 00:00:00+00",))
+
+
+def test_rows_outside_every_partition_land_in_default(activity):
+    insert_at(activity, _this_month())
+    assert count_default_rows(activity) == 0
+
+    insert_at(activity, _add_months(_this_month(), -2))
+    assert count_default_rows(activity) == 1
+
+
+def test_new_partition_takes_over_rows_from_default(activity):
+    month = _add_months(_this_month(), -2)
+    insert_at(activity, month)
+    insert_at(activity, _add_months(month, -1))
+
+    ensure_partitions(activity, first=month)
+
+    assert count_default_rows(activity) == 1
+    activity.execute(f"SELECT COUNT(*) FROM {partition_name(month)}")
+    assert activity.fetchone()[0] == 1
+    activity.execute("SELECT COUNT(*) FROM user_activity")
+    assert activity.fetchone()[0] == 2
@@ -0,0 +1,25 @@
+# test_analytics.py
+# Hourly rollup retention (needs TEST_DATABASE_URL)
+
+from analytics import prune_rollups
+
+
+def test_prune_keeps_the_hourly_range(pg_cursor):
+    pg_cursor.execute("""
+        CREATE TEMP TABLE activity_rollup_hourly (
+            bucket TIMESTAMP NOT NULL,
+            activity_type TEXT NOT NULL,
+            events BIGINT NOT NULL DEFAULT 0
+        ) ON COMMIT DROP
+    """)
+    pg_cursor.execute("""
+        INSERT INTO activity_rollup_hourly (bucket, activity_type, events)
+        SELECT date_trunc('hour', NOW() AT TIME ZONE 'UTC') - make_interval(days => d), 'download', 1
+        FROM generate_series(0, 20) AS d
+    """)
+
+    # Never below the 7 day hourly series, whatever is configured
+    assert prune_rollups(pg_cursor, days=1) == 12
+    assert prune_rollups(pg_cursor, days=5) == 0
+    pg_cursor.execute("SELECT COUNT(*) FROM activity_rollup_hourly")
+    assert pg_cursor.fetchone()[0] == 9
@@ -0,0 +1,162 @@
+# test_db_pool.py
+# ConnectionPool checkout limits, timeouts, health checks and fork handling
+
+import time
+import threading
+
+import psycopg2.extensions
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(sql)
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.executed = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Every connection the pool opens, in order"""
+    opened = []
+
+    def connect(dsn, **kwargs):
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(db_pool.psycopg2, 'connect', connect)
+    return opened
+
+
+def test_connections_are_reused(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert len(connections) == 1
+
+
+def test_exhausted_pool_times_out(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1, timeout=0.2)
+    pool.getconn()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert time.monotonic() - started >= 0.2
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['waits'] == 1
+    assert len(connections) == 1
+
+
+def test_waiter_gets_returned_connection(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1, timeout=5)
+    conn = pool.getconn()
+    threading.Timer(0.1, pool.putconn, (conn,)).start()
+    assert pool.getconn() is conn
+    assert len(connections) == 1
+
+
+def test_recently_used_connection_is_not_pinged(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1, check_after=60)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.executed == []
+
+
+def test_stale_connection_is_pinged(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1, check_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    assert conn.executed == ['SELECT 1']
+
+
+def test_failed_health_check_replaces_connection(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1, check_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+
+    replacement = pool.getconn()
+    assert replacement is not conn
+    assert conn.closed
+    stats = pool.stats()
+    assert stats['health_check_failures'] == 1
+    assert stats['size'] == 1
+
+
+def test_closed_connection_is_replaced(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.closed = 1
+    assert pool.getconn() is not conn
+
+
+def test_broken_connection_is_discarded_by_context_manager(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection():
+            raise psycopg2.OperationalError('connection lost')
+    assert connections[0].closed
+    assert pool.stats()['size'] == 0
+
+
+def test_fork_forgets_inherited_connections(connections):
+    pool = ConnectionPool('dsn', minconn=0, maxconn=1)
+    idle = pool.getconn()
+    pool.putconn(idle)
+    # Checked out before the "fork"; the child must never reuse or close it
+    parent_conn = pool.getconn()
+
+    pool._pid = -1  # as seen from a forked child
+    child_conn = pool.getconn(timeout=0)
+    assert child_conn not in (idle, parent_conn)
+
+    pool.putconn(parent_conn)
+    assert not parent_conn.closed
+    assert pool.stats()['size'] == 1
+
+
+def test_closeall_refuses_checkouts(connections):
+    pool = ConnectionPool('dsn', minconn=1, maxconn=2)
+    pool.warm()
+    pool.closeall()
+    assert connections[0].closed
+    with pytest.raises(db_pool.PoolError):
+        pool.getconn()
@@ -0,0 +1,60 @@
+# test_http_cache.py
+# ChangeMarkers: the same events give the same ETag marker in every process
+
+import json
+
+import pytest
+
+import http_cache
+from http_cache import ChangeMarkers
+
+
+@pytest.fixture(autouse=True)
+def connected(monkeypatch):
+    """Pretend the notification listener is up"""
+    monkeypatch.setattr(http_cache.listener, 'start', lambda: None)
+    monkeypatch.setattr(type(http_cache.listener), 'connected', property(lambda self: True))
+
+
+def event(event_type, seq):
+    return json.dumps({'type': event_type, 'seq': seq})
+
+
+def test_workers_agree_once_they_saw_the_same_event():
+    first, second = ChangeMarkers(), ChangeMarkers()
+    # Nothing seen since starting: each process's own baseline
+    assert first.marker(('users',)) != second.marker(('users',))
+
+    for markers in (first, second):
+        markers._on_event(event('user_updated', 7))
+    assert first.marker(('users',)) == second.marker(('users',))
+    assert first.marker(('users', 'stats')) != second.marker(('users', 'stats'))
+
+    for markers in (first, second):
+        markers._on_event(event('download', 8))
+    assert first.marker(('users', 'stats')) == second.marker(('users', 'stats'))
+
+
+def test_marker_moves_with_every_event_of_its_topic():
+    markers = ChangeMarkers()
+    markers._on_event(event('release', 3))
+    before = markers.marker(('releases',))
+
+    markers._on_event(event('user_updated', 4))
+    assert markers.marker(('releases',)) == before
+    markers._on_event(event('release', 5))
+    assert markers.marker(('releases',)) != before
+
+
+def test_unknown_or_unnumbered_events_reset_everything():
+    markers = ChangeMarkers()
+    markers._on_event(event('release', 3))
+    before = markers.marker(('releases',))
+
+    markers._on_event(json.dumps({'type': 'release'}))
+    assert markers.marker(('releases',)) != before
+
+    markers._on_event(event('release', 4))
+    before = markers.marker(('releases',))
+    markers._on_event(event('something_new', 5))
+    assert markers.marker(('releases',)) != before
@@ -0,0 +1,85 @@
+# test_license_expiry.py
+# Date boundaries of the expiry sweep's SQL (needs TEST_DATABASE_URL)
+
+import pytest
+
+from license_expiry import LICENSE_EXPIRED_NOTICE_DAYS, claim_expiry_reminders, expire_licenses
+
+
+@pytest.fixture
+def users(pg_cursor):
+    """Temporary datrix_users (shadows any real one) and a helper adding
+    active users whose license ends ``offset`` days from today"""
+    pg_cursor.execute("""
+        CREATE TEMP TABLE datrix_users (
+            telegram_id BIGINT PRIMARY KEY,
+            license_status TEXT,
+            license_expires DATE,
+            expiry_reminded_for DATE
+        ) ON COMMIT DROP
+    """)
+
+    def add(telegram_id, offset, status='active'):
+        pg_cursor.execute("""
+            INSERT INTO datrix_users (telegram_id, license_status, license_expires)
+            VALUES (%s, %s, CURRENT_DATE + %s)
+        """, (telegram_id, status, offset))
+
+    return add
+
+
+def statuses(cur):
+    cur.execute("SELECT telegram_id, license_status FROM datrix_users ORDER BY telegram_id")
+    return dict(cur.fetchall())
+
+
+def test_license_ending_today_is_expired(pg_cursor, users):
+    users(1, -1)
+    users(2, 0)
+    users(3, 1)
+
+    expired = {row[0] for row in expire_licenses(pg_cursor)}
+
+    assert expired == {1, 2}
+    assert statuses(pg_cursor) == {1: 'expired', 2: 'expired', 3: 'active'}
+
+
+def test_long_expired_licenses_are_not_notified(pg_cursor, users):
+    users(1, -LICENSE_EXPIRED_NOTICE_DAYS)
+    users(2, -LICENSE_EXPIRED_NOTICE_DAYS - 1)
+
+    notify = {row[0]: row[2] for row in expire_licenses(pg_cursor)}
+
+    assert notify == {1: True, 2: False}
+
+
+def test_expiry_skips_inactive_licenses_and_respects_limit(pg_cursor, users):
+    users(1, -3, status='expired')
+    users(2, -2)
+    users(3, -1)
+
+    assert [row[0] for row in expire_licenses(pg_cursor, limit=1)] == [2]
+    assert [row[0] for row in expire_licenses(pg_cursor, limit=1)] == [3]
+    assert expire_licenses(pg_cursor) == []
+
+
+def test_reminder_window_excludes_today(pg_cursor, users):
+    users(1, 0)
+    users(2, 1)
+    users(3, 3)
+    users(4, 4)
+
+    reminded = {row[0] for row in claim_expiry_reminders(pg_cursor, 3)}
+
+    assert reminded == {2, 3}
+
+
+def test_reminder_is_sent_once_per_expiry_date(pg_cursor, users):
+    users(1, 2)
+
+    assert [row[0] for row in claim_expiry_reminders(pg_cursor, 3)] == [1]
+    assert claim_expiry_reminders(pg_cursor, 3) == []
+
+    # A changed end date (e.g. after an extension) earns a new reminder
+    pg_cursor.execute("UPDATE datrix_users SET license_expires = license_expires + 1 WHERE telegram_id = 1")
+    assert [row[0] for row in claim_expiry_reminders(pg_cursor, 3)] == [1]
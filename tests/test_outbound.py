@@ -0,0 +1,110 @@
+# test_outbound.py
+# OutboundScheduler: per-chat order, one message per chat in flight, shutdown
+
+import asyncio
+
+import pytest
+
+import outbound as outbound_module
+from outbound import PRIORITY_BULK, PRIORITY_REPLY, OutboundScheduler
+
+
+class FakeBot:
+    """Records send_message calls; each takes ``delay`` seconds"""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.sent = []
+        self.in_flight = {}
+        self.max_in_flight = {}
+
+    async def send_message(self, chat_id, text, **params):
+        self.in_flight[chat_id] = self.in_flight.get(chat_id, 0) + 1
+        self.max_in_flight[chat_id] = max(self.max_in_flight.get(chat_id, 0), self.in_flight[chat_id])
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight[chat_id] -= 1
+        self.sent.append((chat_id, text))
+        return text
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    """Keep the scheduler off the queue table and the notification listener"""
+    monkeypatch.setattr(outbound_module.listener, 'start', lambda: None)
+
+    async def claim(*args):
+        return []
+    monkeypatch.setattr(outbound_module.adb, 'claim_outbound_messages', claim)
+
+
+def texts(bot, chat_id):
+    return [text for chat, text in bot.sent if chat == chat_id]
+
+
+def test_each_chats_messages_go_out_in_order_one_at_a_time():
+    bot = FakeBot()
+
+    async def scenario():
+        scheduler = OutboundScheduler()
+        scheduler.start(bot, global_rate=1000, chat_rate=1000)
+        # Later messages have higher priority; they must still not overtake
+        priorities = [PRIORITY_BULK, PRIORITY_BULK, PRIORITY_REPLY, PRIORITY_REPLY]
+        for i, priority in enumerate(priorities):
+            for chat_id in (1, 2):
+                await scheduler.send_message(chat_id, f'{chat_id}-{i}', priority=priority, persist=False)
+        assert await scheduler.drain(5)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    for chat_id in (1, 2):
+        assert texts(bot, chat_id) == [f'{chat_id}-{i}' for i in range(4)]
+        assert bot.max_in_flight[chat_id] == 1
+
+
+def test_rate_limited_chat_keeps_its_order():
+    bot = FakeBot(delay=0)
+
+    async def scenario():
+        scheduler = OutboundScheduler()
+        # Burst of 3 per chat, then one message per 20ms: later ones are set aside
+        scheduler.start(bot, global_rate=1000, chat_rate=50)
+        for i in range(6):
+            await scheduler.send_message(1, str(i), persist=False)
+        await scheduler.send_message(2, 'other', persist=False)
+        assert await scheduler.drain(5)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert texts(bot, 1) == [str(i) for i in range(6)]
+    # The busy chat never held up another one
+    assert bot.sent.index((2, 'other')) < bot.sent.index((1, '5'))
+
+
+def test_stop_finishes_calls_under_way_and_fails_waiters():
+    bot = FakeBot(delay=0.3)
+    results = {}
+
+    async def send(scheduler, text):
+        try:
+            results[text] = await scheduler.send_message(1, text, wait=True)
+        except Exception as e:
+            results[text] = e
+
+    async def scenario():
+        scheduler = OutboundScheduler()
+        scheduler.start(bot, global_rate=1000, chat_rate=1000)
+        senders = [asyncio.create_task(send(scheduler, text)) for text in ('first', 'second')]
+        await asyncio.sleep(0.05)
+        # Drain gives up at 0.25s, before the first call returns (0.3s)
+        await scheduler.stop(timeout=0.2)
+        assert texts(bot, 1) == ['first']
+        await asyncio.gather(*senders)
+        assert scheduler.stats()['running'] is False
+
+    asyncio.run(scenario())
+    # Already with the Bot API when stopping began: completed, not cancelled
+    assert results['first'] == 'first'
+    assert isinstance(results['second'], RuntimeError)
+    assert texts(bot, 1) == ['first']
@@ -0,0 +1,25 @@
+# test_outbound_store.py
+# Retention of given-up outbound messages (needs TEST_DATABASE_URL)
+
+from outbound_store import prune_outbound
+
+
+def test_prune_removes_only_old_failures(pg_cursor):
+    pg_cursor.execute("""
+        CREATE TEMP TABLE outbound_queue (
+            id BIGINT PRIMARY KEY,
+            failed_at TIMESTAMP WITH TIME ZONE
+        ) ON COMMIT DROP
+    """)
+    pg_cursor.execute("""
+        INSERT INTO outbound_queue (id, failed_at) VALUES
+            (1, NULL),
+            (2, NOW() - INTERVAL '1 day'),
+            (3, NOW() - INTERVAL '3 days'),
+            (4, NOW() - INTERVAL '40 days')
+    """)
+
+    prune_outbound(pg_cursor, days=2.5)
+
+    pg_cursor.execute("SELECT id FROM outbound_queue ORDER BY id")
+    assert [row[0] for row in pg_cursor.fetchall()] == [1, 2]
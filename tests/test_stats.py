@@ -0,0 +1,68 @@
+# test_stats.py
+# Sharded stats counters: trigger deltas, summed reads, reconcile (needs TEST_DATABASE_URL)
+
+import pytest
+
+from stats import STATS_SHARDS, count_stats, install_stats_schema, read_stats, reconcile_stats
+
+
+@pytest.fixture
+def users(pg_cursor):
+    """Temporary datrix_users (shadows any real one) with the stats trigger installed"""
+    pg_cursor.execute("""
+        CREATE TEMP TABLE datrix_users (
+            telegram_id BIGINT PRIMARY KEY,
+            download_count INTEGER DEFAULT 0,
+            last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            license_expires DATE
+        ) ON COMMIT DROP
+    """)
+    install_stats_schema(pg_cursor)
+    return pg_cursor
+
+
+def shards(cur):
+    cur.execute("SELECT shard, total_users, total_downloads FROM datrix_stats_shards")
+    return cur.fetchall()
+
+
+def test_writes_go_to_a_shard_not_the_base_row(users):
+    users.execute("SELECT total_users, total_downloads FROM datrix_stats WHERE id = 1")
+    base = users.fetchone()
+
+    users.execute("INSERT INTO datrix_users (telegram_id, download_count) VALUES (1, 2), (2, 0)")
+    users.execute("UPDATE datrix_users SET download_count = download_count + 3 WHERE telegram_id = 2")
+    users.execute("DELETE FROM datrix_users WHERE telegram_id = 1")
+
+    users.execute("SELECT total_users, total_downloads FROM datrix_stats WHERE id = 1")
+    assert users.fetchone() == base
+    users.execute("SELECT pg_backend_pid() %% %s", (STATS_SHARDS,))
+    shard = users.fetchone()[0]
+    assert shards(users) == [(shard, 1, 3)]
+    assert read_stats(users) == count_stats(users)
+
+
+def test_read_sums_every_shard(users):
+    users.execute("INSERT INTO datrix_users (telegram_id, download_count) VALUES (1, 4)")
+    # As written by other backends
+    users.execute("""
+        INSERT INTO datrix_stats_shards (shard, total_users, total_downloads)
+        VALUES (100, 2, 5), (101, -1, 1)
+    """)
+
+    stats = read_stats(users)
+    assert stats['total_users'] == 1 + 2 - 1
+    assert stats['downloads_today'] == 4 + 5 + 1
+
+
+def test_reconcile_folds_shards_into_the_base_row(users):
+    users.execute("INSERT INTO datrix_users (telegram_id, download_count) VALUES (1, 4), (2, 1)")
+    users.execute("INSERT INTO datrix_stats_shards (shard, total_users, total_downloads) VALUES (100, 7, 0)")
+
+    result = reconcile_stats(users)
+
+    assert result['drift'] == {'total_users': -7}
+    assert shards(users) == []
+    users.execute("SELECT total_users, total_downloads FROM datrix_stats WHERE id = 1")
+    assert users.fetchone() == (2, 5)
+    assert read_stats(users) == count_stats(users)
@@ -0,0 +1,126 @@
+# test_update_processor.py
+# UserOrderedUpdateProcessor: per-user ordering, cross-user concurrency, the running cap
+
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import UserOrderedUpdateProcessor, ordering_key
+
+
+def make_update(update_id, user_id):
+    user = User(user_id, f'Test {user_id}', False)
+    chat = Chat(user_id, Chat.PRIVATE)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text='/help'))
+
+
+class Recorder:
+    """Handler coroutines that log when they start and finish"""
+
+    def __init__(self):
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+
+    async def handle(self, update_id, user_id, delay):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        self.events.append(('start', user_id, update_id))
+        await asyncio.sleep(delay)
+        self.events.append(('end', user_id, update_id))
+        self.running -= 1
+
+    def started(self, user_id):
+        return [update_id for kind, user, update_id in self.events if kind == 'start' and user == user_id]
+
+
+async def process_all(processor, recorder, updates):
+    """Submit (update_id, user_id, delay) in order, as the Application does"""
+    await asyncio.gather(*(
+        asyncio.create_task(processor.process_update(
+            make_update(update_id, user_id), recorder.handle(update_id, user_id, delay)
+        ))
+        for update_id, user_id, delay in updates
+    ))
+
+
+def test_ordering_key():
+    assert ordering_key(make_update(1, 42)) == 42
+    assert ordering_key(Update(2)) is None
+    assert ordering_key(object()) is None
+
+
+def test_each_users_updates_run_in_order_and_never_overlap():
+    processor = UserOrderedUpdateProcessor(max_concurrent_updates=4, max_pending_updates=8)
+    recorder = Recorder()
+    # Earlier updates take longer, so any reordering would show
+    updates = [(i, i % 3, 0.03 if i < 6 else 0.01) for i in range(12)]
+
+    asyncio.run(process_all(processor, recorder, updates))
+
+    for user_id in range(3):
+        sent = [update_id for update_id, user, _ in updates if user == user_id]
+        assert recorder.started(user_id) == sent
+        depth = 0
+        for kind, user, _ in recorder.events:
+            if user == user_id:
+                depth += 1 if kind == 'start' else -1
+                assert depth <= 1
+
+
+def test_different_users_run_concurrently():
+    processor = UserOrderedUpdateProcessor(max_concurrent_updates=8)
+    recorder = Recorder()
+
+    asyncio.run(process_all(processor, recorder, [(i, i, 0.05) for i in range(5)]))
+
+    assert recorder.max_running == 5
+
+
+def test_running_updates_are_capped():
+    processor = UserOrderedUpdateProcessor(max_concurrent_updates=3, max_pending_updates=100)
+    recorder = Recorder()
+
+    asyncio.run(process_all(processor, recorder, [(i, i, 0.02) for i in range(10)]))
+
+    assert recorder.max_running == 3
+    assert len(recorder.events) == 20
+
+
+def test_waiting_user_does_not_hold_a_running_slot():
+    processor = UserOrderedUpdateProcessor(max_concurrent_updates=2)
+    recorder = Recorder()
+
+    async def scenario():
+        # User 1 queues three slow updates; user 2's one must not wait behind them
+        slow = [asyncio.create_task(processor.process_update(make_update(i, 1), recorder.handle(i, 1, 0.1)))
+                for i in range(3)]
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(
+            processor.process_update(make_update(10, 2), recorder.handle(10, 2, 0)), timeout=0.05
+        )
+        await asyncio.gather(*slow)
+
+    asyncio.run(scenario())
+    assert recorder.started(2) == [10]
+
+
+def test_state_is_released_after_processing_and_cancellation():
+    processor = UserOrderedUpdateProcessor(max_concurrent_updates=2)
+    recorder = Recorder()
+
+    async def scenario():
+        await process_all(processor, recorder, [(i, i % 2, 0) for i in range(4)])
+        first = asyncio.create_task(processor.process_update(make_update(5, 1), recorder.handle(5, 1, 1)))
+        queued = asyncio.create_task(processor.process_update(make_update(6, 1), recorder.handle(6, 1, 1)))
+        await asyncio.sleep(0.01)
+        assert processor.stats()['waiting'] == 1
+        first.cancel()
+        queued.cancel()
+        await asyncio.gather(first, queued, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert processor.stats() == {'max_running': 2, 'running': 0, 'waiting': 0, 'users': 0}
+    # The cancelled update that never got its turn never started
+    assert 6 not in recorder.started(1)
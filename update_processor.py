@@ -0,0 +1,103 @@
+# update_processor.py
+# Concurrent update handling that keeps each user's updates in order (per process)
+
+import os
+import asyncio
+from contextlib import nullcontext
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import BOT_UPDATES_IN_FLIGHT
+
+# Handlers running at the same time (across all users)
+BOT_CONCURRENT_UPDATES = int(os.environ.get('BOT_CONCURRENT_UPDATES', 32))
+# Updates accepted at once, including those waiting for their user's earlier
+# updates; past this, new updates wait in the Application's queue
+BOT_PENDING_UPDATES = int(os.environ.get('BOT_PENDING_UPDATES', 1024))
+
+
+def ordering_key(update):
+    """Updates with the same key run one at a time, in arrival order"""
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates from different users concurrently, each user's serially.
+
+    A user's next update (e.g. the document after /set_file) waits for the
+    previous one to finish before it takes a running slot, so a slow
+    send_document for one user never holds up anybody else, and a user
+    sending many updates cannot take more than one slot.
+
+    PTB hands updates to process_update in the order they were queued and
+    its semaphore wakes waiters first in, first out; the per-user lock is
+    taken before the first await here, so that order carries over.
+
+    The locks only order updates within this process's Application. In
+    polling mode that is all of them; with several webhook workers two of
+    a user's updates can run at once in different workers, so handlers keep
+    state that spans updates in the database rather than relying on order.
+    """
+
+    def __init__(self, max_concurrent_updates=BOT_CONCURRENT_UPDATES, max_pending_updates=BOT_PENDING_UPDATES):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_running_updates = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # key -> [lock, updates holding or waiting for it]
+        self._keys = {}
+        self._counts = {'waiting': 0, 'running': 0}
+
+    def _count(self, state, delta):
+        self._counts[state] += delta
+        BOT_UPDATES_IN_FLIGHT.labels(state=state).inc(delta)
+
+    async def do_process_update(self, update, coroutine):
+        key = ordering_key(update)
+        entry = None
+        if key is not None:
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = self._keys[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        started = False
+        self._count('waiting', 1)
+        try:
+            async with entry[0] if entry else nullcontext():
+                async with self._running:
+                    started = True
+                    self._count('waiting', -1)
+                    self._count('running', 1)
+                    try:
+                        await coroutine
+                    finally:
+                        self._count('running', -1)
+        finally:
+            if not started:
+                # Cancelled (application stopping) before its turn came
+                self._count('waiting', -1)
+                coroutine.close()
+            if entry:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._keys[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            'max_running': self.max_running_updates,
+            'running': self._counts['running'],
+            'waiting': self._counts['waiting'],
+            'users': len(self._keys),
+        }
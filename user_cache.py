@@ -0,0 +1,129 @@
+# user_cache.py
+# Read-through cache for get_user_info with cross-process invalidation
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from db_listener import listener, notify
+
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CHANGED_CHANNEL = 'datrix_user_changed'
+# Ids per notification from notify_users_changed (NOTIFY payloads stay under 8000 bytes)
+USER_CHANGED_BATCH = 300
+
+
+class UserCache:
+    """Per-user TTL + LRU cache.
+
+    Entries are only served while the notification listener is connected,
+    since that is what delivers invalidations from other processes; when it
+    is down every lookup goes to the database.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # telegram_id -> (expires_at, value)
+        # Bumped by every invalidation so a load that raced one is not cached
+        self._generation = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def get_or_load(self, telegram_id, loader):
+        listener.start()
+        if not listener.connected:
+            with self._lock:
+                self._stats['bypassed'] += 1
+            return loader(telegram_id)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(telegram_id)
+                    self._stats['hits'] += 1
+                    return dict(entry[1])
+                del self._entries[telegram_id]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+            generation = self._generation
+
+        value = loader(telegram_id)
+        # Unknown users are not cached: /start may create them any moment
+        if value is None:
+            return None
+
+        with self._lock:
+            if generation == self._generation:
+                self._entries[telegram_id] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(telegram_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return dict(value)
+
+    def invalidate(self, telegram_id):
+        self.invalidate_many((telegram_id,))
+
+    def invalidate_many(self, telegram_ids):
+        with self._lock:
+            self._generation += 1
+            for telegram_id in telegram_ids:
+                self._stats['invalidations'] += 1
+                self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['listener_connected'] = listener.connected
+        return stats
+
+
+user_cache = UserCache()
+
+
+def _on_user_changed(payload):
+    try:
+        user_cache.invalidate_many([int(telegram_id) for telegram_id in payload.split(',')])
+    except ValueError:
+        user_cache.clear()
+
+
+listener.subscribe(USER_CHANGED_CHANNEL, _on_user_changed)
+listener.on_reset(user_cache.clear)
+
+
+def notify_user_changed(cur, telegram_id):
+    """Tell every process to drop its cached copy (sent on commit)"""
+    notify(cur, USER_CHANGED_CHANNEL, telegram_id)
+
+
+def notify_users_changed(cur, telegram_ids):
+    """Like notify_user_changed for many users, a few notifications in all"""
+    telegram_ids = list(telegram_ids)
+    for start in range(0, len(telegram_ids), USER_CHANGED_BATCH):
+        notify(cur, USER_CHANGED_CHANNEL, ','.join(map(str, telegram_ids[start:start + USER_CHANGED_BATCH])))
+
+
+def notify_all_users_changed(cur):
+    """Tell every process to drop its whole cache (after a bulk update)"""
+    notify(cur, USER_CHANGED_CHANNEL, '*')
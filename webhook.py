@@ -0,0 +1,162 @@
+# webhook.py
+# Runs the bot inside the web process and feeds it webhook updates
+
+import os
+import hmac
+import atexit
+import asyncio
+import hashlib
+import logging
+import threading
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Public base URL Telegram should post to, e.g. https://datrix.example.com
+# (unset: the webhook is assumed to be registered already)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', 40))
+# Seconds to wait for queued and running updates on shutdown
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get('WEBHOOK_DRAIN_TIMEOUT', 30))
+
+
+def default_secret(bot_token):
+    """Secret shared by every worker when WEBHOOK_SECRET is not set"""
+    return hashlib.sha256(f"datrix-webhook:{bot_token}".encode()).hexdigest()
+
+
+class WebhookBridge:
+    """Runs an Application on its own event loop in a daemon thread.
+
+    Web request threads hand validated webhook payloads to ``submit``,
+    which puts them on the Application's update queue. The bridge starts
+    lazily once per process (threads do not survive fork); ``stop`` stops
+    accepting, processes what is already queued and shuts the Application
+    down.
+
+    Every web worker runs its own bridge, so handlers keep no state in the
+    Application (user_data); what spans updates, like a pending /set_file,
+    lives in the database.
+    """
+
+    def __init__(self, build_application, secret, url=WEBHOOK_URL, path=WEBHOOK_PATH):
+        self.build_application = build_application
+        self.secret = secret
+        self.url = url.rstrip('/') + path if url else None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._loop = None
+        self._application = None
+        self._ready = threading.Event()
+        self._accepting = False
+        self._stats = {'received': 0, 'rejected': 0, 'invalid': 0}
+
+    def check_secret(self, token):
+        """Constant-time check of the X-Telegram-Bot-Api-Secret-Token header"""
+        return bool(token) and hmac.compare_digest(token.encode(), self.secret.encode())
+
+    def start(self, timeout=30):
+        """Start the Application for this process (idempotent)"""
+        if self._pid == os.getpid() and self._ready.is_set():
+            return self._accepting
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None:
+                self._pid = os.getpid()
+                self._ready = threading.Event()
+                self._accepting = False
+                self._stats = {'received': 0, 'rejected': 0, 'invalid': 0}
+                self._thread = threading.Thread(target=self._run, name='datrix-bot', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        self._ready.wait(timeout)
+        return self._accepting
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._startup())
+            self._accepting = True
+            logger.info(f"✅ Webhook bot started (pid {os.getpid()})")
+        except Exception as e:
+            logger.error(f"Webhook bot failed to start: {e}")
+            return
+        finally:
+            self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _startup(self):
+        self._application = self.build_application()
+        await self._application.initialize()
+        if self._application.post_init:
+            await self._application.post_init(self._application)
+        if self.url:
+            await self._application.bot.set_webhook(
+                url=self.url,
+                secret_token=self.secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=False
+            )
+        await self._application.start()
+
+    async def _teardown(self):
+        application = self._application
+        # Processes everything already on the update queue first
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def submit(self, data):
+        """Queue one webhook payload; False if this worker cannot take it"""
+        if not self.start():
+            self._count('rejected')
+            return False
+        try:
+            update = Update.de_json(data, self._application.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook update: {e}")
+            self._count('invalid')
+            return True  # a retry would not make it valid
+        try:
+            self._loop.call_soon_threadsafe(self._application.update_queue.put_nowait, update)
+        except RuntimeError:
+            # Loop already closed: let Telegram retry on another worker
+            self._count('rejected')
+            return False
+        self._count('received')
+        return True
+
+    def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Stop accepting updates, drain the queue and shut the bot down"""
+        if self._pid != os.getpid() or not self._accepting:
+            return
+        self._accepting = False
+        logger.info("🔄 Draining webhook updates...")
+        future = asyncio.run_coroutine_threadsafe(self._teardown(), self._loop)
+        try:
+            future.result(timeout)
+            logger.info("✅ Webhook bot stopped")
+        except Exception as e:
+            logger.error(f"Webhook bot shutdown failed: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['accepting'] = self._pid == os.getpid() and self._accepting
+        if stats['accepting']:
+            stats['queued'] = self._application.update_queue.qsize()
+            stats['processor'] = self._application.update_processor.stats()
+        return stats